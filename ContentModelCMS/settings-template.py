@@ -9,6 +9,55 @@ URI_REGISTER_URL = 'http://localhost:8000/uri-gin/'
 # Put the site's base URL here.
 BASE_URL = 'http://localhost:8000/'
 
+# The alias, from CACHES, of the cache that holds rendered catalog responses
+CONTENTMODELS_CACHE = 'default'
+
+# How long, in seconds, the catalog's cached revision number is trusted before it is
+#   read from the database again
+CONTENTMODELS_REVISION_TIMEOUT = 60
+
+# The number of compiled XML Schemas each process keeps for validation, and whether web
+#   server processes compile the latest content models' schemas when they start
+CONTENTMODELS_SCHEMA_CACHE_SIZE = 10
+CONTENTMODELS_WARM_SCHEMAS = False
+
+# Where local copies of remotely imported schemas are kept. Defaults to the
+#   schema-repository folder of MEDIA_ROOT.
+# CONTENTMODELS_SCHEMA_REPOSITORY = '/path/to/schemas'
+
+# The alias, from CACHES, of the cache that holds summaries of WFS GetCapabilities
+#   documents, and for how many seconds a summary is used before it is revalidated
+VALIDATION_CACHE = 'default'
+VALIDATION_CAPABILITIES_TTL = 300
+
+# Seconds to wait on a WFS before giving up on a request
+VALIDATION_HTTP_TIMEOUT = 30
+
+# Whether the WFS validation form queues a job instead of validating during the request.
+#   Queued jobs are run by "python manage.py run_validation_jobs", at most
+#   VALIDATION_JOB_CONCURRENCY at once per worker command. A running job that hasn't
+#   reported progress for VALIDATION_JOB_STALE_MINUTES is queued again.
+VALIDATION_USE_JOBS = True
+VALIDATION_JOB_CONCURRENCY = 2
+VALIDATION_JOB_STALE_MINUTES = 10
+
+# Validations of VALIDATION_PARALLEL_THRESHOLD features or more are spread over a pool of
+#   VALIDATION_PROCESSES worker processes, by default one per core. Queued jobs share
+#   the pool of the run_validation_jobs command that runs them.
+VALIDATION_PROCESSES = None
+VALIDATION_PARALLEL_THRESHOLD = 1000
+
+# The number of features requested at a time when a whole layer is validated, from a WFS
+#   that supports paging. Whole layers can only be validated as queued jobs, or in batches.
+VALIDATION_PAGE_SIZE = 1000
+
+# The number of validations a batch (validate_wfs_batch, or /validate/wfs/batch) runs at once
+VALIDATION_BATCH_CONCURRENCY = 4
+
+# Batches can be POSTed to /validate/wfs/batch by staff users, or by scripts that send
+#   this token as "Authorization: Token <token>". None only lets staff users in.
+VALIDATION_API_TOKEN = None
+
 #--------------------------------------------------------------------------------------
 
 # Django settings for ContentModelCMS project.
@@ -23,6 +23,12 @@ os.environ.setdefault("DJANGO_SETTINGS_MODULE", "ContentModelCMS.settings")
 from django.core.wsgi import get_wsgi_application
 application = get_wsgi_application()
 
+# Compile the latest content models' schemas before the first validation request needs them
+from django.conf import settings
+if getattr(settings, 'CONTENTMODELS_WARM_SCHEMAS', False):
+    from contentmodels.schemacache import warm_schema_cache
+    warm_schema_cache()
+
 # Apply WSGI middleware here.
 # from helloworld.wsgi import HelloWorldApplication
 # application = HelloWorldApplication(application)
@@ -1,10 +1,32 @@
 from django.contrib import admin
 from models import ContentModel, ModelVersion
+from uriconfigure import deferred_rewrite_sync
+
+#--------------------------------------------------------------------------------------
+# Admin views can save or delete many objects at once (inlines, the delete action),
+#   so their RewriteRule work is deferred and done once at the end of the request
+#--------------------------------------------------------------------------------------
+class DeferredRewriteSyncAdmin(admin.ModelAdmin):
+  @deferred_rewrite_sync()
+  def add_view(self, *args, **kwargs):
+    return super(DeferredRewriteSyncAdmin, self).add_view(*args, **kwargs)
+
+  @deferred_rewrite_sync()
+  def change_view(self, *args, **kwargs):
+    return super(DeferredRewriteSyncAdmin, self).change_view(*args, **kwargs)
+
+  @deferred_rewrite_sync()
+  def delete_view(self, *args, **kwargs):
+    return super(DeferredRewriteSyncAdmin, self).delete_view(*args, **kwargs)
+
+  @deferred_rewrite_sync()
+  def changelist_view(self, *args, **kwargs):
+    return super(DeferredRewriteSyncAdmin, self).changelist_view(*args, **kwargs)
 
 #--------------------------------------------------------------------------------------
 # This class defines some customizations of the admin interface for ContentModels
 #--------------------------------------------------------------------------------------
-class ContentModelAdmin(admin.ModelAdmin):
+class ContentModelAdmin(DeferredRewriteSyncAdmin):
   # The Media class defines some additional media to include with an Admin page
   #   Points to a JS and CSS file that together add a Dojo-based WYSIWYG editor
   class Media:
@@ -29,7 +51,7 @@ admin.site.register(ContentModel, ContentModelAdmin)
 #--------------------------------------------------------------------------------------
 # This class defines some customizations of the admin interface for ModelVersions  
 #--------------------------------------------------------------------------------------
-class ModelVersionAdmin(admin.ModelAdmin):
+class ModelVersionAdmin(DeferredRewriteSyncAdmin):
   # Fields to display in the table:
   list_display = ['__unicode__', 'xsd_link', 'xls_link', 'rewrite_rule_link']
   
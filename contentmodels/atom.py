@@ -0,0 +1,140 @@
+from django.db.models import Max, Count
+from django.utils import timezone
+from models import ContentModel
+from lxml import etree
+from io import BytesIO
+import re
+
+# Namespaces used in the feed
+ATOM_NS = 'http://www.w3.org/2005/Atom'
+CM_NS = 'http://schemas.usgin.org/contentmodels'
+NSMAP = { None: ATOM_NS, 'cm': CM_NS }
+
+#--------------------------------------------------------------------------------------
+# Function that strips control characters, which are not allowed anywhere in an XML 1.0
+#   document. Everything else is escaped by lxml as it is written.
+#--------------------------------------------------------------------------------------
+invalid_xml_chars = re.compile(u'[\x00-\x08\x0b\x0c\x0e-\x1f\ufffe\uffff]')
+
+def xml_text(value):
+  if value is None: return u''
+  return invalid_xml_chars.sub(u'', unicode(value))
+
+#--------------------------------------------------------------------------------------
+# Function that formats dates in the feed. ContentModel dates are days, so the time of
+#   day is fixed at noon.
+#--------------------------------------------------------------------------------------
+def atom_date(date):
+  return '%sT12:00:00-05:00' % date.isoformat()
+
+#--------------------------------------------------------------------------------------
+# Class for generating an Atom Feed. Default values as shown, can be adjusted by
+#   keyword-args on creation. The feed is written incrementally with lxml: write()
+#   yields the document a piece at a time, one entry per ContentModel.
+#--------------------------------------------------------------------------------------
+class AtomFeed(object):
+  # These are default values for feed attributes
+  title = "Content Models"
+  subtitle = "USGIN Content Models Atom Feed"
+  url = "http://schemas.usgin.org/contentmodels.xml"
+  id = "http://schemas.usgin.org/contentmodels.xml"
+  date = None
+  author_name = "Ryan Clark"
+  author_email = "metadata@usgin.org"
+
+  # Constructor function. Requires a queryset of ContentModels, maps kwargs to this
+  #   instance to overwrite defaults
+  def __init__(self, contentmodels, **kwargs):
+    self.contentmodels = contentmodels
+
+    # Loop through arguments passed in
+    for arg in kwargs:
+      # Assign them to this instance, overwriting default values
+      setattr(self, arg, kwargs[arg])
+
+    # Set date, id and url
+    self.set_date_id_and_url()
+
+  # Function to set the feed's updated date, id and url from one aggregate query over the
+  #   ContentModels passed in. The date is the latest of their indexed last_updated dates.
+  #   A feed containing only one ContentModel takes that ContentModel's id and url.
+  def set_date_id_and_url(self):
+    summary = ContentModel.objects.filter(pk__in=self.contentmodels.values('pk')).aggregate(
+        date=Max('last_updated'), number_of_models=Count('pk'), last_pk=Max('pk')
+      )
+
+    if summary['date'] is not None: self.date = atom_date(summary['date'])
+    elif self.date is None: self.date = timezone.now().isoformat()
+
+    if summary['number_of_models'] == 1:
+      single = ContentModel(pk=summary['last_pk'])
+      self.url = single.my_atom()
+      self.id = single.my_atom()
+
+  # Generator that writes the feed, yielding the serialized XML as it goes
+  def write(self):
+    buffer = BytesIO()
+    with etree.xmlfile(buffer, encoding='utf-8') as xf:
+      xf.write_declaration()
+      with xf.element(atom('feed'), nsmap=NSMAP):
+        write_text(xf, atom('title'), self.title)
+        write_text(xf, atom('subtitle'), self.subtitle)
+        with xf.element(atom('link'), href=xml_text(self.url), rel='self'): pass
+        write_text(xf, atom('updated'), self.date)
+        with xf.element(atom('author')):
+          write_text(xf, atom('name'), self.author_name)
+          write_text(xf, atom('email'), self.author_email)
+        write_text(xf, atom('id'), self.id)
+
+        # Hand back each entry as soon as it has been written
+        for cm in self.contentmodels:
+          self.write_entry(xf, cm)
+          xf.flush()
+          yield drain(buffer)
+    yield drain(buffer)
+
+  # Function to write the entry for one ContentModel
+  def write_entry(self, xf, cm):
+    updated = cm.date_updated()
+    updated = atom_date(updated) if updated is not None else self.date
+
+    with xf.element(atom('entry')):
+      write_text(xf, atom('title'), cm.title)
+      with xf.element(atom('link'), rel='alternate', href=xml_text(cm.my_html())): pass
+      write_text(xf, atom('updated'), updated)
+      write_text(xf, atom('id'), cm.absolute_uri())
+      with xf.element(atom('content'), type='application/xml'):
+        write_text(xf, cm_tag('title'), cm.title)
+        write_text(xf, cm_tag('uri'), cm.absolute_uri())
+        write_text(xf, cm_tag('lastupdate'), updated)
+        write_text(xf, cm_tag('description'), cm.sanitized_description)
+        write_text(xf, cm_tag('discussion'), cm.sanitized_discussion)
+        write_text(xf, cm_tag('status'), cm.sanitized_status)
+        with xf.element(cm_tag('versions')):
+          for v in cm.versions():
+            with xf.element(cm_tag('version')):
+              write_text(xf, cm_tag('number'), v.version)
+              write_text(xf, cm_tag('uri'), v.absolute_uri())
+              write_text(xf, cm_tag('created'), atom_date(v.date_created))
+              write_text(xf, cm_tag('xlsfile'), v.absolute_xls_path())
+              write_text(xf, cm_tag('xsdfile'), v.absolute_xsd_path())
+              write_text(xf, cm_tag('wfsexample'), v.sample_wfs_request)
+
+#--------------------------------------------------------------------------------------
+# Utility functions for writing the feed
+#--------------------------------------------------------------------------------------
+def atom(tag):
+  return '{%s}%s' % (ATOM_NS, tag)
+
+def cm_tag(tag):
+  return '{%s}%s' % (CM_NS, tag)
+
+def write_text(xf, tag, text):
+  with xf.element(tag):
+    xf.write(xml_text(text))
+
+def drain(buffer):
+  written = buffer.getvalue()
+  buffer.seek(0)
+  buffer.truncate()
+  return written
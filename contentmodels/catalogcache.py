@@ -0,0 +1,268 @@
+from django.core.cache import get_cache
+from django.conf import settings
+from django.http import HttpResponse
+from django.utils.cache import patch_vary_headers
+from functools import wraps
+from gzip import GzipFile
+from io import BytesIO
+import threading, time
+
+# Brotli compression is used when the brotli package is installed
+try:
+  import brotli
+except ImportError:
+  brotli = None
+
+# The extensions that catalog responses are rendered in. Needs to be in sync with urls.py.
+EXTENSIONS = ['json', 'html', 'xml', 'drupal']
+
+# Cache keys for the catalog's revision and the hit/miss counters
+REVISION_KEY = 'contentmodels:revision'
+HITS_KEY = 'contentmodels:hits'
+MISSES_KEY = 'contentmodels:misses'
+
+# How long, in seconds, the cached CatalogRevision is trusted. Invalidation made outside
+#   of deferred_rewrite_sync() happens before the change is committed, so a request
+#   served meanwhile can cache the revision from before; this bounds how long it lasts.
+REVISION_TIMEOUT = 60
+
+#--------------------------------------------------------------------------------------
+# Utility function to retrieve the cache backend that holds rendered catalog responses.
+#   The backend is chosen by the CONTENTMODELS_CACHE setting, an alias from CACHES.
+#--------------------------------------------------------------------------------------
+def get_catalog_cache():
+  return get_cache(getattr(settings, 'CONTENTMODELS_CACHE', 'default'))
+
+#--------------------------------------------------------------------------------------
+# Function to build the cache key for a rendered response
+#   endpoint is 'all' for contentmodels.* or 'model' for contentmodel/<id>.*
+#   revision is the number of the CatalogRevision the response was rendered at, so that
+#   a response rendered before a change, but stored after it, is never served
+#--------------------------------------------------------------------------------------
+def response_key(endpoint, id, extension, revision):
+  return 'contentmodels:response:%s:%s:%s:%s' % (revision, endpoint, id, extension)
+
+# Function to read the number of the catalog's current revision, through the cache
+def revision_number():
+  from models import CatalogRevision
+  return cached_revision(CatalogRevision).number
+
+# The ids in contentmodel/<id>.* URLs can have leading zeros, which are dropped so that
+#   every spelling of an id shares one cache entry
+def normalized_id(id):
+  if id is None or id == '': return id
+  return str(int(id))
+
+#--------------------------------------------------------------------------------------
+# Functions to count cache hits and misses. Counters live in the cache backend itself,
+#   so that every process serving the catalog contributes to the same numbers.
+#--------------------------------------------------------------------------------------
+def count(key):
+  cache = get_catalog_cache()
+  cache.add(key, 0)
+  try:
+    cache.incr(key)
+
+  # This exception is thrown if the counter was evicted between add() and incr()
+  except ValueError:
+    cache.set(key, 1)
+
+def stats():
+  cache = get_catalog_cache()
+  hits = cache.get(HITS_KEY, 0)
+  misses = cache.get(MISSES_KEY, 0)
+  requests = hits + misses
+  return {
+    'hits': hits,
+    'misses': misses,
+    'hit_ratio': float(hits) / requests if requests > 0 else None
+  }
+
+def reset_stats():
+  get_catalog_cache().delete_many([HITS_KEY, MISSES_KEY])
+
+#--------------------------------------------------------------------------------------
+# Functions to compress responses. Compressed variants are made once, when a response is
+#   stored in the cache, and live alongside the uncompressed content until the catalog
+#   changes. Each variant records its size and how long it took to compress.
+#--------------------------------------------------------------------------------------
+def gzip_compress(content):
+  buffer = BytesIO()
+  with GzipFile(fileobj=buffer, mode='wb', compresslevel=9, mtime=0) as f:
+    f.write(content)
+  return buffer.getvalue()
+
+def compressors():
+  available = { 'gzip': gzip_compress }
+  if brotli is not None: available['br'] = brotli.compress
+  return available
+
+def compressed_variants(content):
+  variants = {}
+  for encoding, compress in compressors().items():
+    started = time.time()
+    compressed = compress(content)
+    seconds = time.time() - started
+
+    # Small responses can grow when compressed. Don't keep those variants.
+    if len(compressed) < len(content):
+      variants[encoding] = { 'content': compressed, 'size': len(compressed), 'seconds': seconds }
+  return variants
+
+#--------------------------------------------------------------------------------------
+# Function to choose among the available encodings using the request's Accept-Encoding
+#   header. Brotli is preferred over gzip. Returns None if the content should be sent
+#   uncompressed.
+#--------------------------------------------------------------------------------------
+def choose_encoding(request, available):
+  accepted = {}
+  for coding in request.META.get('HTTP_ACCEPT_ENCODING', '').split(','):
+    parts = coding.strip().split(';')
+    quality = 1.0
+    for param in parts[1:]:
+      if param.strip().startswith('q='):
+        try: quality = float(param.strip()[2:])
+        except ValueError: quality = 0.0
+    accepted[parts[0].strip().lower()] = quality
+
+  for encoding in ['br', 'gzip']:
+    quality = accepted.get(encoding, accepted.get('*', 0.0))
+    if encoding in available and quality > 0: return encoding
+  return None
+
+#--------------------------------------------------------------------------------------
+# Function to build a response from a cache entry, in the best encoding for the request
+#--------------------------------------------------------------------------------------
+def response_from_entry(request, entry):
+  variants = entry.get('variants', {})
+  encoding = choose_encoding(request, variants)
+  if encoding is None:
+    response = HttpResponse(entry['content'], content_type=entry['content_type'])
+  else:
+    response = HttpResponse(variants[encoding]['content'], content_type=entry['content_type'])
+    response['Content-Encoding'] = encoding
+  response['Content-Length'] = str(len(response.content))
+  patch_vary_headers(response, ['Accept-Encoding'])
+  return response
+
+#--------------------------------------------------------------------------------------
+# Function to describe the cached variants of a response, or None if it isn't cached
+#   at the catalog's current revision
+#--------------------------------------------------------------------------------------
+def describe_entry(endpoint, id, extension):
+  entry = get_catalog_cache().get(response_key(endpoint, normalized_id(id), extension, revision_number()))
+  if entry is None: return None
+  description = { 'identity': { 'size': len(entry['content']), 'seconds': 0.0 } }
+  for encoding, variant in entry.get('variants', {}).items():
+    description[encoding] = { 'size': variant['size'], 'seconds': variant['seconds'] }
+  return description
+
+#--------------------------------------------------------------------------------------
+# Decorator for views that render catalog responses. Successful responses are stored by
+#   (catalog revision, endpoint, id, extension), with compressed variants, and served
+#   from the cache until the catalog changes. Requests with query parameters (paged or
+#   streamed JSON) are not cached.
+#--------------------------------------------------------------------------------------
+def cached_catalog_response(endpoint):
+  def decorator(view):
+    @wraps(view)
+    def cached_view(request, **kwargs):
+      if len(request.GET) > 0: return view(request, **kwargs)
+
+      # Serve the response from the cache if it is there. The revision is read before
+      #   rendering, so a change made meanwhile files the response under a stale key.
+      cache = get_catalog_cache()
+      key = response_key(endpoint, normalized_id(kwargs.get('id')), kwargs['extension'], revision_number())
+      cached = cache.get(key)
+      if cached is not None:
+        count(HITS_KEY)
+        return response_from_entry(request, cached)
+
+      # Otherwise render it, and keep it if it worked out
+      count(MISSES_KEY)
+      response = view(request, **kwargs)
+      if response.status_code != 200: return response
+      
+      content = response.content
+      entry = {
+        'content': content,
+        'content_type': response['Content-Type'],
+        'variants': compressed_variants(content)
+      }
+      cache.set(key, entry)
+      return response_from_entry(request, entry)
+    return cached_view
+  return decorator
+
+#--------------------------------------------------------------------------------------
+# Function to retrieve the catalog's CatalogRevision through the cache, so that
+#   conditional GETs are answered without touching the database
+#--------------------------------------------------------------------------------------
+def cached_revision(revision_model):
+  cache = get_catalog_cache()
+  revision = cache.get(REVISION_KEY)
+  if revision is None:
+    revision = revision_model.current()
+    cache.set(REVISION_KEY, revision, getattr(settings, 'CONTENTMODELS_REVISION_TIMEOUT', REVISION_TIMEOUT))
+  return revision
+
+# Function to drop the cached CatalogRevision, after it was bumped other than by the
+#   signals below
+def forget_cached_revision():
+  if deferring(): pending_invalidation().revision = True
+  else: get_catalog_cache().delete(REVISION_KEY)
+
+#--------------------------------------------------------------------------------------
+# Invalidation signalled inside deferred_rewrite_sync(), which wraps the admin's views,
+#   is held back until the outermost block exits, after the view's transaction has been
+#   committed. Dropped earlier, the cached revision could be read again by a concurrent
+#   request before the change is visible to it, and cached under the old number.
+#--------------------------------------------------------------------------------------
+_pending = threading.local()
+
+def pending_invalidation():
+  if not hasattr(_pending, "content_models"):
+    _pending.content_models = set()
+    _pending.revision = False
+  return _pending
+
+def deferring():
+  from uriconfigure import pending_work
+  return pending_work().depth > 0
+
+# Function that does the held back invalidation. It is called by deferred_rewrite_sync().
+def flush_invalidation():
+  pending = pending_invalidation()
+  content_model_ids = list(pending.content_models)
+  revision = pending.revision
+  pending.content_models.clear()
+  pending.revision = False
+  if len(content_model_ids) > 0: drop_cached_responses(content_model_ids)
+  elif revision: get_catalog_cache().delete(REVISION_KEY)
+
+#--------------------------------------------------------------------------------------
+# This function drops the cached revision after a change to a ContentModel or
+#   ModelVersion, so that responses are looked up under the new one, and removes the
+#   responses that the change made stale: the whole catalog, and the changed
+#   ContentModel, as cached at the revision before. It is registered in models.py and
+#   called after an object is saved or deleted.
+#   sender is a reference to the class of object that changed
+#   instance is the object that changed
+#--------------------------------------------------------------------------------------
+def invalidate_cached_responses(sender, instance, **kwargs):
+  # Find the ContentModel that was affected by the change
+  if sender.__name__ == 'ModelVersion': content_model_id = instance.content_model_id
+  else: content_model_id = instance.pk
+
+  if deferring(): pending_invalidation().content_models.add(content_model_id)
+  else: drop_cached_responses([content_model_id])
+
+def drop_cached_responses(content_model_ids):
+  cache = get_catalog_cache()
+  keys = [ REVISION_KEY ]
+  stale = cache.get(REVISION_KEY)
+  if stale is not None:
+    keys += [ response_key('all', None, extension, stale.number) for extension in EXTENSIONS ]
+    for content_model_id in content_model_ids:
+      keys += [ response_key('model', str(content_model_id), extension, stale.number) for extension in EXTENSIONS ]
+  cache.delete_many(keys)
@@ -0,0 +1,59 @@
+from collections import OrderedDict
+import threading
+
+#--------------------------------------------------------------------------------------
+# Class for a bounded, thread-safe, least-recently-used cache living in this process.
+#   Once max_size entries are stored, adding another drops the one used longest ago.
+#   Hits and misses are counted, so the cache's usefulness can be checked.
+#--------------------------------------------------------------------------------------
+class LRUCache(object):
+  def __init__(self, max_size):
+    self.max_size = max_size
+    self.entries = OrderedDict()
+    self.lock = threading.Lock()
+    self.hits = 0
+    self.misses = 0
+
+  # Return the value stored for key, or default if there isn't one
+  def get(self, key, default=None):
+    with self.lock:
+      try:
+        value = self.entries.pop(key)
+      except KeyError:
+        self.misses += 1
+        return default
+
+      # Move the entry to the most recently used end
+      self.entries[key] = value
+      self.hits += 1
+      return value
+
+  def set(self, key, value):
+    with self.lock:
+      self.entries.pop(key, None)
+      self.entries[key] = value
+      while len(self.entries) > self.max_size:
+        self.entries.popitem(last=False)
+
+  def delete(self, key):
+    with self.lock:
+      self.entries.pop(key, None)
+
+  def clear(self):
+    with self.lock:
+      self.entries.clear()
+      self.hits = 0
+      self.misses = 0
+
+  def __len__(self):
+    return len(self.entries)
+
+  def stats(self):
+    requests = self.hits + self.misses
+    return {
+      'size': len(self.entries),
+      'max_size': self.max_size,
+      'hits': self.hits,
+      'misses': self.misses,
+      'hit_ratio': float(self.hits) / requests if requests > 0 else None
+    }
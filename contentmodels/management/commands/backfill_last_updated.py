@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Max
+from django.db import transaction
+from contentmodels.models import ContentModel, ModelVersion
+
+#--------------------------------------------------------------------------------------
+# Command to fill in ContentModel.last_updated for rows that existed before the column
+#   was added. Safe to run again at any time: every row ends up matching its versions.
+#   Usage: python manage.py backfill_last_updated
+#--------------------------------------------------------------------------------------
+class Command(BaseCommand):
+  help = 'Set every ContentModel\'s last_updated to the created date of its latest version'
+  
+  @transaction.commit_on_success
+  def handle(self, *args, **options):
+    # Find the latest version date for every ContentModel that has versions, in one query
+    latest = ModelVersion.objects.values('content_model').annotate(latest=Max('date_created'))
+    
+    # ContentModels without versions have no last_updated
+    ContentModel.objects.filter(modelversion__isnull=True).update(last_updated=None)
+    
+    # Group the ContentModels by date, so there is one UPDATE per distinct date
+    by_date = {}
+    for row in latest: by_date.setdefault(row['latest'], []).append(row['content_model'])
+    for date, pks in by_date.items():
+      ContentModel.objects.filter(pk__in=pks).update(last_updated=date)
+    
+    self.stdout.write('Updated %s content models\n' % ContentModel.objects.count())
@@ -0,0 +1,49 @@
+from django.core.management.base import BaseCommand
+from optparse import make_option
+from contentmodels.resolver import best_mime_type, negotiation_cache
+import mimeparse, time
+
+# The mime types of a ModelVersion's AcceptMappings, in the order uriconfigure.py makes them
+MIME_TYPES = ('application/vnd.ms-excel', 'application/xml', 'text/html', 'text/json')
+
+# Accept headers sent by browsers, crawlers and GIS clients
+ACCEPT_HEADERS = [
+  'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
+  'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,image/apng,*/*;q=0.8',
+  '*/*',
+  'application/xml',
+  'application/json, text/javascript, */*; q=0.01',
+  'text/xml, application/xml;q=0.9, text/html;q=0.5, */*;q=0.1',
+]
+
+#--------------------------------------------------------------------------------------
+# Command to measure what content negotiation for dataschema URIs costs per request,
+#   parsing the Accept header every time and with the LRU cache of resolver.py.
+#   Usage: python manage.py benchmark_negotiation [--requests=<n>]
+#--------------------------------------------------------------------------------------
+class Command(BaseCommand):
+  help = 'Measure the cost of content negotiation for dataschema URIs, with and without caching'
+  option_list = BaseCommand.option_list + (
+    make_option('--requests', type='int', dest='requests', default=100000,
+      help='The number of negotiations to time'),
+  )
+  
+  def handle(self, *args, **options):
+    headers = [ ACCEPT_HEADERS[i % len(ACCEPT_HEADERS)] for i in range(options['requests']) ]
+    
+    started = time.time()
+    for header in headers: mimeparse.best_match(list(MIME_TYPES), header)
+    uncached = time.time() - started
+    
+    negotiation_cache.clear()
+    started = time.time()
+    for header in headers: best_mime_type(MIME_TYPES, header)
+    cached = time.time() - started
+    
+    stats = negotiation_cache.stats()
+    negotiation_cache.clear()
+    
+    self.stdout.write('Negotiated %s requests with %s distinct Accept headers\n' % (len(headers), len(ACCEPT_HEADERS)))
+    self.stdout.write('Parsing every header: %.2f microseconds per request\n' % (uncached * 1000000 / len(headers)))
+    self.stdout.write('With the LRU cache: %.2f microseconds per request\n' % (cached * 1000000 / len(headers)))
+    self.stdout.write('Cache hit ratio: %.4f\n' % stats['hit_ratio'])
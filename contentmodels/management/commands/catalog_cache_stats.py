@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand
+from optparse import make_option
+from contentmodels import catalogcache
+
+#--------------------------------------------------------------------------------------
+# Command to report how well the rendered-response cache for the catalog is doing
+#   Usage: python manage.py catalog_cache_stats [--reset]
+#--------------------------------------------------------------------------------------
+class Command(BaseCommand):
+  help = 'Report hit and miss counts for the cache of rendered catalog responses'
+  option_list = BaseCommand.option_list + (
+    make_option('--reset', action='store_true', dest='reset', default=False,
+      help='Set the counters back to zero after reporting them'),
+  )
+  
+  def handle(self, *args, **options):
+    stats = catalogcache.stats()
+    self.stdout.write('Hits: %s\n' % stats['hits'])
+    self.stdout.write('Misses: %s\n' % stats['misses'])
+    if stats['hit_ratio'] is not None:
+      self.stdout.write('Hit ratio: %.1f%%\n' % (stats['hit_ratio'] * 100))
+    
+    # Report the sizes of the cached whole-catalog documents and their compressed variants
+    for extension in catalogcache.EXTENSIONS:
+      variants = catalogcache.describe_entry('all', None, extension)
+      if variants is None: continue
+      identity = variants['identity']['size']
+      for encoding, variant in sorted(variants.items()):
+        self.stdout.write('contentmodels.%s %s: %s bytes (%.0f%%), compressed in %.1f ms\n' % (
+            extension, encoding, variant['size'], 100.0 * variant['size'] / identity, variant['seconds'] * 1000
+          ))
+    
+    if options['reset']:
+      catalogcache.reset_stats()
+      self.stdout.write('Counters reset\n')
@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand, CommandError
+from optparse import make_option
+from contentmodels.snapshot import export_catalog
+import time
+
+#--------------------------------------------------------------------------------------
+# Command to write every representation of the catalog to static files, so that a
+#   front-end web server can serve them without Django.
+#   Usage: python manage.py export_catalog <output directory> [--changed]
+#--------------------------------------------------------------------------------------
+class Command(BaseCommand):
+  args = '<output directory>'
+  help = 'Write a static snapshot of the catalog. The output path becomes a link to the snapshot.'
+  option_list = BaseCommand.option_list + (
+    make_option('--changed', action='store_true', dest='changed', default=False,
+      help='Only render the files of ContentModels that changed since the last export'),
+  )
+  
+  def handle(self, *args, **options):
+    if len(args) != 1: raise CommandError('Usage: export_catalog %s' % self.args)
+    
+    started = time.time()
+    try:
+      result = export_catalog(args[0], changed_only=options['changed'])
+    except ValueError, err:
+      raise CommandError(err)
+    
+    self.stdout.write('Snapshot: %s\n' % result['snapshot'])
+    self.stdout.write('Rendered %s files, linked %s unchanged files, %s changed content models\n' % (
+        result['rendered'], result['linked'], len(result['changed_models'])
+      ))
+    self.stdout.write('Finished in %.3f seconds\n' % (time.time() - started))
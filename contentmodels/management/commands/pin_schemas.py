@@ -0,0 +1,61 @@
+from django.core.management.base import BaseCommand, CommandError
+from optparse import make_option
+from contentmodels.models import ModelVersion
+from contentmodels.schemarepository import pin_schemas, verify_catalog, schema_locations, compile_offline, is_remote, repository_path
+from lxml import etree
+import urllib2, time
+
+#--------------------------------------------------------------------------------------
+# Command to copy the remote schemas that content models import into the schema
+#   repository, so that schemas compile without network access. With no URLs, every
+#   remote schema imported by an uploaded XSD is pinned.
+#   Usage: python manage.py pin_schemas [<url> ...] [--refresh] [--verify]
+#--------------------------------------------------------------------------------------
+class Command(BaseCommand):
+  args = '[<schema url> ...]'
+  help = 'Fetch remote schemas, and the schemas they import, into the local schema repository'
+  option_list = BaseCommand.option_list + (
+    make_option('--refresh', action='store_true', dest='refresh', default=False,
+      help='Fetch schemas again even if they have been pinned'),
+    make_option('--verify', action='store_true', dest='verify', default=False,
+      help='Instead of fetching, check the pinned files and compile every ModelVersion offline'),
+  )
+  
+  def handle(self, *args, **options):
+    if options['verify']: return self.verify()
+    
+    started = time.time()
+    urls = list(args) if len(args) > 0 else self.imported_urls()
+    try:
+      fetched = pin_schemas(urls, refresh=options['refresh'])
+    except (urllib2.URLError, IOError, etree.XMLSyntaxError), err:
+      raise CommandError('Could not pin schemas: %s' % err)
+    
+    for url in fetched: self.stdout.write('Pinned %s\n' % url)
+    self.stdout.write('Pinned %s schemas into %s in %.3f seconds\n' % (len(fetched), repository_path(), time.time() - started))
+  
+  # Function to find the remote schemas imported by uploaded XSD files
+  def imported_urls(self):
+    urls = []
+    for version in ModelVersion.objects.all():
+      try:
+        root = etree.parse(version.xsd_file.path, etree.XMLParser(no_network=True)).getroot()
+      except (IOError, etree.XMLSyntaxError), err:
+        self.stdout.write('Skipping %s: %s\n' % (version, err))
+        continue
+      urls += [ url for url in schema_locations(root, version.xsd_file.path) if is_remote(url) and url not in urls ]
+    return urls
+  
+  def verify(self):
+    problems = verify_catalog()
+    compiled = 0
+    for version in ModelVersion.objects.all():
+      try:
+        compile_offline(version.xsd_file.path, strict=True)
+        compiled += 1
+      except (IOError, etree.Error), err:
+        problems.append('%s: %s' % (version, err))
+    
+    for problem in problems: self.stdout.write('%s\n' % problem)
+    self.stdout.write('%s schemas compiled offline, %s problems\n' % (compiled, len(problems)))
+    if len(problems) > 0: raise CommandError('The schema repository is incomplete')
@@ -0,0 +1,101 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from optparse import make_option
+from itertools import islice
+from contentmodels.models import ContentModel, CatalogRevision
+from contentmodels.catalogcache import forget_cached_revision
+from contentmodels.uriconfigure import new_report, sync_saved_instances, clear_lookup_cache, pending_work, MANAGED_MEDIA
+import time
+
+#--------------------------------------------------------------------------------------
+# Command to bring every RewriteRule and AcceptMapping up to date, for instance after
+#   BASE_URL or URI_REGISTER_LABEL has changed. Rules are synced a batch of
+#   ContentModels at a time, along with all of their versions, and only what differs
+#   is written. If anything was, the catalog's revision is bumped, so that web
+#   processes rebuild their index of the rules.
+#   Usage: python manage.py rebuild_rewrite_rules [--dry-run] [--batch-size=<n>]
+#--------------------------------------------------------------------------------------
+class Command(BaseCommand):
+  help = 'Recompute the RewriteRules and AcceptMappings of every ContentModel and ModelVersion'
+  option_list = BaseCommand.option_list + (
+    make_option('--dry-run', action='store_true', dest='dry_run', default=False,
+      help='List the changes that would be made, without making them'),
+    make_option('--batch-size', type='int', dest='batch_size', default=200,
+      help='The number of ContentModels to sync at once'),
+  )
+  
+  @transaction.commit_manually
+  def handle(self, *args, **options):
+    # The rules are changed by uriconfigure, not by hand, so the changes don't each bump
+    #   the revision (see resolver.py); it is bumped once at the end
+    work = pending_work()
+    work.syncing = True
+    try:
+      report = self.rebuild(options['dry_run'], options['batch_size'])
+    except:
+      transaction.rollback()
+      clear_lookup_cache()
+      raise
+    finally:
+      work.syncing = False
+    
+    # A dry run may still have created the register or media types it compared against
+    if options['dry_run']:
+      extensions = dict(( media_type.pk, media_type.file_extension ) for media_type in MANAGED_MEDIA())
+      transaction.rollback()
+      clear_lookup_cache()
+      self.write_changes(report, extensions)
+    else:
+      transaction.commit()
+      if any(len(changes) > 0 for changes in report.values()):
+        CatalogRevision.bump()
+        transaction.commit()
+        forget_cached_revision()
+  
+  def rebuild(self, dry_run, batch_size):
+    started = time.time()
+    report = new_report()
+    total = ContentModel.objects.count()
+    models = 0
+    versions = 0
+    
+    content_models = ContentModel.objects.with_catalog_data().in_batches(batch_size)
+    batch = list(islice(content_models, batch_size))
+    while len(batch) > 0:
+      batch_versions = [ version for cm in batch for version in cm.versions() ]
+      sync_saved_instances(batch, 'ContentModel', report, dry_run)
+      sync_saved_instances(batch_versions, 'ModelVersion', report, dry_run)
+      
+      models += len(batch)
+      versions += len(batch_versions)
+      self.stdout.write('Synced %s of %s content models (%s versions) in %.3f seconds\n' % (
+          models, total, versions, time.time() - started
+        ))
+      batch = list(islice(content_models, batch_size))
+    
+    self.stdout.write('%s %s content models and %s versions in %.3f seconds\n' % (
+        'Checked' if dry_run else 'Rebuilt', models, versions, time.time() - started
+      ))
+    self.stdout.write('Rules: %s created, %s fields updated\n' % (
+        len(report['rules_created']), len(report['rules_updated'])
+      ))
+    self.stdout.write('Mappings: %s created, %s updated, %s deleted\n' % (
+        len(report['mappings_created']), len(report['mappings_updated']), len(report['mappings_deleted'])
+      ))
+    return report
+  
+  # Function to list every change in a report
+  #   extensions is a dictionary of MediaType pk -> file extension
+  def write_changes(self, report, extensions):
+    def rule(pk): return 'new rule' if pk is None else 'rule %s' % pk
+    
+    for label, in report['rules_created']:
+      self.stdout.write('+ rule "%s"\n' % label)
+    for label, field, old, new in report['rules_updated']:
+      self.stdout.write('~ rule "%s" %s: %s -> %s\n' % (label, field, old, new))
+    for rule_pk, media_type_pk, url in report['mappings_created']:
+      self.stdout.write('+ %s %s: %s\n' % (rule(rule_pk), extensions.get(media_type_pk), url))
+    for rule_pk, media_type_pk, old, new in report['mappings_updated']:
+      self.stdout.write('~ %s %s: %s -> %s\n' % (rule(rule_pk), extensions.get(media_type_pk), old, new))
+    for rule_pk, media_type_pk, url in report['mappings_deleted']:
+      self.stdout.write('- %s %s: %s\n' % (rule(rule_pk), extensions.get(media_type_pk), url))
@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from contentmodels.models import ContentModel, SearchTerm
+from contentmodels.searchindex import weighted_terms
+
+# The number of ContentModels to load at once
+BATCH_SIZE = 100
+
+#--------------------------------------------------------------------------------------
+# Command to rebuild the whole search index from scratch. The index is kept in sync as
+#   ContentModels are saved; this is for filling it the first time, or after the
+#   tokenizer or weights in searchindex.py change.
+#   Usage: python manage.py rebuild_search_index
+#--------------------------------------------------------------------------------------
+class Command(BaseCommand):
+  help = 'Rebuild the search index for every ContentModel'
+  
+  @transaction.commit_on_success
+  def handle(self, *args, **options):
+    SearchTerm.objects.all().delete()
+    models = 0
+    terms = 0
+    for cm in ContentModel.objects.with_catalog_data().in_batches(BATCH_SIZE):
+      rows = [ SearchTerm(term=term, content_model=cm, weight=weight) for term, weight in weighted_terms(cm).items() ]
+      SearchTerm.objects.bulk_create(rows)
+      models += 1
+      terms += len(rows)
+    self.stdout.write('Indexed %s terms in %s content models\n' % (terms, models))
@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from contentmodels.models import ContentModel, CatalogRevision
+from contentmodels.catalogcache import invalidate_cached_responses
+
+# The number of ContentModels to load at once
+BATCH_SIZE = 100
+
+#--------------------------------------------------------------------------------------
+# Command to recompute the stored, sanitized copies of every ContentModel's description,
+#   discussion and status. Run it whenever the rules in models.removeTags change.
+#   Only rows whose sanitized text actually changes are written.
+#   Usage: python manage.py resanitize
+#--------------------------------------------------------------------------------------
+class Command(BaseCommand):
+  help = 'Re-sanitize the description, discussion and status of every ContentModel'
+  
+  @transaction.commit_on_success
+  def handle(self, *args, **options):
+    fields = ['sanitized_description', 'sanitized_discussion', 'sanitized_status']
+    checked = 0
+    changed = []
+    
+    for cm in ContentModel.objects.all().in_batches(BATCH_SIZE):
+      checked += 1
+      stored = [ getattr(cm, field) for field in fields ]
+      cm.sanitize()
+      sanitized = [ getattr(cm, field) for field in fields ]
+      
+      # Write the new text without save(), which would redo all of the save-time work
+      if sanitized != stored:
+        ContentModel.objects.filter(pk=cm.pk).update(**dict(zip(fields, sanitized)))
+        changed.append(cm)
+    
+    # Let the catalog's caches know about the changes
+    if len(changed) > 0:
+      CatalogRevision.bump()
+      for cm in changed: invalidate_cached_responses(ContentModel, cm)
+      
+    self.stdout.write('Checked %s content models, updated %s\n' % (checked, len(changed)))
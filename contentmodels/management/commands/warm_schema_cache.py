@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+from contentmodels.schemacache import warm_schema_cache
+import time
+
+#--------------------------------------------------------------------------------------
+# Command to compile the XML Schema of every ContentModel's latest version, reporting
+#   how long each took and any that fail to compile. The compiled schemas only live in
+#   the process that compiles them: to have web server processes compile them when they
+#   start, set CONTENTMODELS_WARM_SCHEMAS = True in settings.py.
+#   Usage: python manage.py warm_schema_cache
+#--------------------------------------------------------------------------------------
+class Command(BaseCommand):
+  help = 'Compile the XML Schema of the latest version of every ContentModel'
+  
+  def handle(self, *args, **options):
+    started = time.time()
+    compiled = warm_schema_cache()
+    failed = 0
+    for version, seconds, error in compiled:
+      if error is None:
+        self.stdout.write('%s: compiled in %.3f seconds\n' % (version, seconds))
+      else:
+        failed += 1
+        self.stdout.write('%s: failed to compile: %s\n' % (version, error))
+    self.stdout.write('Compiled %s schemas, %s failed, in %.3f seconds\n' % (
+        len(compiled) - failed, failed, time.time() - started
+      ))
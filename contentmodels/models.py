@@ -1,11 +1,15 @@
 from django.db import models
+from django.db.models import Max, Q, F
+from django.utils import timezone
 from django.conf import settings
 from django.template.defaultfilters import slugify
 from django.db.models.signals import pre_save, post_save, post_delete
 #from django.dispatch import receiver
 from uriconfigure import adjust_rewrite_rule, delete_rewrite_rule, update_related_rewrite_rules, RewriteRule
+from catalogcache import invalidate_cached_responses
+from searchindex import tokenize, weighted_terms, MAX_TERM_LENGTH
+from schemacache import cached_schema, forget_compiled_schema
 from os import path
-from lxml import etree
 import re
 
 #--------------------------------------------------------------------------------------
@@ -16,10 +20,53 @@ def get_file_path(instance, filename):
   return '%s/%s/%s' % (instance.content_model.folder_path(), instance.version, filename)
   
 #--------------------------------------------------------------------------------------
-# Function that strips HTML tags (except anchors) from strings     
+# Function that strips HTML tags (except anchors) and non-breaking spaces from strings.
+#   ContentModels store the result when they are saved: if these rules change, run
+#   python manage.py resanitize to bring the stored text up to date.
 #--------------------------------------------------------------------------------------
+tags_to_remove = re.compile(r'<(?!a[\s>]|/a\s*>)[^>]*>|&nbsp;', re.IGNORECASE)
+
 def removeTags(string_to_clean):
-  return re.sub('</(?!a)[^>]*>|<[^/a][^>]*>|&nbsp;', '', string_to_clean)
+  return tags_to_remove.sub('', string_to_clean)
+
+#--------------------------------------------------------------------------------------
+# QuerySet for ContentModels that knows how to load everything the catalog views need
+#   in a fixed number of queries: the latest version date is annotated onto each row,
+#   and every model's versions are prefetched in one additional query.
+#--------------------------------------------------------------------------------------
+class ContentModelQuerySet(models.query.QuerySet):
+  def with_catalog_data(self):
+    return self.annotate(latest_version_date=Max('modelversion__date_created')).prefetch_related('modelversion_set')
+  
+  # Order the ContentModels by title, with the primary key breaking ties. This gives every
+  #   row a unique position, which is what the keyset filter in after() relies upon.
+  def in_catalog_order(self):
+    return self.order_by('title', 'pk')
+  
+  # Filter to the ContentModels that come after the given one in catalog order
+  def after(self, content_model):
+    return self.filter(Q(title__gt=content_model.title) | Q(title=content_model.title, pk__gt=content_model.pk))
+  
+  # Iterate over the ContentModels in catalog order, fetching batch_size of them at a time.
+  #   Only one batch is held in memory at once, however large the catalog gets.
+  def in_batches(self, batch_size):
+    queryset = self.in_catalog_order()
+    batch = list(queryset[:batch_size])
+    while len(batch) > 0:
+      for cm in batch: yield cm
+      if len(batch) < batch_size: break
+      batch = list(queryset.after(batch[-1])[:batch_size])
+
+#--------------------------------------------------------------------------------------
+# Manager exposing the ContentModelQuerySet, so ContentModel.objects.with_catalog_data()
+#   and ContentModel.objects.filter(...).with_catalog_data() both work
+#--------------------------------------------------------------------------------------
+class ContentModelManager(models.Manager):
+  def get_query_set(self):
+    return ContentModelQuerySet(self.model, using=self._db)
+  
+  def with_catalog_data(self):
+    return self.get_query_set().with_catalog_data()
 
 #--------------------------------------------------------------------------------------
 # This class represent specific USGIN content-models, which are built to convey
@@ -36,16 +83,31 @@ class ContentModel(models.Model):
   discussion = models.TextField(blank=True)
   status = models.TextField(blank=True)
   rewrite_rule = models.OneToOneField(RewriteRule, null=True, blank=True)
+  last_updated = models.DateField(null=True, blank=True, editable=False, db_index=True)
+  
+  # Sanitized copies of description, discussion and status, computed when an instance is saved
+  sanitized_description = models.TextField(blank=True, editable=False)
+  sanitized_discussion = models.TextField(blank=True, editable=False)
+  sanitized_status = models.TextField(blank=True, editable=False)
+  
+  # Custom manager providing with_catalog_data()
+  objects = ContentModelManager()
+  
+  # Sanitize description, discussion and status into their stored copies
+  def sanitize(self):
+    self.sanitized_description = removeTags(self.description)
+    self.sanitized_discussion = removeTags(self.discussion)
+    self.sanitized_status = removeTags(self.status)
   
   # Functions to return cleaned-up properties
   def cleaned_description(self):
-    return removeTags(self.description)
+    return self.sanitized_description
     
   def cleaned_discussion(self):
-    return removeTags(self.discussion)
+    return self.sanitized_discussion
     
   def cleaned_status(self):
-    return removeTags(self.status)
+    return self.sanitized_status
   
   # Define the "display name" for an instance
   def __unicode__(self):
@@ -55,9 +117,31 @@ class ContentModel(models.Model):
   def folder_path(self):
     return slugify(self.title)
   
-  # Simple pointer to the latest version of a instance
+  # Return the list of versions loaded by prefetch_related, or None if they were not prefetched.
+  #   Prefetched versions get their content_model cache pointed back at this instance so that
+  #   walking from a version to its ContentModel doesn't cost another query.
+  def _prefetched_versions(self):
+    if 'modelversion' not in getattr(self, '_prefetched_objects_cache', {}): return None
+    versions = list(self.modelversion_set.all())
+    for version in versions: version._content_model_cache = self
+    return versions
+  
+  # Return this instance's versions, using prefetched data when it is available
+  def versions(self):
+    versions = self._prefetched_versions()
+    if versions is not None: return versions
+    else: return self.modelversion_set.all()
+  
+  # Simple pointer to the latest version of a instance. Versions created on the same day
+  #   are told apart by their primary key, so the most recently created one wins.
   def latest_version(self):
-    if self.modelversion_set.count() > 0: return self.modelversion_set.latest('date_created')
+    versions = self._prefetched_versions()
+    if versions is not None:
+      if versions: return max(versions, key=lambda v: (v.date_created, v.pk))
+      else: return None
+    
+    versions = self.modelversion_set.order_by('-date_created', '-pk')[:1]
+    if versions: return versions[0]
     else: return None
   
   # Simply return the latest version number
@@ -68,10 +152,18 @@ class ContentModel(models.Model):
   
   # The updated date for an instance is the last time that a version was created
   def date_updated(self):
+    # Use the annotation provided by with_catalog_data() when it is there
+    if hasattr(self, 'latest_version_date'): return self.latest_version_date
+    
     version = self.latest_version()
     if version is not None: return version.date_created
     else: return None
     
+  # Work out the value of last_updated from the database: the latest version's created date.
+  #   The column is a copy of date_updated() that can be indexed for "recently updated" lists.
+  def compute_last_updated(self):
+    return self.modelversion_set.aggregate(latest=Max('date_created'))['latest']
+    
   # Return the updated date as an ISO-formatted string
   def iso_date_updated(self):
     updated = self.date_updated()
@@ -81,26 +173,26 @@ class ContentModel(models.Model):
   # Return the absolute path to the latest version's XSD file
   def absolute_latest_xsd_path(self):
     version = self.latest_version()
-    if version is not None: return self.latest_version().absolute_xsd_path()
+    if version is not None: return version.absolute_xsd_path()
     else: return None
   
   # Return the absolute path to the latest version's XLS file
   def absolute_latest_xls_path(self):
     version = self.latest_version()
-    if version is not None: return self.latest_version().absolute_xls_path()
+    if version is not None: return version.absolute_xls_path()
     else: return None
   
   # Provide a link to the latest version's XSD file
   def latest_xsd_link(self):
     version = self.latest_version()
-    if version != None: return self.latest_version().xsd_link()
+    if version != None: return version.xsd_link()
     else: return None
   latest_xsd_link.allow_tags = True
   
   # Provide a link to the latest version's XLS file
   def latest_xls_link(self):
     version = self.latest_version()
-    if version != None: return self.latest_version().xls_link()
+    if version != None: return version.xls_link()
     else: return None
   latest_xls_link.allow_tags = True
   
@@ -146,7 +238,7 @@ class ContentModel(models.Model):
       'discussion': self.discussion,
       'status': self.status,
       'date_updated': self.iso_date_updated(),
-      'versions': [ mv.serialized() for mv in self.modelversion_set.all() ]
+      'versions': [ mv.serialized() for mv in self.versions() ]
     }    
     return as_json
 
@@ -220,13 +312,10 @@ class ModelVersion(models.Model):
   def iso_date_created(self):
     return self.date_created.isoformat()
   
-  # Return an lxml.etree.XMLSchema validator
+  # Return an lxml.etree.XMLSchema validator. It is compiled once per process and shared,
+  #   see schemacache.py.
   def schema_validator(self):
-    # I don't know why this isn't working: schema_file = self.xsd_file.open()
-    schema_file = open(self.xsd_file.path, 'r')
-    schema_doc = etree.parse(schema_file)
-    schema = etree.XMLSchema(schema_doc)
-    return schema
+    return cached_schema(self).schema
   
   # Return the instance as a dictionary that can be easily converted to JSON.
   #   Contains URLs to directly download files 
@@ -241,20 +330,153 @@ class ModelVersion(models.Model):
     }    
     return as_json
     
+#--------------------------------------------------------------------------------------
+# Manager that searches ContentModels through the SearchTerm index. Every term in the
+#   query has to match; the last one may match as a prefix, so that partly typed words
+#   find something. Results are ranked by the summed weights of the matching terms.
+#--------------------------------------------------------------------------------------
+class SearchTermManager(models.Manager):
+  # Returns a list of (ContentModel, score) tuples, best first, and the number of matches
+  def search(self, query, limit):
+    tokens = []
+    for token in tokenize(query):
+      if token not in tokens: tokens.append(token)
+    if len(tokens) == 0: return [], 0
+    last = tokens[-1]
+    
+    # Score every ContentModel that contains any of the terms, and note which terms matched
+    scores = {}
+    matched = {}
+    rows = self.filter(Q(term__in=tokens) | Q(term__startswith=last)).values_list('content_model', 'term', 'weight')
+    for content_model_id, term, weight in rows:
+      if term in tokens:
+        matched.setdefault(content_model_id, set()).add(term)
+        scores[content_model_id] = scores.get(content_model_id, 0) + weight
+        # A whole word can also be what the last term is a prefix of
+        if term.startswith(last): matched[content_model_id].add(last)
+      else:
+        # Prefix matches count for half as much as whole words
+        matched.setdefault(content_model_id, set()).add(last)
+        scores[content_model_id] = scores.get(content_model_id, 0) + weight / 2.0
+    
+    # Rank the ContentModels that matched every term, and load the best of them
+    found = [ pk for pk in scores if len(matched[pk]) == len(tokens) ]
+    found.sort(key=lambda pk: (-scores[pk], pk))
+    ranked = found[:limit]
+    content_models = ContentModel.objects.with_catalog_data().in_bulk(ranked)
+    return [ (content_models[pk], scores[pk]) for pk in ranked if pk in content_models ], len(found)
+
+#--------------------------------------------------------------------------------------
+# This class is an inverted index of the words in ContentModels, used for searching.
+#   Each row says how much a term weighs in one ContentModel. The rows for a ContentModel
+#   are rebuilt whenever it or one of its versions changes.
+#--------------------------------------------------------------------------------------
+class SearchTerm(models.Model):
+  class Meta:
+    unique_together = ('term', 'content_model')
+  
+  term = models.CharField(max_length=MAX_TERM_LENGTH, db_index=True)
+  content_model = models.ForeignKey('ContentModel')
+  weight = models.PositiveIntegerField()
+  
+  objects = SearchTermManager()
+  
+  # Rebuild the index rows for the ContentModel with the given primary key
+  @classmethod
+  def reindex(cls, content_model_id):
+    cls.objects.filter(content_model=content_model_id).delete()
+    for content_model in ContentModel.objects.filter(pk=content_model_id).prefetch_related('modelversion_set'):
+      cls.objects.bulk_create([
+        cls(term=term, content_model=content_model, weight=weight)
+        for term, weight in weighted_terms(content_model).items()
+      ])
+
+#--------------------------------------------------------------------------------------
+# This class holds a single row that counts changes to the catalog. Every save or delete
+#   of a ContentModel or ModelVersion bumps the number and the modification date, so
+#   fetching the row is all it takes to fingerprint the catalog for conditional GETs.
+#--------------------------------------------------------------------------------------
+class CatalogRevision(models.Model):
+  number = models.PositiveIntegerField(default=0)
+  date_modified = models.DateTimeField(default=timezone.now)
+  
+  # Return the catalog's current revision, creating the row the first time it is needed
+  @classmethod
+  def current(cls):
+    revision, created = cls.objects.get_or_create(pk=1)
+    return revision
+  
+  # Record a change to the catalog with a single UPDATE
+  @classmethod
+  def bump(cls):
+    changes = { 'number': F('number') + 1, 'date_modified': timezone.now() }
+    if cls.objects.filter(pk=1).update(**changes) == 0:
+      cls.objects.create(pk=1, number=1)
+
+#--------------------------------------------------------------------------------------
+# Function to bump the CatalogRevision when ModelVersion or ContentModel objects change
+#--------------------------------------------------------------------------------------
+def bump_catalog_revision(sender, instance, **kwargs):
+  CatalogRevision.bump()
+
+#--------------------------------------------------------------------------------------
+# Function to store sanitized text before a ContentModel is saved
+#--------------------------------------------------------------------------------------
+def sanitize_content_model(sender, instance, **kwargs):
+  instance.sanitize()
+
+#--------------------------------------------------------------------------------------
+# Function to keep the search index in sync with ContentModels and their versions
+#--------------------------------------------------------------------------------------
+def reindex_content_model(sender, instance, **kwargs):
+  if sender is ModelVersion: SearchTerm.reindex(instance.content_model_id)
+  else: SearchTerm.reindex(instance.pk)
+
+#--------------------------------------------------------------------------------------
+# Functions to keep ContentModel.last_updated current. A ContentModel recomputes it
+#   before it is saved so a stale in-memory value is never written back, and changes to
+#   a ModelVersion update its ContentModel's row directly.
+#--------------------------------------------------------------------------------------
+def set_last_updated(sender, instance, **kwargs):
+  if instance.pk is not None: instance.last_updated = instance.compute_last_updated()
+  
+def update_parent_last_updated(sender, instance, **kwargs):
+  content_model = ContentModel(pk=instance.content_model_id)
+  ContentModel.objects.filter(pk=content_model.pk).update(last_updated=content_model.compute_last_updated())
+
 #--------------------------------------------------------------------------------------
 # Register a function to fire before ModelVersion and ContentModel objects are saved
 #--------------------------------------------------------------------------------------    
 pre_save.connect(adjust_rewrite_rule, sender=ModelVersion)
 pre_save.connect(adjust_rewrite_rule, sender=ContentModel)
+pre_save.connect(set_last_updated, sender=ContentModel)
+pre_save.connect(sanitize_content_model, sender=ContentModel)
 
 #--------------------------------------------------------------------------------------
 # Register a function to fire after ModelVersion and ContentModel objects are saved
+#   The CatalogRevision is bumped first, so that rewrite rule work done afterwards
+#   knows which revision it brings the dataschema resolver up to.
 #--------------------------------------------------------------------------------------    
+post_save.connect(bump_catalog_revision, sender=ModelVersion)
+post_save.connect(bump_catalog_revision, sender=ContentModel)
 post_save.connect(update_related_rewrite_rules, sender=ModelVersion)
 post_save.connect(update_related_rewrite_rules, sender=ContentModel)
+post_save.connect(update_parent_last_updated, sender=ModelVersion)
+post_save.connect(forget_compiled_schema, sender=ModelVersion)
+post_save.connect(invalidate_cached_responses, sender=ModelVersion)
+post_save.connect(invalidate_cached_responses, sender=ContentModel)
+post_save.connect(reindex_content_model, sender=ModelVersion)
+post_save.connect(reindex_content_model, sender=ContentModel)
 
 #--------------------------------------------------------------------------------------
 # Register a function to fire when ModelVersion and ContentModel objects are deleted
 #--------------------------------------------------------------------------------------  
+post_delete.connect(bump_catalog_revision, sender=ModelVersion)
+post_delete.connect(bump_catalog_revision, sender=ContentModel)
 post_delete.connect(delete_rewrite_rule, sender=ModelVersion)
-post_delete.connect(delete_rewrite_rule, sender=ContentModel)
\ No newline at end of file
+post_delete.connect(delete_rewrite_rule, sender=ContentModel)
+post_delete.connect(update_parent_last_updated, sender=ModelVersion)
+post_delete.connect(forget_compiled_schema, sender=ModelVersion)
+post_delete.connect(invalidate_cached_responses, sender=ModelVersion)
+post_delete.connect(invalidate_cached_responses, sender=ContentModel)
+post_delete.connect(reindex_content_model, sender=ModelVersion)
\ No newline at end of file
@@ -0,0 +1,187 @@
+from django.db.models.signals import post_save, post_delete
+from uriredirect.models import AcceptMapping, RewriteRule
+from models import ContentModel, CatalogRevision
+from uriconfigure import rewrite_rules_synced, rewrite_sync_in_progress
+from catalogcache import cached_revision, forget_cached_revision
+from lru import LRUCache
+import mimeparse, threading, re
+
+# The number of (Accept header, mime types) pairs whose negotiated result is remembered
+NEGOTIATION_CACHE_SIZE = 1000
+
+# The extension at the end of a URI, matching the one in ContentModel.regex_pattern()
+extension_pattern = re.compile(r'^(?P<rest>.+)\.(?P<extension>[a-zA-Z]{3,4})$')
+
+#--------------------------------------------------------------------------------------
+# Class holding an in-process index of dataschema URIs, so that they can be resolved
+#   with a dictionary lookup instead of matching every RewriteRule's pattern. Entries
+#   are keyed by (label, version), with None as the version of a ContentModel, and hold
+#   the AcceptMappings of its RewriteRule as (mime type, file extension, url) tuples.
+#   The index belongs to the CatalogRevision it was built at. When the catalog changes in
+#   this process the changed ContentModels' entries are reloaded; a change made anywhere
+#   else shows up as a new revision, and the index is rebuilt on the next lookup.
+#--------------------------------------------------------------------------------------
+class DataschemaIndex(object):
+  def __init__(self):
+    self.revision = None
+    self.entries = {}
+    self.keys = {}
+    self.lock = threading.Lock()
+
+  # Function to load the entries for some ContentModels, or for all of them
+  #   Returns dictionaries of key -> mappings, and ContentModel pk -> its keys
+  def load(self, content_model_pks=None):
+    content_models = ContentModel.objects.with_catalog_data()
+    if content_model_pks is not None: content_models = content_models.filter(pk__in=content_model_pks)
+
+    rule_keys = {}
+    keys = {}
+    for cm in content_models:
+      keys[cm.pk] = [ (cm.label, None) ]
+      rule_keys[cm.rewrite_rule_id] = (cm.label, None)
+      for version in cm.versions():
+        keys[cm.pk].append((cm.label, version.version))
+        rule_keys[version.rewrite_rule_id] = (cm.label, version.version)
+
+    entries = dict(( key, [] ) for key in rule_keys.values())
+    mappings = AcceptMapping.objects.filter(rewrite_rule__in=rule_keys.keys()).select_related('media_type').order_by('pk')
+    for mapping in mappings:
+      entries[rule_keys[mapping.rewrite_rule_id]].append(
+          (mapping.media_type.mime_type, mapping.media_type.file_extension.lower(), mapping.redirect_to)
+        )
+    return entries, keys
+
+  # Function to build the whole index. The revision is read first, so that a change made
+  #   while the index is loading leaves it out of date rather than wrongly current.
+  def rebuild(self):
+    with self.lock:
+      revision = CatalogRevision.current().number
+      self.entries, self.keys = self.load()
+      self.revision = revision
+
+  # Function to reload the entries of some ContentModels after their rules were synced.
+  #   This is only safe when the index was current just before the change, i.e. the
+  #   catalog has moved on by exactly one revision; otherwise the index is dropped.
+  def update(self, content_model_pks):
+    with self.lock:
+      if self.revision is None: return
+      revision = CatalogRevision.current().number
+      if revision != self.revision + 1:
+        self.revision = None
+        return
+
+      # Change copies, so that lookups going on meanwhile see either index in full
+      loaded_entries, loaded_keys = self.load(content_model_pks)
+      entries = dict(self.entries)
+      keys = dict(self.keys)
+      for pk in content_model_pks:
+        for key in keys.pop(pk, []): entries.pop(key, None)
+      entries.update(loaded_entries)
+      keys.update(loaded_keys)
+      self.entries, self.keys = entries, keys
+      self.revision = revision
+
+  def invalidate(self):
+    self.revision = None
+
+  # Function to find the mappings for a dataschema path, with the extension it asked for
+  #   Returns (mappings, extension), or (None, None) if the path doesn't match anything
+  def lookup(self, path):
+    if cached_revision(CatalogRevision).number != self.revision: self.rebuild()
+    entries = self.entries
+    for key, extension in dataschema_keys(path):
+      if key in entries: return entries[key], extension
+    return None, None
+
+# The index shared by every request served by this process
+dataschema_index = DataschemaIndex()
+
+#--------------------------------------------------------------------------------------
+# Generator for the (label, version) keys, with extensions, that a path could refer to.
+#   Paths look like dataschema/<label>/[<version>][/ or .<ext>], as matched by
+#   regex_pattern() on ContentModels and ModelVersions. dataschema/<label> and
+#   dataschema/<label>.<ext> are accepted too. Version numbers contain dots, so a path
+#   is tried as a whole before a trailing extension is split off.
+#--------------------------------------------------------------------------------------
+def dataschema_keys(path):
+  if not path.startswith('dataschema/'): return
+  path = path[len('dataschema/'):]
+  label, slash, rest = path.partition('/')
+
+  # dataschema/<label>[/[/]] and dataschema/<label>/.<ext>
+  if rest in ['', '/']:
+    yield (label, None), None
+  if rest.startswith('.') and slash:
+    yield (label, None), rest[1:].lower()
+
+  # dataschema/<label> or dataschema/<label>.<ext>
+  if not slash:
+    match = extension_pattern.match(label)
+    if match is not None: yield (match.group('rest'), None), match.group('extension').lower()
+    return
+
+  # dataschema/<label>/<version>[/ or .<ext>]
+  version = rest[:-1] if rest.endswith('/') else rest
+  if version != '' and not version.startswith('.'):
+    yield (label, version), None
+    match = extension_pattern.match(rest)
+    if match is not None: yield (label, match.group('rest')), match.group('extension').lower()
+
+#--------------------------------------------------------------------------------------
+# Function that chooses where to redirect to, from the mappings of one rule
+#   extension is the one asked for in the URI, if any. Otherwise the Accept header is
+#   matched against the mime types of the mappings, in the order they were created.
+#   Returns the url, or None if no mapping is acceptable.
+#--------------------------------------------------------------------------------------
+def negotiate(mappings, extension, accept):
+  if extension is not None:
+    for mime_type, file_extension, url in mappings:
+      if file_extension == extension: return url
+    return None
+
+  if len(mappings) == 0: return None
+  best = best_mime_type(tuple( mime_type for mime_type, file_extension, url in mappings ), accept or '*/*')
+  for mime_type, file_extension, url in mappings:
+    if mime_type == best: return url
+  return None
+
+#--------------------------------------------------------------------------------------
+# Function that matches an Accept header against a tuple of mime types, returning the
+#   best one or '' if none is acceptable. Clients send the same few Accept headers over
+#   and over, so results are remembered in a bounded LRU cache. A header that mimeparse
+#   cannot parse accepts nothing.
+#--------------------------------------------------------------------------------------
+negotiation_cache = LRUCache(NEGOTIATION_CACHE_SIZE)
+
+def best_mime_type(mime_types, accept):
+  key = (accept, mime_types)
+  best = negotiation_cache.get(key)
+  if best is None:
+    try:
+      best = mimeparse.best_match(list(mime_types), accept)
+    except ValueError:
+      best = ''
+    negotiation_cache.set(key, best)
+  return best
+
+#--------------------------------------------------------------------------------------
+# Functions that keep the index up to date
+#--------------------------------------------------------------------------------------
+def update_dataschema_index(sender, content_model_pks, **kwargs):
+  dataschema_index.update(content_model_pks)
+
+# A rule edited by hand bumps the catalog's revision, so that every process rebuilds its
+#   index, not just this one
+def invalidate_dataschema_index(sender, **kwargs):
+  if rewrite_sync_in_progress(): return
+  CatalogRevision.bump()
+  forget_cached_revision()
+  dataschema_index.invalidate()
+
+rewrite_rules_synced.connect(update_dataschema_index)
+
+# RewriteRules and AcceptMappings can also be edited by hand through uriredirect
+post_save.connect(invalidate_dataschema_index, sender=RewriteRule)
+post_delete.connect(invalidate_dataschema_index, sender=RewriteRule)
+post_save.connect(invalidate_dataschema_index, sender=AcceptMapping)
+post_delete.connect(invalidate_dataschema_index, sender=AcceptMapping)
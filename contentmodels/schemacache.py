@@ -0,0 +1,109 @@
+from django.conf import settings
+from lru import LRUCache
+from schemarepository import compile_offline, repository_path, CATALOG_NAME
+from lxml import etree
+import hashlib, os, threading, time
+
+#--------------------------------------------------------------------------------------
+# Compiled XML Schemas are kept in a per-process LRU cache, because compiling a schema
+#   that imports GML can take seconds. Entries are keyed by ModelVersion pk and remember
+#   the path, modification time and size of the XSD file they were compiled from, and
+#   when the schema repository's catalog last changed; a schema whose file or imports
+#   have changed since is compiled again. The number of schemas kept is set by
+#   CONTENTMODELS_SCHEMA_CACHE_SIZE.
+#--------------------------------------------------------------------------------------
+schema_cache = LRUCache(getattr(settings, 'CONTENTMODELS_SCHEMA_CACHE_SIZE', 10))
+
+# Compiling is serialized, so that requests arriving together don't compile the same
+#   schema several times over
+compile_lock = threading.Lock()
+
+#--------------------------------------------------------------------------------------
+# Class for a cache entry. An XMLSchema keeps the error log of its last validation, so
+#   threads sharing one must hold the entry's lock from validating until they have read
+#   the errors.
+#--------------------------------------------------------------------------------------
+class CompiledSchema(object):
+  def __init__(self, fingerprint, schema, seconds):
+    self.fingerprint = fingerprint
+    self.schema = schema
+    self.seconds = seconds
+    self.lock = threading.Lock()
+
+  # Function to validate an element, returning whether it is valid and a copy of the
+  #   errors found, taken while holding the lock
+  def validate(self, element):
+    with self.lock:
+      valid = self.schema.validate(element)
+      return valid, list(self.schema.error_log)
+
+def file_fingerprint(path):
+  stat = os.stat(path)
+  catalog = os.path.join(repository_path(), CATALOG_NAME)
+  catalog_modified = os.stat(catalog).st_mtime if os.path.exists(catalog) else None
+  return (path, stat.st_mtime, stat.st_size, catalog_modified)
+
+#--------------------------------------------------------------------------------------
+# Function to hash what a ModelVersion's schema is compiled from: its XSD file, and the
+#   schema repository's catalog, which decides what its imports resolve to. Unlike
+#   file_fingerprint, the hash only changes when their content does.
+#--------------------------------------------------------------------------------------
+def schema_hash(version):
+  digest = hashlib.sha256()
+  with open(version.xsd_file.path, 'rb') as xsd: digest.update(xsd.read())
+  catalog = os.path.join(repository_path(), CATALOG_NAME)
+  if os.path.exists(catalog):
+    with open(catalog, 'rb') as f: digest.update(f.read())
+  return digest.hexdigest()
+
+#--------------------------------------------------------------------------------------
+# Function to parse and compile an XSD file. Parsing from the path lets relative
+#   imports and includes be found next to the file; remote ones come from the schema
+#   repository, see schemarepository.py.
+#--------------------------------------------------------------------------------------
+def compile_schema(path):
+  return compile_offline(path)
+
+#--------------------------------------------------------------------------------------
+# Function to retrieve the CompiledSchema for a ModelVersion, compiling it if needed
+#--------------------------------------------------------------------------------------
+def cached_schema(version):
+  path = version.xsd_file.path
+  fingerprint = file_fingerprint(path)
+  entry = schema_cache.get(version.pk)
+  if entry is not None and entry.fingerprint == fingerprint: return entry
+
+  with compile_lock:
+    # Another thread may have compiled it while this one was waiting
+    entry = schema_cache.get(version.pk)
+    if entry is not None and entry.fingerprint == fingerprint: return entry
+
+    started = time.time()
+    entry = CompiledSchema(fingerprint, compile_schema(path), time.time() - started)
+    if version.pk is not None: schema_cache.set(version.pk, entry)
+    return entry
+
+#--------------------------------------------------------------------------------------
+# Function to compile the schema of each ContentModel's latest version ahead of time,
+#   so that the first validations after a worker starts don't wait for them.
+#   Returns a list of (ModelVersion, seconds taken or None, error or None).
+#--------------------------------------------------------------------------------------
+def warm_schema_cache():
+  from models import ContentModel
+  compiled = []
+  for cm in ContentModel.objects.with_catalog_data():
+    version = cm.latest_version()
+    if version is None: continue
+    try:
+      compiled.append((version, cached_schema(version).seconds, None))
+    except (IOError, OSError, etree.Error), err:
+      compiled.append((version, None, err))
+  return compiled
+
+#--------------------------------------------------------------------------------------
+# This function drops a ModelVersion's compiled schema from this process when the
+#   ModelVersion is saved, i.e. a new XSD was uploaded, or deleted. Other processes
+#   notice the new file by its fingerprint. It is registered in models.py.
+#--------------------------------------------------------------------------------------
+def forget_compiled_schema(sender, instance, **kwargs):
+  schema_cache.delete(instance.pk)
@@ -0,0 +1,168 @@
+from django.conf import settings
+from lxml import etree
+from urlparse import urljoin, urlparse
+import os, json, hashlib, urllib2, posixpath, tempfile, logging
+
+logger = logging.getLogger(__name__)
+
+XSD_NS = 'http://www.w3.org/2001/XMLSchema'
+
+# Name of the file, in the repository, that maps remote schema locations to local copies
+CATALOG_NAME = 'catalog.json'
+
+# Seconds to wait for a remote schema when pinning it
+FETCH_TIMEOUT = 30
+
+#--------------------------------------------------------------------------------------
+# The schema repository holds local copies of the remote schemas (GML, xlink and other
+#   OGC schemas) that content model XSDs import. Schemas are compiled without any
+#   network access: remote locations are looked up in the repository's catalog, and a
+#   location that isn't there is an error until it has been pinned with the pin_schemas
+#   command. The repository is the schema-repository folder of MEDIA_ROOT unless
+#   CONTENTMODELS_SCHEMA_REPOSITORY says otherwise.
+#--------------------------------------------------------------------------------------
+def repository_path():
+  return getattr(settings, 'CONTENTMODELS_SCHEMA_REPOSITORY', os.path.join(settings.MEDIA_ROOT, 'schema-repository'))
+
+#--------------------------------------------------------------------------------------
+# Functions to read and write the catalog: a dictionary of remote URL -> { path, sha256 },
+#   where path is relative to the repository
+#--------------------------------------------------------------------------------------
+def load_catalog():
+  path = os.path.join(repository_path(), CATALOG_NAME)
+  if not os.path.exists(path): return {}
+  with open(path) as f: return json.load(f)
+
+def save_catalog(catalog):
+  write_file(CATALOG_NAME, json.dumps(catalog, indent=2, sort_keys=True))
+
+# Local copies are stored under the host and path of their remote location
+def local_path(url):
+  parsed = urlparse(url)
+  return '%s%s' % (parsed.netloc, posixpath.normpath(parsed.path or '/'))
+
+def is_remote(url):
+  return urlparse(url).scheme in ['http', 'https', 'ftp']
+
+#--------------------------------------------------------------------------------------
+# Exception raised when a schema imports a remote location that is not in the catalog
+#--------------------------------------------------------------------------------------
+class SchemaNotPinned(IOError):
+  pass
+
+#--------------------------------------------------------------------------------------
+# lxml resolver that serves remote schema locations from the repository. Documents keep
+#   their remote URL as their base, so their own relative imports come back here as
+#   remote URLs too. Remote locations that aren't in the catalog are remembered.
+#--------------------------------------------------------------------------------------
+class SchemaRepositoryResolver(etree.Resolver):
+  def __init__(self, catalog=None):
+    self.catalog = load_catalog() if catalog is None else catalog
+    self.missing = []
+
+  def resolve(self, url, id, context):
+    entry = self.catalog.get(url)
+    if entry is not None:
+      with open(os.path.join(repository_path(), entry['path']), 'rb') as f: content = f.read()
+      return self.resolve_string(content, context, base_url=url)
+    if is_remote(url) and url not in self.missing: self.missing.append(url)
+    return None
+
+#--------------------------------------------------------------------------------------
+# Function to parse and compile an XSD file offline, using the repository for imports.
+#   While nothing has been pinned at all, a schema with remote imports is compiled the
+#   way it was before the repository existed, fetching them over the network, and a
+#   warning is logged; unless strict is True, as it is for pin_schemas --verify.
+#--------------------------------------------------------------------------------------
+def compile_offline(path, strict=False):
+  catalog = load_catalog()
+  resolver = SchemaRepositoryResolver(catalog)
+  parser = etree.XMLParser(no_network=True)
+  parser.resolvers.add(resolver)
+  try:
+    schema = etree.XMLSchema(etree.parse(path, parser))
+  except etree.XMLSchemaParseError:
+    if len(resolver.missing) == 0: raise
+    schema = None
+
+  # libxml2 skips imports it cannot load, so the schema may have compiled without them
+  if len(resolver.missing) == 0: return schema
+  if strict or len(catalog) > 0: raise SchemaNotPinned(not_pinned_message(path, resolver.missing))
+  logger.warning('No schemas have been pinned; fetching the imports of %s over the network (run "manage.py pin_schemas"): %s', path, ', '.join(resolver.missing))
+  return etree.XMLSchema(etree.parse(path, etree.XMLParser(no_network=False)))
+
+def not_pinned_message(path, missing):
+  return '%s imports schemas that have not been pinned (run "manage.py pin_schemas"): %s' % (path, ', '.join(missing))
+
+#--------------------------------------------------------------------------------------
+# Function to find the locations a schema document imports, includes or redefines,
+#   made absolute against the document's own location
+#--------------------------------------------------------------------------------------
+def schema_locations(root, base_url):
+  locations = []
+  for element in root.iter('{%s}import' % XSD_NS, '{%s}include' % XSD_NS, '{%s}redefine' % XSD_NS):
+    location = element.get('schemaLocation')
+    if location: locations.append(urljoin(base_url, location))
+  return locations
+
+def fetch_url(url):
+  return urllib2.urlopen(url, timeout=FETCH_TIMEOUT).read()
+
+#--------------------------------------------------------------------------------------
+# Function to copy remote schemas into the repository, along with every remote schema
+#   they depend on. Schemas already in the catalog are kept as they are, unless refresh
+#   is True. Returns the list of URLs that were fetched.
+#--------------------------------------------------------------------------------------
+def pin_schemas(urls, refresh=False, fetch=fetch_url):
+  catalog = load_catalog()
+  fetched = []
+  queue = list(urls)
+  seen = set()
+  while len(queue) > 0:
+    url = queue.pop(0)
+    if url in seen: continue
+    seen.add(url)
+
+    if url in catalog and not refresh:
+      with open(os.path.join(repository_path(), catalog[url]['path']), 'rb') as f: content = f.read()
+    else:
+      content = fetch(url)
+      path = local_path(url)
+      write_file(path, content)
+      catalog[url] = { 'path': path, 'sha256': hashlib.sha256(content).hexdigest() }
+      fetched.append(url)
+
+    # Follow the schema's own remote dependencies
+    root = etree.fromstring(content, etree.XMLParser(no_network=True), base_url=url)
+    queue += [ location for location in schema_locations(root, url) if is_remote(location) ]
+
+  save_catalog(catalog)
+  return fetched
+
+#--------------------------------------------------------------------------------------
+# Function to check that every pinned schema is present and unchanged
+#   Returns a list of problems, empty if there are none
+#--------------------------------------------------------------------------------------
+def verify_catalog():
+  problems = []
+  for url, entry in sorted(load_catalog().items()):
+    path = os.path.join(repository_path(), entry['path'])
+    if not os.path.exists(path):
+      problems.append('%s: %s is missing' % (url, entry['path']))
+      continue
+    with open(path, 'rb') as f:
+      if hashlib.sha256(f.read()).hexdigest() != entry['sha256']:
+        problems.append('%s: %s has changed since it was pinned' % (url, entry['path']))
+  return problems
+
+#--------------------------------------------------------------------------------------
+# Utility function to write a file into the repository. Files are swapped in whole, so
+#   a process compiling a schema meanwhile never reads half of one.
+#--------------------------------------------------------------------------------------
+def write_file(path, content):
+  path = os.path.join(repository_path(), path)
+  if not os.path.isdir(os.path.dirname(path)): os.makedirs(os.path.dirname(path))
+  handle, temporary = tempfile.mkstemp(dir=os.path.dirname(path))
+  with os.fdopen(handle, 'wb') as f: f.write(content)
+  os.chmod(temporary, 0644)
+  os.rename(temporary, path)
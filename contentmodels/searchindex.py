@@ -0,0 +1,44 @@
+import re
+
+# How much a term counts for, depending on where it was found in a ContentModel
+WEIGHTS = {
+  'title': 10,
+  'label': 8,
+  'version': 5,
+  'description': 2,
+  'discussion': 1
+}
+
+# Terms are runs of letters and digits. Dots are kept inside them so that version
+#   numbers such as 1.2 are terms of their own.
+term_pattern = re.compile(r'\w+(?:\.\w+)*', re.UNICODE)
+markup_pattern = re.compile(r'<[^>]*>|&\w+;')
+
+# The longest term that is stored. Needs to be in sync with SearchTerm.term in models.py
+MAX_TERM_LENGTH = 100
+
+#--------------------------------------------------------------------------------------
+# Function that splits text into lowercase terms, ignoring any HTML markup
+#--------------------------------------------------------------------------------------
+def tokenize(text):
+  text = markup_pattern.sub(' ', text or '')
+  return [ term[:MAX_TERM_LENGTH] for term in term_pattern.findall(text.lower()) ]
+
+#--------------------------------------------------------------------------------------
+# Function that works out the weighted terms for a ContentModel: a dictionary of
+#   term -> weight, where the weight adds up every occurrence of the term
+#--------------------------------------------------------------------------------------
+def weighted_terms(content_model):
+  fields = [
+    ('title', content_model.title),
+    ('label', content_model.label),
+    ('description', content_model.sanitized_description),
+    ('discussion', content_model.sanitized_discussion)
+  ]
+  fields += [ ('version', version.version) for version in content_model.versions() ]
+
+  terms = {}
+  for field, text in fields:
+    for term in tokenize(text):
+      terms[term] = terms.get(term, 0) + WEIGHTS[field]
+  return terms
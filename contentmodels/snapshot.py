@@ -0,0 +1,128 @@
+from django.http import HttpRequest
+from models import ContentModel, CatalogRevision
+from catalogcache import EXTENSIONS
+import views
+import os, json, hashlib, tempfile, shutil
+
+# Name of the file, inside each snapshot, that records what the snapshot was built from
+MANIFEST = '.export-manifest.json'
+
+#--------------------------------------------------------------------------------------
+# Function that lists the files that depend on the whole catalog, as a dictionary of
+#   path -> function returning the HttpResponse for that file. Paths need to be in
+#   sync with urls.py: a front-end server maps /models/ and /home/ to their index.html.
+#--------------------------------------------------------------------------------------
+def catalog_files():
+  files = {
+    'models/index.html': lambda: views.models(HttpRequest()),
+    'home/index.html': lambda: views.homepage(HttpRequest())
+  }
+  for extension in EXTENSIONS:
+    files['contentmodels.%s' % extension] = render(ContentModel.objects.with_catalog_data(), extension)
+  return files
+
+#--------------------------------------------------------------------------------------
+# Function that lists the files for a single ContentModel, like catalog_files()
+#--------------------------------------------------------------------------------------
+def model_files(pk):
+  contentmodels = ContentModel.objects.filter(pk=pk).with_catalog_data()
+  return dict(( model_path(pk, extension), render(contentmodels, extension) ) for extension in EXTENSIONS)
+
+def model_path(pk, extension):
+  return 'contentmodel/%s.%s' % (pk, extension)
+
+def render(contentmodels, extension):
+  return lambda: views.view_models(contentmodels, extension)
+
+#--------------------------------------------------------------------------------------
+# Function to fingerprint every ContentModel. A ContentModel's files need to be
+#   rendered again whenever its fingerprint changes.
+#--------------------------------------------------------------------------------------
+def fingerprints():
+  prints = {}
+  for cm in ContentModel.objects.with_catalog_data():
+    prints[str(cm.pk)] = hashlib.md5(json.dumps(cm.serialized(), sort_keys=True)).hexdigest()
+  return prints
+
+#--------------------------------------------------------------------------------------
+# Function to write the catalog to a directory tree that a front-end web server can serve.
+#   output will be a symbolic link to the current snapshot. Each export is built in a new
+#   directory next to it and swapped in by renaming a link over output, so readers
+#   never see a half-written snapshot.
+#   When changed_only is True, files of ContentModels that have not changed since the
+#   last export are hard-linked from the previous snapshot instead of being rendered.
+#   Returns a dictionary describing what was done.
+#--------------------------------------------------------------------------------------
+def export_catalog(output, changed_only=False):
+  output = os.path.abspath(output.rstrip('/'))
+  if os.path.exists(output) and not os.path.islink(output):
+    raise ValueError('%s exists and is not a link to a catalog snapshot' % output)
+
+  # Find the previous snapshot and what it was built from
+  previous = os.path.realpath(output) if os.path.islink(output) else None
+  previous_manifest = None
+  if changed_only and previous is not None and os.path.exists(os.path.join(previous, MANIFEST)):
+    previous_manifest = json.load(open(os.path.join(previous, MANIFEST)))
+
+  # Nothing has changed at all since the previous export
+  revision = CatalogRevision.current().number
+  if previous_manifest is not None and previous_manifest['revision'] == revision:
+    return { 'snapshot': previous, 'rendered': 0, 'linked': 0, 'changed_models': [] }
+
+  # Work out which ContentModels need their files rendered
+  prints = fingerprints()
+  if previous_manifest is not None:
+    old_prints = previous_manifest['fingerprints']
+    changed = [ pk for pk in prints if prints[pk] != old_prints.get(pk) or not has_model_files(previous, pk) ]
+  else:
+    changed = prints.keys()
+
+  # Build the new snapshot next to the output link
+  build = tempfile.mkdtemp(prefix='.%s-' % os.path.basename(output), dir=os.path.dirname(output))
+  os.chmod(build, 0755)
+  files = catalog_files()
+  for pk in changed: files.update(model_files(pk))
+
+  # Reuse the unchanged ContentModels' files from the previous snapshot
+  linked = 0
+  if previous_manifest is not None:
+    for pk in prints:
+      if pk in changed: continue
+      for extension in EXTENSIONS:
+        link_file(os.path.join(previous, model_path(pk, extension)), os.path.join(build, model_path(pk, extension)))
+        linked += 1
+
+  for path, response in files.items(): write_file(os.path.join(build, path), response().content)
+  write_file(os.path.join(build, MANIFEST), json.dumps({ 'revision': revision, 'fingerprints': prints }))
+
+  # Swap the new snapshot in, then clean up the old one. The link may have pointed at a
+  #   directory that this function didn't build, which is left alone.
+  temporary_link = '%s.link' % build
+  os.symlink(build, temporary_link)
+  os.rename(temporary_link, output)
+  if previous is not None and os.path.exists(os.path.join(previous, MANIFEST)): shutil.rmtree(previous)
+
+  return { 'snapshot': build, 'rendered': len(files), 'linked': linked, 'changed_models': changed }
+
+#--------------------------------------------------------------------------------------
+# Utility functions for writing files into a snapshot
+#--------------------------------------------------------------------------------------
+def has_model_files(snapshot, pk):
+  return all(os.path.exists(os.path.join(snapshot, model_path(pk, extension))) for extension in EXTENSIONS)
+
+def make_parent(path):
+  parent = os.path.dirname(path)
+  if not os.path.isdir(parent): os.makedirs(parent)
+
+def write_file(path, content):
+  make_parent(path)
+  with open(path, 'wb') as f: f.write(content)
+
+def link_file(source, destination):
+  make_parent(destination)
+  try:
+    os.link(source, destination)
+
+  # Some filesystems cannot hard-link. Fall back to copying.
+  except OSError:
+    shutil.copy2(source, destination)
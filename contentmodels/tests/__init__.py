@@ -1 +1,9 @@
-from contentmodel import ContentModelTestCase
\ No newline at end of file
+from contentmodel import ContentModelTestCase
+from views import CatalogViewsTestCase
+from sanitizer import SanitizerTestCase
+from snapshot import SnapshotTestCase
+from search import SearchTestCase
+from rewriterules import RewriteRuleSyncTestCase
+from resolver import ResolverTestCase
+from schemacache import SchemaCacheTestCase
+from schemarepository import SchemaRepositoryTestCase
@@ -0,0 +1,133 @@
+from django.test import TestCase
+from django.core.files.base import ContentFile
+from django.core.files import File
+from django.conf import settings
+from django.conf.urls import url
+from django.core.urlresolvers import RegexURLResolver
+from django.http import HttpResponse
+import os, shutil
+from contentmodels.models import ContentModel, ModelVersion, CatalogRevision
+from contentmodels.resolver import dataschema_index, dataschema_keys, negotiation_cache, DataschemaIndex
+from uriredirect.models import AcceptMapping
+from contentmodels.lru import LRUCache
+from contentmodels import views
+
+class ResolverTestCase(TestCase):
+  fixtures = [
+      "tests/cm-example.json"
+    ]
+  
+  def setUp(self):
+    dataschema_index.invalidate()
+    negotiation_cache.clear()
+    self.cm = ContentModel.objects.create(title="Resolver Test", label="resolvertest", description="Testing")
+    dummy_xsd_file = File(ContentFile("Dummy Schema File"), "dummyFile.xsd")
+    dummy_xls_file = File(ContentFile("Dummy Excel File"), "dummyFile.xls")
+    self.version = ModelVersion.objects.create(
+        content_model = self.cm,
+        version = "1.2",
+        xsd_file = dummy_xsd_file,
+        xls_file = dummy_xls_file
+      )
+  
+  def tearDown(self):
+    for cm in ContentModel.objects.all():
+      model_path = os.path.join(settings.MEDIA_ROOT, cm.folder_path())
+      if os.path.exists(model_path):
+        shutil.rmtree(model_path)
+  
+  def resolve(self, path, **extra):
+    return self.client.get('/uri-gin/%s/%s' % (settings.URI_REGISTER_LABEL, path), **extra)
+  
+  def assertRedirectsTo(self, response, url):
+    self.assertEqual(response.status_code, 302)
+    self.assertEqual(response['Location'], url)
+  
+  def test_keys(self):
+    """Paths should be split into (label, version) keys and extensions"""
+    self.assertEqual(list(dataschema_keys('dataschema/example/'))[0], (('example', None), None))
+    self.assertIn((('example', None), 'json'), list(dataschema_keys('dataschema/example/.json')))
+    self.assertIn((('example', '1.2'), None), list(dataschema_keys('dataschema/example/1.2/')))
+    self.assertIn((('example', '1.2'), 'xsd'), list(dataschema_keys('dataschema/example/1.2.xsd')))
+    self.assertEqual(list(dataschema_keys('xmlschema/example/')), [])
+  
+  def test_accept_header(self):
+    """A ContentModel URI should redirect by the Accept header"""
+    self.assertRedirectsTo(self.resolve('dataschema/resolvertest/', HTTP_ACCEPT='text/html'), self.cm.my_html())
+    self.assertRedirectsTo(self.resolve('dataschema/resolvertest/', HTTP_ACCEPT='text/json'), self.cm.my_json())
+    self.assertIn('Accept', self.resolve('dataschema/resolvertest/', HTTP_ACCEPT='text/html')['Vary'])
+  
+  def test_extension(self):
+    """A version URI with an extension should redirect to that file"""
+    self.assertRedirectsTo(self.resolve('dataschema/resolvertest/1.2.xsd'), self.version.absolute_xsd_path())
+    self.assertRedirectsTo(self.resolve('dataschema/resolvertest/1.2.xls'), self.version.absolute_xls_path())
+  
+  def test_not_found(self):
+    """Unknown URIs and extensions should not be found, and unacceptable types refused"""
+    self.assertEqual(self.resolve('dataschema/unknown/').status_code, 404)
+    self.assertEqual(self.resolve('dataschema/resolvertest/1.2.pdf').status_code, 404)
+    self.assertEqual(self.resolve('dataschema/resolvertest/', HTTP_ACCEPT='image/png').status_code, 406)
+  
+  def test_not_indexed(self):
+    """URIs that aren't in the index, like those of rules made by hand, should be left to uriredirect"""
+    resolver = views.uriredirect_resolver
+    views.uriredirect_resolver = RegexURLResolver(r'^/', [
+        url(r'^uri-gin/[^/]+/(?P<uri>dataschema/handmade/.*)$', lambda request, uri: HttpResponse(uri))
+      ])
+    try:
+      self.assertEqual(self.resolve('dataschema/handmade/1.0').content, 'dataschema/handmade/1.0')
+      self.assertEqual(self.resolve('dataschema/unknown/').status_code, 404)
+    finally:
+      views.uriredirect_resolver = resolver
+  
+  def test_no_queries(self):
+    """Resolving should not touch the database once the index is built"""
+    self.resolve('dataschema/resolvertest/', HTTP_ACCEPT='text/html')
+    with self.assertNumQueries(0):
+      self.resolve('dataschema/resolvertest/1.2.xsd')
+  
+  def test_incremental_update(self):
+    """Changes should be applied to the index without rebuilding it"""
+    self.resolve('dataschema/resolvertest/', HTTP_ACCEPT='text/html')
+    self.cm.label = "renamedtest"
+    self.cm.save()
+    self.assertNotEqual(dataschema_index.revision, None)
+    self.assertEqual(self.resolve('dataschema/resolvertest/').status_code, 404)
+    self.assertRedirectsTo(self.resolve('dataschema/renamedtest/1.2.xsd'), self.version.absolute_xsd_path())
+    
+    self.version.delete()
+    self.assertEqual(self.resolve('dataschema/renamedtest/1.2.xsd').status_code, 404)
+  
+  def test_hand_edit_other_process(self):
+    """A mapping edited by hand should reach the indexes of other processes too"""
+    other = DataschemaIndex()
+    other.rebuild()
+    mapping = AcceptMapping.objects.filter(rewrite_rule=self.version.rewrite_rule_id, media_type__file_extension__iexact='xsd')[0]
+    mapping.redirect_to = 'http://example.com/moved.xsd'
+    mapping.save()
+    self.assertEqual(other.revision + 1, CatalogRevision.current().number)
+    mappings, extension = other.lookup('dataschema/resolvertest/1.2.xsd')
+    self.assertIn('http://example.com/moved.xsd', [ url for mime_type, file_extension, url in mappings ])
+  
+  def test_negotiation_cache(self):
+    """Negotiating the same Accept header again should hit the cache"""
+    for i in range(3):
+      self.assertRedirectsTo(self.resolve('dataschema/resolvertest/', HTTP_ACCEPT='text/json'), self.cm.my_json())
+    self.assertEqual(negotiation_cache.stats()['misses'], 1)
+    self.assertEqual(negotiation_cache.stats()['hits'], 2)
+  
+  def test_malformed_accept(self):
+    """An Accept header that can't be parsed should accept nothing"""
+    self.assertEqual(self.resolve('dataschema/resolvertest/', HTTP_ACCEPT='text/html;q=abc').status_code, 406)
+  
+  def test_lru_eviction(self):
+    """The least recently used entry should be dropped when the cache is full"""
+    cache = LRUCache(2)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    cache.get('a')
+    cache.set('c', 3)
+    self.assertEqual(cache.get('b'), None)
+    self.assertEqual(cache.get('a'), 1)
+    self.assertEqual(cache.get('c'), 3)
+    self.assertEqual(cache.stats()['hit_ratio'], 0.75)
@@ -0,0 +1,184 @@
+from django.test import TestCase
+from django.core.files.base import ContentFile
+from django.core.files import File
+from django.conf import settings
+from django.core.management import call_command
+from StringIO import StringIO
+from django.db import connection
+import os, shutil
+from contentmodels.models import ContentModel, ModelVersion, CatalogRevision
+from contentmodels.uriconfigure import HTML_MEDIA, XLS_MEDIA, XSD_MEDIA, clear_lookup_cache
+from contentmodels.uriconfigure import deferred_rewrite_sync, flush_rewrite_sync, pending_work
+from uriredirect.models import AcceptMapping, MediaType, RewriteRule
+
+class RewriteRuleSyncTestCase(TestCase):
+  fixtures = [
+      "tests/cm-example.json"
+    ]
+  
+  def setUp(self):
+    clear_lookup_cache()
+    self.cm = ContentModel.objects.create(title="Sync Test", label="synctest", description="Testing")
+  
+  def tearDown(self):
+    for cm in ContentModel.objects.all():
+      model_path = os.path.join(settings.MEDIA_ROOT, cm.folder_path())
+      if os.path.exists(model_path):
+        shutil.rmtree(model_path)
+  
+  def createVersion(self, content_model, version):
+    """Create a ModelVersion with dummy files"""
+    dummy_xsd_file = File(ContentFile("Dummy Schema File"), "dummyFile.xsd")
+    dummy_xls_file = File(ContentFile("Dummy Excel File"), "dummyFile.xls")
+    return ModelVersion.objects.create(
+        content_model = content_model,
+        version = version,
+        xsd_file = dummy_xsd_file,
+        xls_file = dummy_xls_file
+      )
+  
+  def mappings(self, instance):
+    instance = type(instance).objects.get(pk=instance.pk)
+    return dict(( m.media_type_id, m.redirect_to ) for m in AcceptMapping.objects.filter(rewrite_rule=instance.rewrite_rule_id))
+  
+  def test_new_model_mappings(self):
+    """A new ContentModel's mappings should use its primary key"""
+    mappings = self.mappings(self.cm)
+    self.assertEqual(mappings[HTML_MEDIA().pk], self.cm.my_html())
+    self.assertNotIn("None", mappings[HTML_MEDIA().pk])
+    self.assertNotIn(XLS_MEDIA().pk, mappings)
+  
+  def test_version_mappings(self):
+    """Adding a version should point the ContentModel's file mappings at it"""
+    version = self.createVersion(self.cm, "1.0")
+    mappings = self.mappings(self.cm)
+    self.assertEqual(mappings[XLS_MEDIA().pk], version.absolute_xls_path())
+    self.assertEqual(mappings[XSD_MEDIA().pk], version.absolute_xsd_path())
+    self.assertEqual(self.mappings(version)[HTML_MEDIA().pk], self.cm.my_html())
+  
+  def test_deleted_version_mappings(self):
+    """Deleting the only version should remove the ContentModel's file mappings"""
+    version = self.createVersion(self.cm, "1.0")
+    version.delete()
+    mappings = self.mappings(self.cm)
+    self.assertNotIn(XLS_MEDIA().pk, mappings)
+    self.assertNotIn(XSD_MEDIA().pk, mappings)
+    self.assertIn(HTML_MEDIA().pk, mappings)
+  
+  def test_unchanged_save(self):
+    """Saving without changes should not write any rules or mappings"""
+    self.createVersion(self.cm, "1.0")
+    before = list(AcceptMapping.objects.order_by("pk").values_list("pk", "redirect_to"))
+    ContentModel.objects.get(pk=self.cm.pk).save()
+    after = list(AcceptMapping.objects.order_by("pk").values_list("pk", "redirect_to"))
+    self.assertEqual(before, after)
+  
+  def test_label_change(self):
+    """Changing a label should update the rules of the ContentModel and its versions"""
+    version = self.createVersion(self.cm, "1.0")
+    self.cm.label = "renamed"
+    self.cm.save()
+    version = ModelVersion.objects.get(pk=version.pk)
+    self.assertIn("renamed", version.rewrite_rule.pattern)
+    self.assertIn("renamed", ContentModel.objects.get(pk=self.cm.pk).rewrite_rule.pattern)
+  
+  def test_hand_made_mappings(self):
+    """Mappings to media types this app doesn't manage should be left alone"""
+    media_type = MediaType.objects.create(mime_type="application/pdf", file_extension="pdf")
+    AcceptMapping.objects.create(rewrite_rule=self.cm.rewrite_rule, media_type=media_type, redirect_to="http://example.com/doc.pdf")
+    self.cm.save()
+    self.assertEqual(self.mappings(self.cm)[media_type.pk], "http://example.com/doc.pdf")
+  
+  def test_duplicate_mappings(self):
+    """Duplicate mappings for a media type should be removed"""
+    AcceptMapping.objects.create(rewrite_rule=self.cm.rewrite_rule, media_type=HTML_MEDIA(), redirect_to="http://example.com/old.html")
+    self.cm.save()
+    self.assertEqual(AcceptMapping.objects.filter(rewrite_rule=self.cm.rewrite_rule, media_type=HTML_MEDIA()).count(), 1)
+    self.assertEqual(self.mappings(self.cm)[HTML_MEDIA().pk], self.cm.my_html())
+  
+  def test_deferred_sync(self):
+    """Rule work inside deferred_rewrite_sync should be done when the block exits"""
+    with deferred_rewrite_sync():
+      version = self.createVersion(self.cm, "1.0")
+      self.assertNotIn(XLS_MEDIA().pk, self.mappings(self.cm))
+      self.assertEqual(self.mappings(version), {})
+    self.assertEqual(self.mappings(self.cm)[XLS_MEDIA().pk], version.absolute_xls_path())
+    self.assertEqual(self.mappings(version)[XLS_MEDIA().pk], version.absolute_xls_path())
+  
+  def test_flush_scales(self):
+    """Syncing a ContentModel should take the same number of queries however many versions it has"""
+    def flush_queries(number_of_versions):
+      cm = ContentModel.objects.create(title="Scale %s" % number_of_versions, label="scale%s" % number_of_versions, description="Testing")
+      for i in range(number_of_versions):
+        self.createVersion(cm, "%s.0" % (i + 1))
+      pending_work().content_models.add(cm.pk)
+      connection.use_debug_cursor = True
+      try:
+        before = len(connection.queries)
+        flush_rewrite_sync()
+        return len(connection.queries) - before
+      finally:
+        connection.use_debug_cursor = False
+    self.assertEqual(flush_queries(2), flush_queries(10))
+  
+  def test_deferred_delete(self):
+    """Deleting a ContentModel should remove the rules and mappings of it and its versions"""
+    versions = [ self.createVersion(self.cm, "%s.0" % i) for i in range(1, 4) ]
+    rules = [ self.cm.rewrite_rule_id ] + [ v.rewrite_rule_id for v in versions ]
+    with deferred_rewrite_sync():
+      ContentModel.objects.get(pk=self.cm.pk).delete()
+    self.assertEqual(RewriteRule.objects.filter(pk__in=rules).count(), 0)
+    self.assertEqual(AcceptMapping.objects.filter(rewrite_rule__in=rules).count(), 0)
+  
+  def test_deferred_sync_exception(self):
+    """Saves made before the deferred block raised should still have their rules synced"""
+    version = self.createVersion(self.cm, "1.0")
+    try:
+      with deferred_rewrite_sync():
+        self.cm.title = "Changed"
+        self.cm.save()
+        raise ValueError()
+    except ValueError:
+      pass
+    self.assertEqual(ContentModel.objects.get(pk=self.cm.pk).rewrite_rule.label, "Changed")
+    self.assertEqual(ModelVersion.objects.get(pk=version.pk).rewrite_rule.label, "Changed v. 1.0")
+  
+  def test_deferred_delete_exception(self):
+    """The rules of objects that weren't deleted after all should be kept"""
+    rule = self.cm.rewrite_rule_id
+    try:
+      with deferred_rewrite_sync():
+        pending_work().deleted_rules.add(rule)
+        raise ValueError()
+    except ValueError:
+      pass
+    self.assertEqual(RewriteRule.objects.filter(pk=rule).count(), 1)
+  
+  def test_rebuild_rewrite_rules(self):
+    """rebuild_rewrite_rules should repair rules and mappings that are out of date"""
+    version = self.createVersion(self.cm, "1.0")
+    RewriteRule.objects.filter(pk=version.rewrite_rule_id).update(pattern="^broken$")
+    AcceptMapping.objects.filter(rewrite_rule=self.cm.rewrite_rule_id, media_type=HTML_MEDIA()).update(redirect_to="http://example.com/old.html")
+    
+    # A dry run lists the changes without making them
+    output = StringIO()
+    call_command("rebuild_rewrite_rules", dry_run=True, stdout=output)
+    self.assertIn("http://example.com/old.html -> %s" % self.cm.my_html(), output.getvalue())
+    self.assertIn("^broken$ -> %s" % version.regex_pattern(), output.getvalue())
+    self.assertEqual(RewriteRule.objects.get(pk=version.rewrite_rule_id).pattern, "^broken$")
+    
+    revision = CatalogRevision.current().number
+    call_command("rebuild_rewrite_rules", stdout=StringIO())
+    self.assertEqual(RewriteRule.objects.get(pk=version.rewrite_rule_id).pattern, version.regex_pattern())
+    self.assertEqual(self.mappings(self.cm)[HTML_MEDIA().pk], self.cm.my_html())
+    
+    # Web processes find out about the changes through the catalog's revision
+    self.assertEqual(CatalogRevision.current().number, revision + 1)
+    call_command("rebuild_rewrite_rules", stdout=StringIO())
+    self.assertEqual(CatalogRevision.current().number, revision + 1)
+    
+    # Nothing is left to change
+    output = StringIO()
+    call_command("rebuild_rewrite_rules", dry_run=True, stdout=output)
+    self.assertIn("Mappings: 0 created, 0 updated, 0 deleted", output.getvalue())
+    self.assertIn("Rules: 0 created, 0 fields updated", output.getvalue())
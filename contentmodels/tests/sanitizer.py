@@ -0,0 +1,50 @@
+from django.test import TestCase
+from django.core.management import call_command
+from contentmodels.models import ContentModel, removeTags
+from StringIO import StringIO
+
+class SanitizerTestCase(TestCase):
+  fixtures = [
+      "tests/cm-example.json"
+    ]
+  
+  def setUp(self):
+    self.example = ContentModel.objects.get(label="example")
+    
+  def test_removes_tags(self):
+    """Tags other than anchors should be removed, leaving their text"""
+    self.assertEqual(removeTags('<p>Some <b>bold</b> <span class="x">text</span></p><br/>'), 'Some bold text')
+    
+  def test_keeps_anchors(self):
+    """Anchors should be kept, whatever their case or attributes"""
+    html = '<p><a href="http://usgin.org">USGIN</a> and <A HREF="#top">top</A></p>'
+    self.assertEqual(removeTags(html), '<a href="http://usgin.org">USGIN</a> and <A HREF="#top">top</A>')
+    
+  def test_removes_tags_starting_with_a(self):
+    """Tags whose names merely start with an a should still be removed"""
+    self.assertEqual(removeTags('<abbr title="x">USGIN</abbr> <address>here</address>'), 'USGIN here')
+    
+  def test_removes_nbsp(self):
+    """Non-breaking space entities should be removed"""
+    self.assertEqual(removeTags('one&nbsp;two'), 'onetwo')
+    
+  def test_sanitized_on_save(self):
+    """Saving a ContentModel should store its sanitized text"""
+    self.example.description = '<p>New <a href="#">description</a></p>'
+    self.example.discussion = '<div>Discussion</div>'
+    self.example.status = '<em>Status</em>'
+    self.example.save()
+    
+    stored = ContentModel.objects.get(pk=self.example.pk)
+    self.assertEqual(stored.sanitized_description, 'New <a href="#">description</a>')
+    self.assertEqual(stored.sanitized_discussion, 'Discussion')
+    self.assertEqual(stored.sanitized_status, 'Status')
+    self.assertEqual(stored.cleaned_description(), stored.sanitized_description)
+    
+  def test_resanitize_command(self):
+    """The resanitize command should bring stale sanitized text up to date"""
+    ContentModel.objects.filter(pk=self.example.pk).update(
+        description='<p>Stale</p>', sanitized_description='<p>Stale</p>'
+      )
+    call_command('resanitize', stdout=StringIO())
+    self.assertEqual(ContentModel.objects.get(pk=self.example.pk).sanitized_description, 'Stale')
@@ -0,0 +1,74 @@
+from django.test import TestCase
+from django.core.files.base import ContentFile
+from django.core.files import File
+from django.conf import settings
+import os, shutil
+from contentmodels.models import ContentModel, ModelVersion
+from contentmodels.schemacache import schema_cache, cached_schema, warm_schema_cache, schema_hash
+from lxml import etree
+
+SCHEMA = '''<?xml version="1.0"?>
+<xs:schema xmlns:xs="http://www.w3.org/2001/XMLSchema">
+  <xs:element name="%s" type="xs:string"/>
+</xs:schema>'''
+
+class SchemaCacheTestCase(TestCase):
+  fixtures = [
+      "tests/cm-example.json"
+    ]
+  
+  def setUp(self):
+    schema_cache.clear()
+    self.cm = ContentModel.objects.create(title="Schema Test", label="schematest", description="Testing")
+    self.version = self.createVersion("1.0", "first")
+  
+  def tearDown(self):
+    for cm in ContentModel.objects.all():
+      model_path = os.path.join(settings.MEDIA_ROOT, cm.folder_path())
+      if os.path.exists(model_path):
+        shutil.rmtree(model_path)
+  
+  def createVersion(self, version, element):
+    """Create a ModelVersion whose schema defines one element"""
+    return ModelVersion.objects.create(
+        content_model = self.cm,
+        version = version,
+        xsd_file = File(ContentFile(SCHEMA % element), "schema.xsd"),
+        xls_file = File(ContentFile("Dummy Excel File"), "dummyFile.xls")
+      )
+  
+  def test_compiled_once(self):
+    """The same compiled schema should be returned until the file changes"""
+    schema = self.version.schema_validator()
+    self.assertTrue(schema.validate(etree.fromstring('<first>text</first>')))
+    self.assertTrue(self.version.schema_validator() is schema)
+    self.assertEqual(schema_cache.stats()['hits'], 1)
+  
+  def test_new_upload(self):
+    """Uploading a new XSD should invalidate the compiled schema"""
+    schema = self.version.schema_validator()
+    self.version.xsd_file = File(ContentFile(SCHEMA % "second"), "schema.xsd")
+    self.version.save()
+    self.assertEqual(len(schema_cache), 0)
+    self.assertTrue(self.version.schema_validator().validate(etree.fromstring('<second>text</second>')))
+  
+  def test_changed_file(self):
+    """A file changed outside of Django should be compiled again"""
+    schema = self.version.schema_validator()
+    with open(self.version.xsd_file.path, 'w') as f: f.write(SCHEMA % "changedelement")
+    self.assertFalse(self.version.schema_validator() is schema)
+    self.assertTrue(self.version.schema_validator().validate(etree.fromstring('<changedelement>text</changedelement>')))
+  
+  def test_warm_schema_cache(self):
+    """Warming the cache should compile the latest version of each ContentModel"""
+    latest = self.createVersion("2.0", "latest")
+    compiled = warm_schema_cache()
+    self.assertIn((latest.pk, None), [ (version.pk, error) for version, seconds, error in compiled ])
+    self.assertTrue(cached_schema(latest) is schema_cache.get(latest.pk))
+  
+  def test_schema_hash(self):
+    """The schema's hash should follow its content, not its file"""
+    same = self.createVersion("1.1", "first")
+    self.assertEqual(schema_hash(self.version), schema_hash(same))
+    with open(self.version.xsd_file.path, 'w') as f: f.write(SCHEMA % "changedelement")
+    self.assertNotEqual(schema_hash(self.version), schema_hash(same))
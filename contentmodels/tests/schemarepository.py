@@ -0,0 +1,88 @@
+from django.test import TestCase
+from django.test.utils import override_settings
+from lxml import etree
+import os, shutil, tempfile, logging
+from contentmodels.schemarepository import pin_schemas, verify_catalog, compile_offline, load_catalog, repository_path, SchemaNotPinned
+
+REPOSITORY = os.path.join(tempfile.gettempdir(), 'contentmodels-test-schemas')
+
+# Remote schemas, as a fake server would return them. base.xsd includes types.xsd by a
+#   relative location.
+REMOTE = {
+  'http://schemas.example.com/base/1.0/base.xsd': '''<?xml version="1.0"?>
+<xs:schema xmlns:xs="http://www.w3.org/2001/XMLSchema" targetNamespace="urn:base">
+  <xs:include schemaLocation="types.xsd"/>
+</xs:schema>''',
+  'http://schemas.example.com/base/1.0/types.xsd': '''<?xml version="1.0"?>
+<xs:schema xmlns:xs="http://www.w3.org/2001/XMLSchema" targetNamespace="urn:base">
+  <xs:simpleType name="Code"><xs:restriction base="xs:string"><xs:pattern value="[A-Z]+"/></xs:restriction></xs:simpleType>
+</xs:schema>'''
+}
+
+LOCAL = '''<?xml version="1.0"?>
+<xs:schema xmlns:xs="http://www.w3.org/2001/XMLSchema" xmlns:base="urn:base" targetNamespace="urn:model">
+  <xs:import namespace="urn:base" schemaLocation="http://schemas.example.com/base/1.0/base.xsd"/>
+  <xs:element name="code" type="base:Code"/>
+</xs:schema>'''
+
+@override_settings(CONTENTMODELS_SCHEMA_REPOSITORY=REPOSITORY)
+class SchemaRepositoryTestCase(TestCase):
+  def setUp(self):
+    self.fetched = []
+    os.makedirs(REPOSITORY)
+    self.schema_path = os.path.join(REPOSITORY, 'model.xsd')
+    with open(self.schema_path, 'w') as f: f.write(LOCAL)
+  
+  def tearDown(self):
+    shutil.rmtree(REPOSITORY)
+  
+  def fetch(self, url):
+    """Serve the fake remote schemas, remembering what was asked for"""
+    self.fetched.append(url)
+    return REMOTE[url]
+  
+  def test_pin_dependencies(self):
+    """Pinning a schema should also pin the schemas it includes"""
+    pin_schemas(['http://schemas.example.com/base/1.0/base.xsd'], fetch=self.fetch)
+    self.assertEqual(sorted(load_catalog().keys()), sorted(REMOTE.keys()))
+    self.assertTrue(os.path.exists(os.path.join(repository_path(), 'schemas.example.com/base/1.0/types.xsd')))
+    
+    # Pinned schemas aren't fetched again
+    self.assertEqual(pin_schemas(['http://schemas.example.com/base/1.0/base.xsd'], fetch=self.fetch), [])
+    self.assertEqual(len(self.fetched), 2)
+  
+  def test_compile_offline(self):
+    """A schema importing pinned schemas should compile from the repository"""
+    pin_schemas(['http://schemas.example.com/base/1.0/base.xsd'], fetch=self.fetch)
+    schema = compile_offline(self.schema_path)
+    self.assertTrue(schema.validate(etree.fromstring('<m:code xmlns:m="urn:model">ABC</m:code>')))
+    self.assertFalse(schema.validate(etree.fromstring('<m:code xmlns:m="urn:model">abc</m:code>')))
+  
+  def test_not_pinned(self):
+    """A schema importing remote schemas that aren't pinned should not compile"""
+    pin_schemas(['http://schemas.example.com/base/1.0/types.xsd'], fetch=self.fetch)
+    self.assertRaises(SchemaNotPinned, compile_offline, self.schema_path)
+  
+  def test_nothing_pinned(self):
+    """While nothing is pinned, remote imports should be fetched with a warning, unless strict"""
+    self.assertRaises(SchemaNotPinned, compile_offline, self.schema_path, strict=True)
+    
+    warnings = []
+    handler = logging.Handler()
+    handler.emit = warnings.append
+    logger = logging.getLogger('contentmodels.schemarepository')
+    logger.addHandler(handler)
+    try:
+      # The fake remote schemas aren't on the network, so compiling fails there instead
+      self.assertRaises(etree.XMLSchemaParseError, compile_offline, self.schema_path)
+    finally:
+      logger.removeHandler(handler)
+    self.assertEqual(len(warnings), 1)
+    self.assertIn('pin_schemas', warnings[0].getMessage())
+  
+  def test_verify(self):
+    """Pinned files that have changed should be reported"""
+    pin_schemas(['http://schemas.example.com/base/1.0/base.xsd'], fetch=self.fetch)
+    self.assertEqual(verify_catalog(), [])
+    with open(os.path.join(repository_path(), 'schemas.example.com/base/1.0/types.xsd'), 'a') as f: f.write(' ')
+    self.assertEqual(len(verify_catalog()), 1)
@@ -0,0 +1,86 @@
+from django.test import TestCase
+from django.core.files.base import ContentFile
+from django.core.files import File
+from django.core.management import call_command
+from django.conf import settings
+import os, shutil, json
+from StringIO import StringIO
+from contentmodels.models import ContentModel, ModelVersion, SearchTerm
+from contentmodels.searchindex import tokenize
+
+class SearchTestCase(TestCase):
+  fixtures = [
+      "tests/cm-example.json"
+    ]
+  
+  def setUp(self):
+    self.example = ContentModel.objects.get(label="example")
+    self.heat = ContentModel.objects.create(
+        title="Borehole Temperature Observation", label="boreholetemperature",
+        description="<p>Temperature measured in a <a href='#'>borehole</a>.</p>"
+      )
+    self.wells = ContentModel.objects.create(
+        title="Well Headers", label="wellheader",
+        description="Header information for wells, including borehole temperature where known."
+      )
+  
+  def tearDown(self):
+    for cm in ContentModel.objects.all():
+      model_path = os.path.join(settings.MEDIA_ROOT, cm.folder_path())
+      if os.path.exists(model_path):
+        shutil.rmtree(model_path)
+  
+  def search(self, query):
+    response = self.client.get('/contentmodels/search.json', { 'q': query })
+    self.assertEqual(response.status_code, 200)
+    return json.loads(response.content)
+  
+  def titles(self, query):
+    return [ result['title'] for result in self.search(query)['results'] ]
+  
+  def test_tokenize(self):
+    """Terms should be lowercase words and version numbers, without markup"""
+    self.assertEqual(tokenize('<p>Borehole &nbsp;<a href="x">Temp</a>, v. 1.2.</p>'), ['borehole', 'temp', 'v', '1.2'])
+  
+  def test_ranking(self):
+    """Models with the terms in their titles should rank above those with them in descriptions"""
+    self.assertEqual(self.titles('borehole temperature'), ["Borehole Temperature Observation", "Well Headers"])
+    
+  def test_all_terms_required(self):
+    """Every term in the query should have to match"""
+    self.assertEqual(self.titles('borehole wells'), ["Well Headers"])
+    self.assertEqual(self.titles('nothing like this'), [])
+    self.assertEqual(self.search('')['total'], 0)
+    
+  def test_prefix(self):
+    """The last term should also match as a prefix"""
+    self.assertEqual(self.titles('bore'), ["Borehole Temperature Observation", "Well Headers"])
+    
+  def test_prefix_of_another_term(self):
+    """A word should match both itself and the last term, when that is its prefix"""
+    self.assertEqual(self.titles('temperature temp'), ["Borehole Temperature Observation", "Well Headers"])
+    
+  def test_index_follows_changes(self):
+    """Saving models and versions should keep the index current"""
+    self.heat.title = "Heat Flow"
+    self.heat.save()
+    self.assertEqual(self.titles('heat'), ["Heat Flow"])
+    
+    v = ModelVersion.objects.create(
+        content_model = self.example,
+        version = "1.5",
+        xsd_file = File(ContentFile("Dummy Schema File"), "dummyFile.xsd"),
+        xls_file = File(ContentFile("Dummy Excel File"), "dummyFile.xls")
+      )
+    self.assertEqual(self.titles('1.5'), ["Example ContentModel"])
+    v.delete()
+    self.assertEqual(self.titles('1.5'), [])
+    
+    self.wells.delete()
+    self.assertEqual(SearchTerm.objects.filter(content_model=self.wells.pk).count(), 0)
+    
+  def test_rebuild_command(self):
+    """Rebuilding the index should give the same results"""
+    before = self.search('temperature')
+    call_command('rebuild_search_index', stdout=StringIO())
+    self.assertEqual(self.search('temperature'), before)
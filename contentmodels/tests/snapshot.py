@@ -0,0 +1,91 @@
+from django.test import TestCase
+from django.core.files.base import ContentFile
+from django.core.files import File
+from django.conf import settings
+import os, shutil, tempfile
+from contentmodels.models import ContentModel, ModelVersion
+from contentmodels.snapshot import export_catalog
+from contentmodels import catalogcache
+
+class SnapshotTestCase(TestCase):
+  fixtures = [
+      "tests/cm-example.json"
+    ]
+  
+  def setUp(self):
+    self.example = ContentModel.objects.get(label="example")
+    self.other = ContentModel.objects.create(title="Other Model", label="other", description="Other")
+    self.createVersion(self.example, "1.0")
+    self.createVersion(self.other, "1.0")
+    self.directory = tempfile.mkdtemp()
+    self.output = os.path.join(self.directory, 'catalog')
+    catalogcache.get_catalog_cache().clear()
+    
+  def tearDown(self):
+    shutil.rmtree(self.directory)
+    for cm in ContentModel.objects.all():
+      model_path = os.path.join(settings.MEDIA_ROOT, cm.folder_path())
+      if os.path.exists(model_path):
+        shutil.rmtree(model_path)
+        
+  def createVersion(self, content_model, version):
+    return ModelVersion.objects.create(
+        content_model = content_model,
+        version = version,
+        xsd_file = File(ContentFile("Dummy Schema File"), "dummyFile.xsd"),
+        xls_file = File(ContentFile("Dummy Excel File"), "dummyFile.xls")
+      )
+    
+  def read(self, path):
+    return open(os.path.join(self.output, path), 'rb').read()
+  
+  def test_export(self):
+    """Every representation should be written, matching what the site serves"""
+    export_catalog(self.output)
+    self.assertTrue(os.path.islink(self.output))
+    for extension in catalogcache.EXTENSIONS:
+      url = 'contentmodels.%s' % extension
+      self.assertEqual(self.read(url), self.client.get('/' + url).content)
+      for cm in [self.example, self.other]:
+        url = 'contentmodel/%s.%s' % (cm.pk, extension)
+        self.assertEqual(self.read(url), self.client.get('/' + url).content)
+    self.assertEqual(self.read('models/index.html'), self.client.get('/models/').content)
+    self.assertEqual(self.read('home/index.html'), self.client.get('/home/').content)
+    
+  def test_export_replaces_snapshot(self):
+    """A second export should replace the first one and clean it up"""
+    first = export_catalog(self.output)['snapshot']
+    second = export_catalog(self.output)['snapshot']
+    self.assertEqual(os.path.realpath(self.output), second)
+    self.assertFalse(os.path.exists(first))
+    
+  def test_export_changed(self):
+    """Only the files of changed models should be rendered again"""
+    export_catalog(self.output)
+    other_json = os.path.join(self.output, 'contentmodel/%s.json' % self.other.pk)
+    inode = os.stat(other_json).st_ino
+    
+    # Nothing changed: nothing to do
+    self.assertEqual(export_catalog(self.output, changed_only=True)['rendered'], 0)
+    
+    self.createVersion(self.example, "2.0")
+    result = export_catalog(self.output, changed_only=True)
+    self.assertEqual(result['changed_models'], [str(self.example.pk)])
+    self.assertEqual(os.stat(other_json).st_ino, inode)
+    self.assertEqual(self.read('contentmodel/%s.json' % self.example.pk), self.client.get('/contentmodel/%s.json' % self.example.pk).content)
+    self.assertEqual(self.read('contentmodels.json'), self.client.get('/contentmodels.json').content)
+    
+  def test_export_refuses_directory(self):
+    """An existing directory at the output path should not be replaced"""
+    os.mkdir(self.output)
+    self.assertRaises(ValueError, export_catalog, self.output)
+    
+  def test_export_keeps_foreign_directory(self):
+    """A directory the link pointed at, that isn't a snapshot, should not be removed"""
+    docroot = os.path.join(self.directory, 'docroot')
+    os.mkdir(docroot)
+    open(os.path.join(docroot, 'index.html'), 'w').close()
+    os.symlink(docroot, self.output)
+    export_catalog(self.output)
+    self.assertTrue(os.path.exists(os.path.join(docroot, 'index.html')))
+    self.assertNotEqual(os.path.realpath(self.output), docroot)
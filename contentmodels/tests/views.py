@@ -0,0 +1,276 @@
+from django.test import TestCase
+from django.test.client import RequestFactory
+from django.core.files.base import ContentFile
+from django.core.files import File
+from django.conf import settings
+import os, shutil, json, gzip
+from StringIO import StringIO
+from lxml import etree
+from contentmodels.models import ContentModel, ModelVersion
+from contentmodels import catalogcache
+from contentmodels.uriconfigure import deferred_rewrite_sync
+
+class CatalogViewsTestCase(TestCase):
+  fixtures = [
+      "tests/cm-example.json"
+    ]
+  
+  # Catalog views should cost this many queries, however many models there are. The
+  #   contentmodel(s).* views need one more to read the CatalogRevision, and the Atom
+  #   feed another for its aggregate date.
+  catalog_urls = [
+      ('/contentmodels.json', 3),
+      ('/contentmodels.html', 3),
+      ('/contentmodels.xml', 4),
+      ('/contentmodels.drupal', 3),
+      ('/models/', 2),
+      ('/home/', 2)
+    ]
+  
+  def setUp(self):
+    self.example = ContentModel.objects.get(label="example")
+    catalogcache.get_catalog_cache().clear()
+    
+  def tearDown(self):
+    # Remove any files that may have been added in the course of adding versions
+    for cm in ContentModel.objects.all():
+      model_path = os.path.join(settings.MEDIA_ROOT, cm.folder_path())
+      if os.path.exists(model_path):
+        shutil.rmtree(model_path)
+  
+  def createVersion(self, content_model, version):
+    """Create a ModelVersion with dummy files"""
+    dummy_xsd_file = File(ContentFile("Dummy Schema File"), "dummyFile.xsd")
+    dummy_xls_file = File(ContentFile("Dummy Excel File"), "dummyFile.xls")
+    return ModelVersion.objects.create(
+        content_model = content_model,
+        version = version,
+        xsd_file = dummy_xsd_file,
+        xls_file = dummy_xls_file
+      )
+  
+  def createModels(self, number_of_models, versions_per_model):
+    """Create a number of ContentModels, each with a number of versions"""
+    for i in range(number_of_models):
+      cm = ContentModel.objects.create(
+          title = "Generated Model %s" % i,
+          label = "generated-%s" % i,
+          description = "<p>Description %s</p>" % i
+        )
+      for v in range(versions_per_model):
+        self.createVersion(cm, "%s.0" % (v + 1))
+  
+  def assertCatalogQueries(self, url, queries):
+    catalogcache.get_catalog_cache().clear()
+    self.assertNumQueries(queries, lambda: self.client.get(url))
+  
+  def test_catalog_query_count_is_constant(self):
+    """Catalog views should issue the same number of queries no matter how many models exist"""
+    self.createVersion(self.example, "1.0")
+    for url, queries in self.catalog_urls: self.assertCatalogQueries(url, queries)
+    
+    self.createModels(5, 3)
+    for url, queries in self.catalog_urls: self.assertCatalogQueries(url, queries)
+    
+  def test_single_model_query_count(self):
+    """A single model's representations should also be served in a constant number of queries"""
+    self.createVersion(self.example, "1.0")
+    self.createVersion(self.example, "2.0")
+    for extension in ['json', 'html', 'xml', 'drupal']:
+      queries = 4 if extension == 'xml' else 3
+      self.assertCatalogQueries('/contentmodel/%s.%s' % (self.example.pk, extension), queries)
+  
+  def test_with_catalog_data_latest_version(self):
+    """Helpers should give the same answers from prefetched data as they do without it"""
+    self.createVersion(self.example, "1.0")
+    self.createVersion(self.example, "2.0")
+    prefetched = ContentModel.objects.with_catalog_data().get(pk=self.example.pk)
+    self.assertEqual(prefetched.latest_version(), self.example.latest_version())
+    self.assertEqual(prefetched.date_updated(), self.example.date_updated())
+    self.assertEqual(prefetched.serialized(), self.example.serialized())
+    
+  def test_paged_json(self):
+    """Walking contentmodels.json page by page should return every model once, in catalog order"""
+    self.createModels(5, 1)
+    everything = json.loads(self.client.get('/contentmodels.json').content)
+    
+    pages = []
+    url = '/contentmodels.json?limit=2'
+    while url:
+      response = self.client.get(url)
+      self.assertEqual(response.status_code, 200)
+      pages.append(json.loads(response.content))
+      url = None
+      if response.has_header('Link'):
+        url = response['Link'].split(';')[0].strip('<>').replace(settings.BASE_URL.rstrip('/'), '')
+        
+    self.assertEqual([ len(page) for page in pages ], [2, 2, 2])
+    self.assertEqual(sum(pages, []), everything)
+    
+  def test_paged_json_bad_parameters(self):
+    """Invalid limits and unknown cursors should be rejected"""
+    for query in ['limit=0', 'limit=abc', 'limit=1000', 'after=abc', 'after=9999']:
+      self.assertEqual(self.client.get('/contentmodels.json?%s' % query).status_code, 400)
+      
+  def test_streamed_json(self):
+    """The streamed catalog should match the regular JSON catalog"""
+    self.createModels(5, 2)
+    everything = json.loads(self.client.get('/contentmodels.json').content)
+    streamed = json.loads(self.client.get('/contentmodels.json?stream=true').content)
+    self.assertEqual(streamed, everything)
+    
+  def test_in_batches(self):
+    """Iterating in batches should visit every model once, in catalog order"""
+    self.createModels(7, 0)
+    expected = list(ContentModel.objects.all().in_catalog_order())
+    self.assertEqual(list(ContentModel.objects.with_catalog_data().in_batches(3)), expected)
+
+  def test_etag_not_modified(self):
+    """A client sending back the current ETag should get a 304 without touching the database"""
+    for url, queries in self.catalog_urls[:4]:
+      etag = self.client.get(url)['ETag']
+      with self.assertNumQueries(0):
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+      self.assertEqual(response.status_code, 304)
+      self.assertEqual(response.content, '')
+      
+  def test_etag_changes_with_catalog(self):
+    """Saving a model should change the ETag, so old copies are sent again in full"""
+    etag = self.client.get('/contentmodels.json')['ETag']
+    self.example.status = "Changed"
+    self.example.save()
+    response = self.client.get('/contentmodels.json', HTTP_IF_NONE_MATCH=etag)
+    self.assertEqual(response.status_code, 200)
+    self.assertNotEqual(response['ETag'], etag)
+    
+  def test_if_modified_since(self):
+    """A client that has a copy from after the last change should get a 304"""
+    url = '/contentmodel/%s.xml' % self.example.pk
+    last_modified = self.client.get(url)['Last-Modified']
+    self.assertEqual(self.client.get(url, HTTP_IF_MODIFIED_SINCE=last_modified).status_code, 304)
+    self.assertEqual(self.client.get(url, HTTP_IF_MODIFIED_SINCE='Sat, 01 Jan 2000 00:00:00 GMT').status_code, 200)
+
+  def test_cached_responses(self):
+    """Rendered responses should be served from the cache until the catalog changes"""
+    self.createVersion(self.example, "1.0")
+    for extension in catalogcache.EXTENSIONS:
+      for url in ['/contentmodels.%s' % extension, '/contentmodel/%s.%s' % (self.example.pk, extension)]:
+        first = self.client.get(url)
+        with self.assertNumQueries(0):
+          second = self.client.get(url)
+        self.assertEqual(second.content, first.content)
+        self.assertEqual(second['Content-Type'], first['Content-Type'])
+  
+  def test_cached_responses_invalidated(self):
+    """Saving a version should remove the stale responses from the cache"""
+    url = '/contentmodel/%s.json' % self.example.pk
+    self.assertEqual(json.loads(self.client.get(url).content)[0]['versions'], [])
+    self.assertEqual(json.loads(self.client.get('/contentmodels.json').content)[0]['versions'], [])
+    
+    self.createVersion(self.example, "1.0")
+    self.assertEqual(len(json.loads(self.client.get(url).content)[0]['versions']), 1)
+    self.assertEqual(len(json.loads(self.client.get('/contentmodels.json').content)[0]['versions']), 1)
+  
+  def test_cached_responses_leading_zeros(self):
+    """A model's responses should be invalidated however its id was spelled"""
+    url = '/contentmodel/0%s.json' % self.example.pk
+    self.assertEqual(json.loads(self.client.get(url).content)[0]['versions'], [])
+    self.createVersion(self.example, "1.0")
+    self.assertEqual(len(json.loads(self.client.get(url).content)[0]['versions']), 1)
+  
+  def test_response_rendered_before_change(self):
+    """A response rendered before a change, but stored after it, should not be served"""
+    url = '/contentmodel/%s.json' % self.example.pk
+    render = catalogcache.cached_catalog_response('model')
+    def view(request, id, extension):
+      response = self.client.get(url)
+      self.createVersion(self.example, "1.0")
+      return response
+    render(view)(RequestFactory().get(url), id=str(self.example.pk), extension='json')
+    self.assertEqual(len(json.loads(self.client.get(url).content)[0]['versions']), 1)
+  
+  def test_invalidated_after_deferred_block(self):
+    """Changes made in a deferred block, like the admin's, should invalidate the cache when it ends"""
+    url = '/contentmodel/%s.json' % self.example.pk
+    self.client.get(url)
+    revision = catalogcache.revision_number()
+    with deferred_rewrite_sync():
+      self.createVersion(self.example, "1.0")
+      self.assertEqual(catalogcache.revision_number(), revision)
+    self.assertTrue(catalogcache.revision_number() > revision)
+    self.assertEqual(len(json.loads(self.client.get(url).content)[0]['versions']), 1)
+  
+  def test_cache_stats(self):
+    """Cache hits and misses should be counted"""
+    catalogcache.reset_stats()
+    self.client.get('/contentmodels.json')
+    self.client.get('/contentmodels.json')
+    self.client.get('/contentmodels.json')
+    self.assertEqual(catalogcache.stats(), { 'hits': 2, 'misses': 1, 'hit_ratio': 2.0 / 3 })
+
+  def test_atom_feed(self):
+    """The Atom feed should be well-formed, escape text properly, and be dated by the latest version"""
+    self.example.description = u'Rock & <a href="http://usgin.org">roll</a> \x0b<b>bold</b> \xe9'
+    self.example.save()
+    v = self.createVersion(self.example, "1.0")
+    self.createModels(2, 0)
+    
+    ns = { 'atom': 'http://www.w3.org/2005/Atom', 'cm': 'http://schemas.usgin.org/contentmodels' }
+    feed = etree.fromstring(self.client.get('/contentmodels.xml').content)
+    self.assertEqual(len(feed.xpath('atom:entry', namespaces=ns)), 3)
+    self.assertEqual(feed.xpath('string(atom:updated)', namespaces=ns), '%sT12:00:00-05:00' % v.date_created.isoformat())
+    self.assertEqual(feed.xpath('string(atom:id)', namespaces=ns), 'http://schemas.usgin.org/contentmodels.xml')
+    
+    description = feed.xpath('string(atom:entry/atom:content/cm:description)', namespaces=ns)
+    self.assertEqual(description, u'Rock & <a href="http://usgin.org">roll</a> bold \xe9')
+    
+  def test_single_model_atom_feed(self):
+    """A feed with a single model should take that model's id"""
+    ns = { 'atom': 'http://www.w3.org/2005/Atom' }
+    feed = etree.fromstring(self.client.get('/contentmodel/%s.xml' % self.example.pk).content)
+    self.assertEqual(feed.xpath('string(atom:id)', namespaces=ns), self.example.my_atom())
+    self.assertEqual(len(feed.xpath('atom:entry', namespaces=ns)), 1)
+
+  def test_last_updated(self):
+    """last_updated should follow the latest version as versions come and go"""
+    self.assertIsNone(ContentModel.objects.get(pk=self.example.pk).last_updated)
+    v = self.createVersion(self.example, "1.0")
+    self.assertEqual(ContentModel.objects.get(pk=self.example.pk).last_updated, v.date_created)
+    
+    # Saving a stale instance should not lose the date
+    self.example.save()
+    self.assertEqual(ContentModel.objects.get(pk=self.example.pk).last_updated, v.date_created)
+    
+    v.delete()
+    self.assertIsNone(ContentModel.objects.get(pk=self.example.pk).last_updated)
+    
+  def test_homepage_recent_models(self):
+    """The homepage should list up to three models that have versions, most recent first"""
+    self.createModels(4, 1)
+    ContentModel.objects.filter(label="generated-1").update(last_updated="2000-01-01")
+    recent = self.client.get('/home/').context['recent_models']
+    self.assertEqual([ cm.label for cm in recent ], ["generated-0", "generated-2", "generated-3"])
+
+  def test_compressed_responses(self):
+    """Clients that accept gzip should get the cached, precompressed variant"""
+    self.createModels(5, 2)
+    identity = self.client.get('/contentmodels.json')
+    self.assertFalse(identity.has_header('Content-Encoding'))
+    self.assertIn('Accept-Encoding', identity['Vary'])
+    
+    with self.assertNumQueries(0):
+      compressed = self.client.get('/contentmodels.json', HTTP_ACCEPT_ENCODING='gzip, deflate')
+    self.assertEqual(compressed['Content-Encoding'], 'gzip')
+    self.assertEqual(gzip.GzipFile(fileobj=StringIO(compressed.content)).read(), identity.content)
+    self.assertTrue(len(compressed.content) < len(identity.content))
+    
+    refused = self.client.get('/contentmodels.json', HTTP_ACCEPT_ENCODING='gzip;q=0')
+    self.assertFalse(refused.has_header('Content-Encoding'))
+    
+  def test_compressed_variant_description(self):
+    """Cached variants should report their size and compression time"""
+    self.createModels(5, 2)
+    self.client.get('/contentmodels.xml')
+    variants = catalogcache.describe_entry('all', None, 'xml')
+    self.assertTrue(variants['gzip']['size'] < variants['identity']['size'])
+    self.assertTrue(variants['gzip']['seconds'] >= 0)
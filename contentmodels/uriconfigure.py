@@ -1,34 +1,67 @@
 from uriredirect.models import UriRegister, RewriteRule, MediaType, AcceptMapping
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import Signal
 from django.conf import settings
+from functools import wraps
+from catalogcache import flush_invalidation
+import logging, threading
+
+logger = logging.getLogger(__name__)
+
+#--------------------------------------------------------------------------------------
+# In-process cache of the register and media types, which hardly ever change. Entries
+#   are dropped whenever a UriRegister or MediaType is saved or deleted.
+#--------------------------------------------------------------------------------------
+_lookup_cache = {}
+
+def clear_lookup_cache(sender=None, **kwargs):
+  _lookup_cache.clear()
+
+post_save.connect(clear_lookup_cache, sender=UriRegister)
+post_delete.connect(clear_lookup_cache, sender=UriRegister)
+post_save.connect(clear_lookup_cache, sender=MediaType)
+post_delete.connect(clear_lookup_cache, sender=MediaType)
 
 #--------------------------------------------------------------------------------------
 # Utility function to retrieve the default URI register
 #--------------------------------------------------------------------------------------
 def get_default_register():
+  key = ('register', settings.URI_REGISTER_LABEL)
+  if key in _lookup_cache: return _lookup_cache[key]
+
   # Attempt to retrieve the default register defined in the project's settings
   try:
-    return UriRegister.objects.get(label=settings.URI_REGISTER_LABEL)
-  
+    register = UriRegister.objects.get(label=settings.URI_REGISTER_LABEL)
+
   # This exception is thrown if the register does not yet exist. Create it and return it.
-  except UriRegister.DoesNotExist:    
-    return UriRegister.objects.create(
-        label=settings.URI_REGISTER_LABEL, 
-        url=settings.URI_REGISTER_URL, 
+  except UriRegister.DoesNotExist:
+    register = UriRegister.objects.create(
+        label=settings.URI_REGISTER_LABEL,
+        url=settings.URI_REGISTER_URL,
         can_be_resolved=True
       )
 
+  _lookup_cache[key] = register
+  return register
+
 #--------------------------------------------------------------------------------------
 # Utility function to retrieve specific media types
 #--------------------------------------------------------------------------------------
 def get_media_type(kwargs):
+  key = ('media', kwargs['mime_type'], kwargs['file_extension'])
+  if key in _lookup_cache: return _lookup_cache[key]
+
   # Attempt to locate the requested media type
-  try:    
-    return MediaType.objects.get(**kwargs)
-  
+  try:
+    media_type = MediaType.objects.get(**kwargs)
+
   # This exception indicates that the media type doesn't yet exist. Create and return it.
-  except MediaType.DoesNotExist:    
-    return MediaType.objects.create(**kwargs)
-  
+  except MediaType.DoesNotExist:
+    media_type = MediaType.objects.create(**kwargs)
+
+  _lookup_cache[key] = media_type
+  return media_type
+
 #--------------------------------------------------------------------------------------
 # Functions to get the four needed media types needed within the module
 #--------------------------------------------------------------------------------------
@@ -37,7 +70,7 @@ def XSD_MEDIA():
       "mime_type": "application/xml",
       "file_extension": "xsd"
     })
-def XLS_MEDIA(): 
+def XLS_MEDIA():
   return get_media_type({
       "mime_type": "application/vnd.ms-excel",
       "file_extension": "xls"
@@ -53,9 +86,14 @@ def JSON_MEDIA():
       "file_extension": "json"
     })
 
+# The media types whose AcceptMappings this module manages. Mappings to any other media
+#   type were added by hand and are left alone.
+def MANAGED_MEDIA():
+  return [ XSD_MEDIA(), XLS_MEDIA(), HTML_MEDIA(), JSON_MEDIA() ]
+
 #--------------------------------------------------------------------------------------
 # Function to define RewriteRule attributes from an object
-#   instance is a ModelVersion or ContentModel object  
+#   instance is a ModelVersion or ContentModel object
 #--------------------------------------------------------------------------------------
 def create_rule_attribs(instance):
   return {
@@ -66,138 +104,292 @@ def create_rule_attribs(instance):
   }
 
 #--------------------------------------------------------------------------------------
-# Function to create a RewriteRule
-#--------------------------------------------------------------------------------------
-def create_rewrite_rule(instance, class_name):
-  # Create the attributes that will define the RewriteRule
-  rule_attribs = create_rule_attribs(instance)
-  
-  # Create the RewriteRule
-  rule = RewriteRule.objects.create(**rule_attribs)
-  
-  # Associate the RewriteRule with this object
-  instance.rewrite_rule = rule
-  
-  # Configure AcceptMappings for this RewriteRule
-  configure_rule_mappings(instance, rule, class_name)
-  
-  # Return the rule
-  return rule
-  
-#--------------------------------------------------------------------------------------
-# Function to update a RewriteRule
-#--------------------------------------------------------------------------------------
-def update_rewrite_rule(instance, rule, class_name):
-  # Create the attributes that will define the RewriteRule
-  rule_attribs = create_rule_attribs(instance)
-  
-  # Add the rule's pk to the attributes hash, allowing it to be used to update
-  rule_attribs["pk"] = rule.pk
-  
-  # Update the rule
-  rule = RewriteRule(**rule_attribs)
-  rule.save()
-  
-  # Configure AcceptMappings for this RewriteRule
-  configure_rule_mappings(instance, rule, class_name)
-  
-#--------------------------------------------------------------------------------------
-# Function to configure AcceptMappings for a RewriteRule
-#--------------------------------------------------------------------------------------
-def configure_rule_mappings(instance, rule, class_name):
-  # Configure the AcceptMappings for a ModelVersion's RewriteRule.
-  if class_name is "ModelVersion":
-    configure_version_mappings(instance, rule)
-  
-  # Configure the AcceptMappings for a ContentModel's RewriteRule.
-  elif class_name is "ContentModel":     
-    configure_model_mappings(instance, rule)
-
-#--------------------------------------------------------------------------------------
-# This function creates or updates an AcceptMapping, given --
-#   rewriterule: a RewriteRule to which the AcceptMapping pertains
-#   url: the URL to which the AcceptMapping should redirect
-#   mediatype: the MediaType which is represented by the AcceptMapping
-#--------------------------------------------------------------------------------------
-def configure_mapping(rewriterule, url, mediatype):
-  # Setup the attributes that will define the AcceptMapping
-  mapping_attribs = {
-    "rewrite_rule": rewriterule,
-    "media_type": mediatype,
-    "redirect_to": url
+# Function to define the AcceptMappings a RewriteRule should have, as a dictionary of
+#   MediaType pk -> URL to redirect to
+#   instance is a ModelVersion or ContentModel object
+#--------------------------------------------------------------------------------------
+def desired_mappings(instance, class_name):
+  # A ModelVersion redirects to its files, and to its ContentModel's pages
+  if class_name == "ModelVersion":
+    return {
+      XLS_MEDIA().pk: instance.absolute_xls_path(),
+      XSD_MEDIA().pk: instance.absolute_xsd_path(),
+      HTML_MEDIA().pk: instance.content_model.my_html(),
+      JSON_MEDIA().pk: instance.content_model.my_json()
+    }
+
+  # A ContentModel redirects to its pages, and to the latest version's files if there is one
+  mappings = {
+    HTML_MEDIA().pk: instance.my_html(),
+    JSON_MEDIA().pk: instance.my_json()
   }
-  
-  # Look for an existing AcceptMapping associated with this RewriteRule and having
-  #   the correct media_type. If there is one, put its index into the attributes in
-  #   order to force an update of the existing AcceptMapping.
-  try:    
-    mapping_attribs["pk"] = rewriterule.acceptmapping_set.get(media_type=mediatype).pk
-  
-  # Don't need to adjust any attributes if there is no AcceptMapping yet.
-  except AcceptMapping.DoesNotExist:    
-    pass
-    
-  # Create a new one or update an existing AcceptMapping
+  version = instance.latest_version()
+  if version is not None:
+    mappings[XLS_MEDIA().pk] = version.absolute_xls_path()
+    mappings[XSD_MEDIA().pk] = version.absolute_xsd_path()
+  return mappings
+
+#--------------------------------------------------------------------------------------
+# Function to start a report of the changes made by the functions below. Each list holds
+#   one tuple per change:
+#   rules_created: (label,)
+#   rules_updated: (label, field, old value, new value)
+#   mappings_created / mappings_deleted: (rule pk, media type pk, url)
+#   mappings_updated: (rule pk, media type pk, old url, new url)
+#--------------------------------------------------------------------------------------
+def new_report():
+  return {
+    "rules_created": [],
+    "rules_updated": [],
+    "mappings_created": [],
+    "mappings_updated": [],
+    "mappings_deleted": []
+  }
+
+#--------------------------------------------------------------------------------------
+# Function to make sure an instance has a RewriteRule with the right attributes. Rules
+#   are only written when something about them has changed.
+#   Returns True if a new RewriteRule was created. With dry_run, nothing is written and
+#   changes are only added to the report.
+#--------------------------------------------------------------------------------------
+def sync_rule(instance, rule=None, report=None, dry_run=False):
+  if report is None: report = new_report()
+  attribs = create_rule_attribs(instance)
+
+  # Create the RewriteRule, and associate it with this object
+  if instance.rewrite_rule_id is None:
+    report["rules_created"].append((attribs["label"],))
+    if not dry_run: instance.rewrite_rule = RewriteRule.objects.create(**attribs)
+    return True
+
+  # Find the fields that differ from what is stored, and update just those
+  if rule is None: rule = instance.rewrite_rule
+  changes = {}
+  for field, value in attribs.items():
+    # Compare the register by pk, so that it doesn't have to be fetched
+    current = rule.register_id if field == "register" else getattr(rule, field)
+    wanted = value.pk if field == "register" else value
+    if current != wanted:
+      report["rules_updated"].append((rule.label, field, current, wanted))
+      changes[field] = value
+  if len(changes) > 0 and not dry_run:
+    for field, value in changes.items(): setattr(rule, field, value)
+    RewriteRule.objects.filter(pk=rule.pk).update(**changes)
+  return False
+
+#--------------------------------------------------------------------------------------
+# Function to bring the AcceptMappings of many RewriteRules up to date at once. Existing
+#   mappings are loaded in one query and compared with the desired ones; then missing
+#   mappings are bulk-created, stale ones deleted in one query, and only mappings whose
+#   URL changed are updated.
+#   desired is a dictionary of RewriteRule pk -> dictionary from desired_mappings()
+#--------------------------------------------------------------------------------------
+def sync_mappings(desired, report=None, dry_run=False):
+  if report is None: report = new_report()
+  if len(desired) == 0: return report
+  managed = set(media_type.pk for media_type in MANAGED_MEDIA())
+
+  to_create = []
+  to_delete = []
+  to_update = []
+  seen = set()
+  for mapping in AcceptMapping.objects.filter(rewrite_rule__in=desired.keys()):
+    wanted = desired[mapping.rewrite_rule_id]
+    key = (mapping.rewrite_rule_id, mapping.media_type_id)
+
+    # Leave hand-made mappings alone
+    if mapping.media_type_id not in managed: continue
+
+    # Remove mappings that aren't wanted anymore, or that duplicate another one
+    if mapping.media_type_id not in wanted or key in seen:
+      to_delete.append(mapping)
+    elif mapping.redirect_to != wanted[mapping.media_type_id]:
+      to_update.append((mapping, wanted[mapping.media_type_id]))
+    seen.add(key)
+
+  for rule_pk, wanted in desired.items():
+    for media_type_pk, url in wanted.items():
+      if (rule_pk, media_type_pk) not in seen:
+        to_create.append(AcceptMapping(rewrite_rule_id=rule_pk, media_type_id=media_type_pk, redirect_to=url))
+
+  report["mappings_created"] += [ (m.rewrite_rule_id, m.media_type_id, m.redirect_to) for m in to_create ]
+  report["mappings_deleted"] += [ (m.rewrite_rule_id, m.media_type_id, m.redirect_to) for m in to_delete ]
+  report["mappings_updated"] += [ (m.rewrite_rule_id, m.media_type_id, m.redirect_to, url) for m, url in to_update ]
+  if dry_run: return report
+
+  if len(to_create) > 0: AcceptMapping.objects.bulk_create(to_create)
+  if len(to_delete) > 0: AcceptMapping.objects.filter(pk__in=[ m.pk for m in to_delete ]).delete()
+  for mapping, url in to_update: AcceptMapping.objects.filter(pk=mapping.pk).update(redirect_to=url)
+  return report
+
+#--------------------------------------------------------------------------------------
+# Function to sync the RewriteRules and AcceptMappings of a set of saved instances of one
+#   class. The instances' rules are loaded in one query, and any instance that had no
+#   rule yet is linked to its new one without firing its save signals again.
+#   Returns the report of changes, which are only reported and not made with dry_run.
+#--------------------------------------------------------------------------------------
+def sync_saved_instances(instances, class_name, report=None, dry_run=False):
+  if report is None: report = new_report()
+  rules = RewriteRule.objects.in_bulk([ i.rewrite_rule_id for i in instances if i.rewrite_rule_id is not None ])
+  desired = {}
+  for instance in instances:
+    if sync_rule(instance, rules.get(instance.rewrite_rule_id), report, dry_run):
+      # A rule that a dry run would have created would get all of its mappings
+      if dry_run:
+        report["mappings_created"] += [ (None, media_type_pk, url) for media_type_pk, url in desired_mappings(instance, class_name).items() ]
+        continue
+      type(instance).objects.filter(pk=instance.pk).update(rewrite_rule=instance.rewrite_rule)
+    desired[instance.rewrite_rule_id] = desired_mappings(instance, class_name)
+  return sync_mappings(desired, report, dry_run)
+
+#--------------------------------------------------------------------------------------
+# Rewrite rule work is recorded as it is signalled and done in one go by
+#   flush_rewrite_sync(): the ContentModels whose rules and mappings need syncing (a
+#   ModelVersion change marks its ContentModel, which syncs all of its versions), and the
+#   RewriteRules of deleted objects. Normally each save or delete is flushed right away;
+#   inside deferred_rewrite_sync() the work is piled up and flushed once at the end, so
+#   importing or deleting many objects costs a handful of queries per object instead of
+#   re-syncing every related rule on every save.
+#--------------------------------------------------------------------------------------
+_pending = threading.local()
+
+def pending_work():
+  if not hasattr(_pending, "depth"):
+    _pending.depth = 0
+    _pending.content_models = set()
+    _pending.deleted_rules = set()
+    _pending.syncing = False
+  return _pending
+
+# Function telling whether RewriteRules and AcceptMappings are being changed by this
+#   module, rather than by hand
+def rewrite_sync_in_progress():
+  return pending_work().syncing
+
+#--------------------------------------------------------------------------------------
+# Context manager, and decorator, that defers rewrite rule work until the outermost
+#   block exits. The work is done even if the block raises an exception, since what it
+#   saved before then may well have been committed; see flush_after_error. Cached catalog
+#   responses are invalidated last; see catalogcache.flush_invalidation.
+#--------------------------------------------------------------------------------------
+class deferred_rewrite_sync(object):
+  def __enter__(self):
+    pending_work().depth += 1
+    return self
+
+  def __exit__(self, exc_type, exc_value, traceback):
+    work = pending_work()
+    work.depth -= 1
+    if work.depth == 0:
+      try:
+        if exc_type is None: flush_rewrite_sync()
+        else: flush_after_error()
+      finally:
+        flush_invalidation()
+    return False
+
+  def __call__(self, function):
+    @wraps(function)
+    def deferred(*args, **kwargs):
+      with deferred_rewrite_sync():
+        return function(*args, **kwargs)
+    return deferred
+
+#--------------------------------------------------------------------------------------
+# Function to do the pending work of a block that raised an exception. The rules of the
+#   objects that still exist are synced, and the rules of deleted objects are only
+#   deleted if those objects are really gone, since their deletion may have been rolled
+#   back. Anything going wrong here is logged, so that the block's own exception is the
+#   one that is raised; rebuild_rewrite_rules repairs what is left out of date.
+#--------------------------------------------------------------------------------------
+def flush_after_error():
+  from models import ContentModel, ModelVersion
+  work = pending_work()
+  try:
+    if len(work.deleted_rules) > 0:
+      for model in [ContentModel, ModelVersion]:
+        work.deleted_rules -= set(model.objects.filter(rewrite_rule__in=work.deleted_rules).values_list('rewrite_rule', flat=True))
+    flush_rewrite_sync()
+  except Exception:
+    discard_rewrite_sync()
+    logger.exception('Rewrite rules could not be synced after an error; run "manage.py rebuild_rewrite_rules"')
+
+def discard_rewrite_sync():
+  work = pending_work()
+  work.content_models.clear()
+  work.deleted_rules.clear()
+
+# Signal sent when the rules of ContentModels, and their versions, have been synced.
+#   content_model_pks lists them, including ContentModels that have been deleted.
+rewrite_rules_synced = Signal(providing_args=["content_model_pks"])
+
+#--------------------------------------------------------------------------------------
+# Function that does all of the pending rewrite rule work
+#--------------------------------------------------------------------------------------
+def flush_rewrite_sync():
+  from models import ContentModel
+  work = pending_work()
+  content_model_pks = list(work.content_models)
+  deleted_rules = list(work.deleted_rules)
+  discard_rewrite_sync()
+
+  work.syncing = True
+  try:
+    # Delete the rules of deleted objects in one go
+    if len(deleted_rules) > 0:
+      RewriteRule.objects.filter(pk__in=deleted_rules).delete()
+
+    # Sync the changed ContentModels and all of their versions. ContentModels that have
+    #   been deleted since they were marked are simply not found.
+    if len(content_model_pks) == 0: return
+    content_models = list(ContentModel.objects.filter(pk__in=content_model_pks).with_catalog_data())
+    versions = [ version for cm in content_models for version in cm.versions() ]
+    sync_saved_instances(content_models, "ContentModel")
+    sync_saved_instances(versions, "ModelVersion")
   finally:
-    mapping = AcceptMapping(**mapping_attribs)
-    mapping.save()
-    
-#--------------------------------------------------------------------------------------
-# Function to create AcceptMappings for a ModelVersion
-#--------------------------------------------------------------------------------------
-def configure_version_mappings(instance, rule):
-  configure_mapping(rule, instance.absolute_xls_path(), XLS_MEDIA())
-  configure_mapping(rule, instance.absolute_xsd_path(), XSD_MEDIA())
-  configure_mapping(rule, instance.content_model.my_html(), HTML_MEDIA())
-  configure_mapping(rule, instance.content_model.my_json(), JSON_MEDIA())
-  
-#--------------------------------------------------------------------------------------
-# Function to create AcceptMappings for a ContentModel
-#--------------------------------------------------------------------------------------
-def configure_model_mappings(instance, rule):
-  # When you first create a ContentModel, the instance does not yet have an ID assigned.
-  #    instance.my_html() and my_json() return None, and AcceptMappings are incorrect.
-  configure_mapping(rule, instance.my_html(), HTML_MEDIA())
-  configure_mapping(rule, instance.my_json(), JSON_MEDIA())
-  
-  # File mappings depend on there being a ModelVersion in the set
-  if instance.latest_version() is not None:    
-    configure_mapping(rule, instance.absolute_latest_xls_path(), XLS_MEDIA())
-    configure_mapping(rule, instance.absolute_latest_xsd_path(), XSD_MEDIA())
-  
+    work.syncing = False
+  rewrite_rules_synced.send(sender=ContentModel, content_model_pks=content_model_pks)
+
+def flush_unless_deferred():
+  if pending_work().depth == 0: flush_rewrite_sync()
+
 #--------------------------------------------------------------------------------------
 # This function manages RewriteRules defined by the uriredirect module.
-#   The function is called before a ModelVersion or ContentModel is saved. 
+#   The function is called before a ModelVersion or ContentModel is saved.
 #   It is registered in models.py.
 #   sender is a reference to the class that is being saved
 #   instance is the object that is being saved
+#   Only a missing RewriteRule is created here, so that it is saved along with the
+#   instance. Its attributes and AcceptMappings are synced after the save, once the
+#   instance has the pk that its URLs use.
 #--------------------------------------------------------------------------------------
 def adjust_rewrite_rule(sender, instance, **kwargs):
-  # Look for a RewriteRule associated with this instance
-  rule = instance.rewrite_rule
-  
-  # Create one if it doesn't already exist, update it if it does
-  class_name = sender.__name__
-  if rule is None: rule = create_rewrite_rule(instance, class_name)
-  else: update_rewrite_rule(instance, rule, class_name)
+  if instance.rewrite_rule_id is None:
+    work = pending_work()
+    work.syncing = True
+    try:
+      instance.rewrite_rule = RewriteRule.objects.create(**create_rule_attribs(instance))
+    finally:
+      work.syncing = False
 
 #--------------------------------------------------------------------------------------
-# This function updates RewriteRules that pertain to objects related to the 
-#   instance that has been saved. The function is registered in models.py and is 
-#   called after the object is saved
+# This function marks the RewriteRules and AcceptMappings affected by a save as needing
+#   to be synced. The function is registered in models.py and is called after the
+#   object is saved
 #--------------------------------------------------------------------------------------
 def update_related_rewrite_rules(sender, instance, **kwargs):
-  # Find the class name of the object being saved
-  class_name = sender.__name__
-  
+  work = pending_work()
+
   # Saving a ModelVersion may change the latest version of the ContentModel,
   #   which effects the ContentModel's RewriteRule.
-  if class_name is "ModelVersion":    
-    update_rewrite_rule(instance.content_model, instance.content_model.rewrite_rule, "ContentModel")
-  
+  if sender.__name__ == "ModelVersion":
+    work.content_models.add(instance.content_model_id)
+
   # Changes to a ContentModel can affect ModelVersion's RewriteRules (i.e. changing the label).
-  elif class_name is "ContentModel":    
-    for version in instance.modelversion_set.all(): update_rewrite_rule(version, version.rewrite_rule, "ModelVersion")
+  elif sender.__name__ == "ContentModel":
+    work.content_models.add(instance.pk)
+
+  flush_unless_deferred()
 
 #--------------------------------------------------------------------------------------
 # This function deletes a RewriteRule when a ModelVersion or ContentModel is deleted
@@ -206,7 +398,17 @@ def update_related_rewrite_rules(sender, instance, **kwargs):
 #   instance is the object that was deleted
 #--------------------------------------------------------------------------------------
 def delete_rewrite_rule(sender, instance, **kwargs):
+  work = pending_work()
+
   # Simply delete the RewriteRule, if it exists!
-  if instance.rewrite_rule != None:
-    instance.rewrite_rule.delete()
-  
+  if instance.rewrite_rule_id != None:
+    work.deleted_rules.add(instance.rewrite_rule_id)
+
+  # Deleting a ModelVersion may change the latest version of the ContentModel. A deleted
+  #   ContentModel is marked too, so that listeners hear that its rules are gone.
+  if sender.__name__ == "ModelVersion":
+    work.content_models.add(instance.content_model_id)
+  elif sender.__name__ == "ContentModel":
+    work.content_models.add(instance.pk)
+
+  flush_unless_deferred()
@@ -1,14 +1,22 @@
 from django.conf.urls import patterns, url
 from django.conf import settings
+import re
 
 urlpatterns = patterns('contentmodels.views',
 
   # Get all the ContentModels as JSON or HTML
   url(r'^contentmodels\.(?P<extension>json|html|xml|drupal)$', 'get_all_models'),
   
+  # Search the ContentModels
+  url(r'^contentmodels/search\.json$', 'search'),
+  
   # Get a single ContentModel as JSON or HTML
   url(r'^contentmodel/(?P<id>\d*)\.(?P<extension>json|html|xml|drupal)$', 'get_model'),
   
+  # Resolve dataschema URIs in the default register, ahead of uriredirect. Needs to be
+  #   in sync with ContentModel.relative_uri().
+  url(r'^uri-gin/%s/(?P<path>dataschema/.*)$' % re.escape(settings.URI_REGISTER_LABEL), 'resolve_dataschema'),
+  
   # Homepage
   url(r'^home/$', 'homepage'),
   
@@ -1,21 +1,83 @@
-from django.http import HttpResponse, Http404
+from django.http import HttpResponse, HttpResponseBadRequest, HttpResponseNotModified, HttpResponseRedirect, HttpResponseNotFound, Http404
+from django.utils.cache import patch_vary_headers
 from django.shortcuts import render_to_response
-from models import ContentModel
-from datetime import datetime
+from django.utils.http import urlencode, http_date, parse_http_date_safe, parse_etags, quote_etag
+from django.conf import settings
+from django.core.urlresolvers import RegexURLResolver, Resolver404
+from models import ContentModel, CatalogRevision, SearchTerm
+from atom import AtomFeed
+from catalogcache import cached_catalog_response, cached_revision
+from resolver import dataschema_index, negotiate
+from functools import wraps
+from calendar import timegm
 import json
 
+# The largest page of ContentModels that can be requested from contentmodels.json
+MAX_PAGE_SIZE = 100
+
+# The number of ContentModels fetched from the database at once when streaming JSON
+STREAM_BATCH_SIZE = 50
+
+#--------------------------------------------------------------------------------------
+# Decorator that answers conditional GETs for catalog views. The catalog's fingerprint
+#   is read from the CatalogRevision row (through the catalog cache), so a client that
+#   already has the current representation gets a 304 without any serialization.
+#--------------------------------------------------------------------------------------
+def catalog_conditional(view):
+  @wraps(view)
+  def conditional_view(request, *args, **kwargs):
+    # Compute the ETag and Last-Modified values for the current state of the catalog
+    revision = cached_revision(CatalogRevision)
+    tag = 'catalog-%s' % revision.number
+    last_modified = timegm(revision.date_modified.utctimetuple())
+    
+    # Answer with a 304 if the client's copy is current
+    if request.method in ['GET', 'HEAD'] and not_modified(request, tag, last_modified):
+      response = HttpResponseNotModified()
+    else:
+      response = view(request, *args, **kwargs)
+    
+    # Let the client know how to ask next time. The ETag is weak because the same
+    #   content may be sent with different encodings.
+    if response.status_code in [200, 304]:
+      response['ETag'] = 'W/%s' % quote_etag(tag)
+      response['Last-Modified'] = http_date(last_modified)
+    return response
+  return conditional_view
+
+#--------------------------------------------------------------------------------------
+# Function to decide whether a client's cached copy is still current. If-None-Match
+#   takes precedence over If-Modified-Since when a client sends both.
+#--------------------------------------------------------------------------------------
+def not_modified(request, tag, last_modified):
+  if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+  if if_none_match:
+    etags = parse_etags(if_none_match)
+    return '*' in etags or tag in etags
+  
+  if_modified_since = parse_http_date_safe(request.META.get('HTTP_IF_MODIFIED_SINCE', ''))
+  return if_modified_since is not None and last_modified <= if_modified_since
+
 #--------------------------------------------------------------------------------------
 # Expose all the available ContentModels
 #--------------------------------------------------------------------------------------
+@catalog_conditional
+@cached_catalog_response('all')
 def get_all_models(request, extension):
-  all_models = ContentModel.objects.all()
+  # Paging and streaming are only offered for the JSON representation
+  if extension == 'json' and any(param in request.GET for param in ['limit', 'after', 'stream']):
+    return paged_json(request)
+  
+  all_models = ContentModel.objects.with_catalog_data()
   return view_models(all_models, extension)
   
 #--------------------------------------------------------------------------------------
 # Expose a single ContentModel
 #--------------------------------------------------------------------------------------
+@catalog_conditional
+@cached_catalog_response('model')
 def get_model(request, id, extension):
-  contentmodels = ContentModel.objects.filter(pk=id)
+  contentmodels = ContentModel.objects.filter(pk=id).with_catalog_data()
   if not contentmodels: raise Http404
   return view_models(contentmodels, extension)
   
@@ -35,6 +97,59 @@ def as_json(contentmodels):
   data = [ cm.serialized() for cm in contentmodels ]
   return HttpResponse(json.dumps(data), mimetype='application/json')
   
+#--------------------------------------------------------------------------------------
+# Expose the ContentModels as JSON one page, or one stream, at a time. Query parameters:
+#   limit: the number of ContentModels to return, at most MAX_PAGE_SIZE. When there are
+#     more, a Link header with rel="next" points to the following page.
+#   after: the id of the last ContentModel on the previous page
+#   stream: ask for the whole catalog as a stream.
+#   Without a limit, every remaining ContentModel is written to the response as the
+#   catalog is read, STREAM_BATCH_SIZE models at a time. Pages and streams are in the same
+#   order as the full catalog: by title, then id.
+#--------------------------------------------------------------------------------------
+def paged_json(request):
+  contentmodels = ContentModel.objects.with_catalog_data().in_catalog_order()
+  
+  # Check the cursor, and filter to the ContentModels that follow it
+  after = request.GET.get('after')
+  if after:
+    try:
+      contentmodels = contentmodels.after(ContentModel.objects.get(pk=int(after)))
+    except (ValueError, ContentModel.DoesNotExist):
+      return HttpResponseBadRequest('after must be the id of an existing ContentModel')
+  
+  # Without a limit, stream the rest of the catalog
+  limit = request.GET.get('limit')
+  if not limit:
+    return HttpResponse(stream_json(contentmodels.in_batches(STREAM_BATCH_SIZE)), mimetype='application/json')
+  
+  # Check the limit
+  try:
+    limit = int(limit)
+    if limit < 1 or limit > MAX_PAGE_SIZE: raise ValueError
+  except ValueError:
+    return HttpResponseBadRequest('limit must be a number between 1 and %s' % MAX_PAGE_SIZE)
+  
+  # Fetch one more ContentModel than was asked for to find out whether there is a next page
+  page = list(contentmodels[:limit + 1])
+  response = as_json(page[:limit])
+  if len(page) > limit:
+    next_params = urlencode({ 'limit': limit, 'after': page[limit - 1].pk })
+    next_url = '%s/contentmodels.json?%s' % (settings.BASE_URL.rstrip('/'), next_params)
+    response['Link'] = '<%s>; rel="next"' % next_url
+  return response
+
+#--------------------------------------------------------------------------------------
+# Generator that writes a JSON array of ContentModels one ContentModel at a time
+#--------------------------------------------------------------------------------------
+def stream_json(contentmodels):
+  yield '['
+  separator = ''
+  for cm in contentmodels:
+    yield separator + json.dumps(cm.serialized())
+    separator = ', '
+  yield ']'
+  
 #--------------------------------------------------------------------------------------
 # Convert a set of ContentModel instances to HTML and send as an HttpResponse
 #--------------------------------------------------------------------------------------
@@ -45,11 +160,7 @@ def as_html(contentmodels):
 # Convert a set of ContentModel instances to XML (Atom) and send as an HttpResponse
 #--------------------------------------------------------------------------------------
 def as_atom(contentmodels):
-  return render_to_response(
-      'contentmodels.xml', 
-      { 'feed': AtomFeed(contentmodels=contentmodels), 'contentmodels': contentmodels },
-      mimetype="application/xml"
-    )
+  return HttpResponse(AtomFeed(contentmodels).write(), mimetype="application/xml")
     
 #--------------------------------------------------------------------------------------
 # Convert a set of ContentModel instances to XML (fer Drupal) and send as an HttpResponse
@@ -60,68 +171,63 @@ def fer_drupal(contentmodels):
     )
 
 #--------------------------------------------------------------------------------------
-# Class for generating an Atom Feed. Default values as shown, can be adjusted by 
-#   keyword-args on creation.
-#--------------------------------------------------------------------------------------
-class AtomFeed(object):
-  # These are default values for feed attributes
-  title = "Content Models"
-  subtitle = "USGIN Content Models Atom Feed"
-  url = "http://schemas.usgin.org/contentmodels.xml"
-  id = "http://schemas.usgin.org/contentmodels.xml"
-  date = datetime.now().isoformat()
-  author_name = "Ryan Clark"
-  author_email = "metadata@usgin.org"
-  contentmodels = ContentModel.objects.all()
+# Search the ContentModels. Query parameters:
+#   q: the words to search for
+#   limit: the number of results to return, at most MAX_PAGE_SIZE (default 20)
+#--------------------------------------------------------------------------------------
+def search(request):
+  query = request.GET.get('q', '')
+  try:
+    limit = int(request.GET.get('limit', 20))
+    if limit < 1 or limit > MAX_PAGE_SIZE: raise ValueError
+  except ValueError:
+    return HttpResponseBadRequest('limit must be a number between 1 and %s' % MAX_PAGE_SIZE)
   
-  # Constructor function. Map kwargs to this instance to overwrite defaults
-  def __init__(self, **kwargs):
-    # Loop through arguments passed in
-    for arg in kwargs:
-      # Assign them to this instance, overwriting default values
-      setattr(self, arg, kwargs[arg])
-      
-    # Set date and id
-    self.set_date()
-    self.set_id_and_url()
+  results, total = SearchTerm.objects.search(query, limit)
+  data = {
+    'query': query,
+    'total': total,
+    'results': [ dict(cm.serialized(), score=score) for cm, score in results ]
+  }
+  return HttpResponse(json.dumps(data), mimetype='application/json')
+
+#--------------------------------------------------------------------------------------
+# Resolve a dataschema URI to one of its representations. The URI is looked up in the
+#   in-process index of resolver.py rather than matched against every RewriteRule;
+#   the representation is chosen by the URI's extension or the Accept header. The index
+#   only knows the rules of ContentModels and ModelVersions, so URIs it doesn't have
+#   are handed to uriredirect, which matches them against every rule, including those
+#   made by hand.
+#--------------------------------------------------------------------------------------
+uriredirect_resolver = RegexURLResolver(r'^/', 'uriredirect.urls')
+
+def resolve_dataschema(request, path):
+  mappings, extension = dataschema_index.lookup(path)
+  if mappings is None:
+    try:
+      match = uriredirect_resolver.resolve(request.path_info)
+    except Resolver404:
+      return HttpResponseNotFound('%s was not found' % path, mimetype='text/plain')
+    return match.func(request, *match.args, **match.kwargs)
   
-  # Function to set the feed's updated date based on the ContentModels passed in
-  def set_date(self):
-    # Count the number of ContentModels that were passed in
-    number_of_models = self.contentmodels.count()
-    
-    # There is more than one ContentModel
-    if number_of_models > 1:
-      # Sort the ContentModels by date
-      sortable = list(self.contentmodels)
-      sortable.sort(key=lambda cm: cm.date_updated())
-      # Set the feed's date to the most recent ContentModel's updated date
-      self.date = sortable[len(sortable)-1].iso_date_updated() 
-    
-    # There is one ContentModel
-    elif number_of_models == 1:
-      # This ContentModel's date is what we want
-      self.date = self.contentmodels[0].iso_date_updated()
+  url = negotiate(mappings, extension, request.META.get('HTTP_ACCEPT'))
+  if url is None and extension is not None: return HttpResponseNotFound('%s was not found' % path, mimetype='text/plain')
+  if url is None: return HttpResponse('No acceptable representation of %s' % path, status=406, mimetype='text/plain')
   
-  # Function to set the feed's id and url    
-  def set_id_and_url(self):
-    # Use the default values unless this is a Feed containing only one ContenModel
-    if self.contentmodels.count() == 1:
-      # Set the feed's id and url to that of the passed in ContentModel
-      self.url = self.contentmodels[0].my_atom()
-      self.id = self.contentmodels[0].my_atom()
-      
+  response = HttpResponseRedirect(url)
+  patch_vary_headers(response, ['Accept'])
+  return response
+
 #--------------------------------------------------------------------------------------
 # Homepage
 #--------------------------------------------------------------------------------------
 def homepage(req):
-  models = list(ContentModel.objects.all())
-  models.sort(key=lambda cm: cm.date_updated(), reverse=True)
-  return render_to_response('home.html', { 'recent_models': models[:3] })
+  recent_models = ContentModel.objects.exclude(last_updated=None).order_by('-last_updated', 'title')
+  return render_to_response('home.html', { 'recent_models': recent_models.with_catalog_data()[:3] })
   
 #--------------------------------------------------------------------------------------
 # Model view page
 #--------------------------------------------------------------------------------------
 def models(req):
-  return render_to_response('models.html', { 'contentmodels': ContentModel.objects.all() })
+  return render_to_response('models.html', { 'contentmodels': ContentModel.objects.with_catalog_data() })
   
\ No newline at end of file
@@ -0,0 +1,308 @@
+from django.conf import settings
+from django.db import connection
+from django.utils import timezone
+from contentmodels.models import ModelVersion
+from models import ValidationBatch
+from contentmodels.schemacache import cached_schema
+from validators.WfsCapabilities import WfsCapabilities
+from validators.WfsHarvest import feature_validator
+from jobs import describe_errors
+from incremental import IncrementalRun
+from multiprocessing.pool import ThreadPool
+import json, time
+
+# The number of features validated for each task, unless the manifest says otherwise
+DEFAULT_NUMBER_OF_FEATURES = 50
+
+# The most GetCapabilities documents requested at once
+CAPABILITIES_FETCHES = 8
+
+# What became of a task: its features were all valid, some were not, or it could not
+#   be validated at all
+PASSED = 'passed'
+FAILED = 'failed'
+ERROR = 'error'
+
+# The number of validations a batch runs at once, set by VALIDATION_BATCH_CONCURRENCY
+def batch_concurrency():
+  return getattr(settings, 'VALIDATION_BATCH_CONCURRENCY', 4)
+
+#--------------------------------------------------------------------------------------
+# Exception raised for a manifest that can't be understood
+#--------------------------------------------------------------------------------------
+class ManifestError(ValueError):
+  pass
+
+#--------------------------------------------------------------------------------------
+# A batch is described by a manifest like this one, where every FeatureType of an
+#   endpoint is validated against every ModelVersion listed for it:
+#
+#   { "number_of_features": 50,
+#     "endpoints": [
+#       { "url": "http://example.com/wfs?request=GetCapabilities&service=WFS",
+#         "feature_types": [ "aasg:BoreholeTemperature" ],
+#         "model_versions": [ { "content_model": "boreholetemperature", "version": "1.5" } ],
+#         "number_of_features": 10 } ] }
+#
+#   number_of_features is optional, at either level; 0 validates whole layers. So is
+#   "incremental": true, to only validate the features that changed since the last
+#   incremental run (see incremental.py); incremental=True turns it on for every task.
+#--------------------------------------------------------------------------------------
+def parse_manifest(manifest, incremental=False):
+  if not isinstance(manifest, dict) or not isinstance(manifest.get('endpoints'), list):
+    raise ManifestError('The manifest must be an object with a list of endpoints')
+  default_number = number_of_features(manifest, DEFAULT_NUMBER_OF_FEATURES)
+  default_incremental = incremental or flag(manifest, 'incremental', False)
+
+  versions = {}
+  tasks = []
+  for position, endpoint in enumerate(manifest['endpoints']):
+    where = 'Endpoint %s' % (position + 1)
+    if not isinstance(endpoint, dict): raise ManifestError('%s is not an object' % where)
+    url = endpoint.get('url')
+    if not isinstance(url, basestring) or not url: raise ManifestError('%s has no url' % where)
+    feature_types = string_list(endpoint, 'feature_types', where)
+    models = endpoint.get('model_versions')
+    if not isinstance(models, list) or len(models) == 0:
+      raise ManifestError('%s has no model_versions' % where)
+    number = number_of_features(endpoint, default_number)
+    endpoint_incremental = incremental or flag(endpoint, 'incremental', default_incremental)
+
+    for model in models:
+      modelversion = find_model_version(model, versions, where)
+      for feature_type in feature_types:
+        tasks.append(BatchTask(url, feature_type, modelversion, number, endpoint_incremental))
+  return tasks
+
+def string_list(endpoint, name, where):
+  values = endpoint.get(name)
+  if not isinstance(values, list) or len(values) == 0 or not all( isinstance(value, basestring) for value in values ):
+    raise ManifestError('%s needs a list of %s' % (where, name))
+  return values
+
+def number_of_features(entry, default):
+  number = entry.get('number_of_features', default)
+  if not isinstance(number, int) or isinstance(number, bool) or number < 0:
+    raise ManifestError('number_of_features must be a whole number, or 0 for every feature')
+  return number
+
+def flag(entry, name, default):
+  value = entry.get(name, default)
+  if not isinstance(value, bool): raise ManifestError('%s must be true or false' % name)
+  return value
+
+# Function to look up the ModelVersion a manifest names by its ContentModel's label and
+#   its version number, remembering the ones already found
+def find_model_version(model, versions, where):
+  if not isinstance(model, dict): raise ManifestError('%s lists a model version that is not an object' % where)
+  key = (model.get('content_model'), model.get('version'))
+  if key not in versions:
+    try:
+      versions[key] = ModelVersion.objects.select_related('content_model').get(content_model__label=key[0], version=key[1])
+    except ModelVersion.DoesNotExist:
+      raise ManifestError('%s lists version %s of %s, which does not exist' % (where, key[1], key[0]))
+  return versions[key]
+
+#--------------------------------------------------------------------------------------
+# Class for one validation in a batch: a FeatureType of a WFS against a ModelVersion.
+#   Records how long each step took, in seconds.
+#--------------------------------------------------------------------------------------
+class BatchTask(object):
+  def __init__(self, url, feature_type, modelversion, number_of_features, incremental=False):
+    self.url = url
+    self.feature_type = feature_type
+    self.modelversion = modelversion
+    self.number_of_features = number_of_features
+    self.incremental = incremental
+    self.incremental_summary = None
+    self.get_feature_url = None
+    self.status = None
+    self.error = None
+    self.result = None
+    self.timings = {}
+
+  def fail(self, message):
+    self.status = ERROR
+    self.error = message
+
+  def finish(self, result):
+    self.status = PASSED if result.valid else FAILED
+    self.result = result.serialized()
+
+  def serialized(self):
+    return {
+      'url': self.url,
+      'feature_type': self.feature_type,
+      'content_model': self.modelversion.content_model.label,
+      'version': self.modelversion.version,
+      'model_version': self.modelversion.absolute_uri(),
+      'number_of_features': self.number_of_features,
+      'get_feature_url': self.get_feature_url,
+      'status': self.status,
+      'error': self.error,
+      'incremental': self.incremental_summary,
+      'timings': dict( (step, round(seconds, 3)) for step, seconds in self.timings.items() ),
+      'result': self.result
+    }
+
+#--------------------------------------------------------------------------------------
+# Function to run a batch of BatchTasks. Every endpoint's GetCapabilities document is
+#   read once, several at a time, while the schemas are compiled; each schema is compiled
+#   once, and kept in the schema cache for the tasks that use it. The validations then
+#   run in a pool of concurrency threads, VALIDATION_BATCH_CONCURRENCY by default. Tasks
+#   are run grouped by ModelVersion, so that a batch using more schemas than the cache
+#   holds doesn't keep compiling them again. progress, if given, is called with the
+#   number of tasks finished each time one finishes.
+#   Returns the report, a dictionary that can be written out as JSON.
+#--------------------------------------------------------------------------------------
+def run_batch(tasks, concurrency=None, progress=None):
+  concurrency = concurrency or batch_concurrency()
+  started = time.time()
+  started_at = timezone.now()
+
+  urls = []
+  for task in tasks:
+    if task.url not in urls: urls.append(task.url)
+  fetches = ThreadPool(max(1, min(len(urls), CAPABILITIES_FETCHES)))
+  fetching = fetches.map_async(fetch_capabilities, urls)
+
+  schemas = {}
+  for task in tasks:
+    if task.modelversion.pk not in schemas: schemas[task.modelversion.pk] = compile_schema(task.modelversion)
+
+  fetched = dict(zip(urls, fetching.get()))
+  fetches.close()
+
+  for task in tasks:
+    capabilities, task.timings['capabilities'], error = fetched[task.url]
+    task.capabilities = capabilities
+    if error is not None: task.fail('The GetCapabilities document could not be read: %s' % error)
+    task.timings['schema'], error = schemas[task.modelversion.pk]
+    if error is not None and task.error is None: task.fail('The schema could not be compiled: %s' % error)
+
+  validations = ThreadPool(concurrency)
+  finished = 0
+  for task in validations.imap_unordered(run_task, sorted(tasks, key=lambda task: task.modelversion.pk)):
+    finished += 1
+    if progress is not None: progress(finished)
+  validations.close()
+
+  return {
+    'started': started_at.isoformat(),
+    'seconds': round(time.time() - started, 3),
+    'concurrency': concurrency,
+    'summary': {
+      'tasks': len(tasks),
+      PASSED: len([ task for task in tasks if task.status == PASSED ]),
+      FAILED: len([ task for task in tasks if task.status == FAILED ]),
+      ERROR: len([ task for task in tasks if task.status == ERROR ])
+    },
+    'tasks': [ task.serialized() for task in tasks ]
+  }
+
+# Function to read a GetCapabilities document, in a thread of its own
+#   Returns the WfsCapabilities, the seconds it took, and a description of what went
+#   wrong, if anything did
+def fetch_capabilities(url):
+  started = time.time()
+  try:
+    capabilities = WfsCapabilities(url)
+    error = None if capabilities.url_is_valid else describe_errors(capabilities.errors)
+    return capabilities, time.time() - started, error
+  except Exception, err:
+    return None, time.time() - started, '%s: %s' % (err.__class__.__name__, err)
+  finally:
+    connection.close()
+
+# Function to compile a ModelVersion's schema. Returns the seconds it took, and what went
+#   wrong, if anything did.
+def compile_schema(modelversion):
+  started = time.time()
+  try:
+    cached_schema(modelversion)
+    return time.time() - started, None
+  except Exception, err:
+    return time.time() - started, '%s: %s' % (err.__class__.__name__, err)
+
+# Function to validate a task's features, in one of the pool's threads
+def run_task(task):
+  if task.status == ERROR: return
+  started = time.time()
+  try:
+    validator = feature_validator(task.capabilities, task.feature_type, task.number_of_features)
+    if validator.url is None: return task.fail('The WFS does not offer %s' % task.feature_type)
+    task.get_feature_url = validator.url
+    if not task.incremental: return task.finish(validator.validate(task.modelversion))
+
+    verdicts = IncrementalRun(task.url, task.feature_type, task.modelversion)
+    result = validator.validate(task.modelversion, verdicts=verdicts)
+    task.finish(result)
+
+    # A run that may have missed features mustn't be built on
+    if result.incomplete: verdicts.abandon()
+    else: verdicts.finish()
+    task.incremental_summary = verdicts.summary()
+
+  # One task going wrong mustn't stop the rest of the batch
+  except Exception, err:
+    task.fail('%s: %s' % (err.__class__.__name__, err))
+
+  finally:
+    task.timings['validation'] = time.time() - started
+    connection.close()
+
+#--------------------------------------------------------------------------------------
+# Batches POSTed to /validate/wfs/batch are queued, and run by run_validation_jobs along
+#   with ValidationJobs. The manifest is checked when the batch is submitted, and read
+#   again when it is run. Returns the ValidationBatch.
+#--------------------------------------------------------------------------------------
+def submit_batch(manifest):
+  tasks = parse_manifest(manifest)
+  return ValidationBatch.objects.create(manifest=json.dumps(manifest), number_of_tasks=len(tasks))
+
+# Function to take the oldest queued batch, the way claim_next_job takes jobs. Returns the
+#   claimed batch's pk, or None if nothing is queued.
+def claim_next_batch():
+  candidates = ValidationBatch.objects.filter(status=ValidationBatch.QUEUED).order_by('created')
+  for pk in candidates.values_list('pk', flat=True)[:10]:
+    now = timezone.now()
+    claimed = ValidationBatch.objects.filter(pk=pk, status=ValidationBatch.QUEUED).update(
+      status=ValidationBatch.RUNNING, started=now, updated=now
+    )
+    if claimed == 1: return pk
+  return None
+
+# Function to queue again batches that a stopping worker leaves unfinished. A batch only
+#   reports when one of its validations finishes, which may take longer than a job is
+#   allowed to go without reporting, so running batches aren't requeued as stale.
+def requeue_batches(pks):
+  return ValidationBatch.objects.filter(status=ValidationBatch.RUNNING, pk__in=pks).update(
+    status=ValidationBatch.QUEUED, tasks_finished=0
+  )
+
+def report_batch(pk, **changes):
+  changes['updated'] = timezone.now()
+  ValidationBatch.objects.filter(pk=pk).update(**changes)
+
+#--------------------------------------------------------------------------------------
+# Function to run a claimed batch, in one of run_validation_jobs' threads. Whatever
+#   happens, the batch ends up done or failed.
+#--------------------------------------------------------------------------------------
+def run_queued_batch(pk):
+  try:
+    batch = ValidationBatch.objects.get(pk=pk)
+    tasks = parse_manifest(json.loads(batch.manifest))
+    report = run_batch(tasks, progress=lambda finished: report_batch(pk, tasks_finished=finished))
+    report_batch(pk,
+      status=ValidationBatch.DONE,
+      tasks_finished=len(tasks),
+      report=json.dumps(report),
+      finished=timezone.now()
+    )
+
+  # The worker must carry on with other jobs, whatever went wrong with this batch
+  except Exception, err:
+    report_batch(pk, status=ValidationBatch.FAILED, error='%s: %s' % (err.__class__.__name__, err), finished=timezone.now())
+
+  finally:
+    connection.close()
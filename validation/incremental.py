@@ -0,0 +1,102 @@
+from django.utils import timezone
+from models import ValidationRun, FeatureVerdict
+from validators.validationresults import feature_digest, error_key
+from contentmodels.schemacache import schema_hash
+import json
+
+# The number of verdicts kept in memory before they are written to the database
+VERDICT_BATCH = 500
+
+#--------------------------------------------------------------------------------------
+# Re-validating a layer mostly means validating features that haven't changed. An
+#   IncrementalRun saves a verdict for every feature it sees, known by the hash of the
+#   feature's canonical XML. A later run of the same FeatureType, from the same WFS,
+#   against the same schema only validates the features whose hash it hasn't seen, and
+#   gives the rest the verdict of the latest complete run. The hash of the schema is part
+#   of the key, so features are all validated again when the XSD file changes. Once a
+#   run is complete, the verdicts of the runs before it are deleted; the runs themselves
+#   are kept, with their counts. A run that couldn't see every feature is abandoned
+#   instead, and the next run builds on the same complete run as it did.
+#   It is handed to WfsGetFeature.validate or WfsHarvest.validate as verdicts.
+#--------------------------------------------------------------------------------------
+class IncrementalRun(object):
+  def __init__(self, url, feature_type, modelversion):
+    self.run = ValidationRun.objects.create(
+      url=url,
+      feature_type=feature_type,
+      modelversion=modelversion,
+      schema_hash=schema_hash(modelversion)
+    )
+    self.based_on = None
+    self.previous = self.load_previous()
+    self.pending = []
+
+  # Function to read the verdicts of the latest complete run with the same key
+  #   Returns a dictionary of digest -> (valid, errors)
+  def load_previous(self):
+    verdicts = {}
+    latest = self.run.siblings().filter(complete=True).order_by('-created')[:1]
+    if len(latest) == 0: return verdicts
+    self.based_on = latest[0]
+    found = FeatureVerdict.objects.filter(run=latest[0]).values_list('digest', 'valid', 'errors')
+    for digest, valid, errors in found.iterator():
+      verdicts[digest] = (valid, [ tuple(error) for error in json.loads(errors) ] if errors else [])
+    return verdicts
+
+  #--------------------------------------------------------------------------------------
+  # Function to find whether a feature is valid, validating it against compiled (a
+  #   CompiledSchema) only if it is new or has changed. Returns whether it is valid, and
+  #   its errors as (type, message, path) tuples.
+  #--------------------------------------------------------------------------------------
+  def check(self, element, id, compiled):
+    digest = feature_digest(element)
+    verdict = self.previous.get(digest)
+    if verdict is None:
+      valid, errors = compiled.validate(element)
+      verdict = (valid, [ error_key(error) for error in errors ])
+      self.run.features_validated += 1
+    self.record(digest, id, *verdict)
+    return verdict
+
+  def record(self, digest, id, valid, errors):
+    self.run.number_of_features += 1
+    self.pending.append(FeatureVerdict(
+      run=self.run,
+      digest=digest,
+      feature_id=id or '',
+      valid=valid,
+      errors=json.dumps(errors) if errors else ''
+    ))
+    if len(self.pending) >= VERDICT_BATCH: self.save_pending()
+
+  def save_pending(self):
+    FeatureVerdict.objects.bulk_create(self.pending)
+    self.pending = []
+
+  # Function to call once every feature has been checked. Makes this run the one that
+  #   later runs build on.
+  def finish(self):
+    self.save_pending()
+    self.run.complete = True
+    self.run.finished = timezone.now()
+    self.run.save()
+    FeatureVerdict.objects.filter(run__in=self.run.siblings()).delete()
+
+  # Function to call instead of finish when the features checked may not be all there
+  #   are, for instance because the response was cut short. The run is kept, with its
+  #   counts, but not its verdicts.
+  def abandon(self):
+    self.pending = []
+    self.run.finished = timezone.now()
+    self.run.save()
+    FeatureVerdict.objects.filter(run=self.run).delete()
+
+  # The counts that go in a report
+  def summary(self):
+    return {
+      'complete': self.run.complete,
+      'features': self.run.number_of_features,
+      'validated': self.run.features_validated,
+      'carried_forward': self.run.number_of_features - self.run.features_validated,
+      'based_on': self.based_on.created.isoformat() if self.based_on else None
+    }
@@ -0,0 +1,159 @@
+from django.conf import settings
+from django.db import connection
+from django.utils import timezone
+from models import ValidationJob
+from validators.WfsCapabilities import WfsCapabilities
+from validators.WfsHarvest import feature_validator, WfsHarvest
+from contentmodels.schemacache import cached_schema
+from datetime import timedelta
+import time
+
+# The stages a job goes through, as shown on its status page
+STAGE_QUEUED = 'Waiting for a worker'
+STAGE_CAPABILITIES = 'Reading the GetCapabilities document'
+STAGE_SCHEMA = 'Compiling the schema'
+STAGE_VALIDATING = 'Validating features'
+STAGE_PAGE = 'Validating features, page %s'
+STAGE_FINISHED = 'Finished'
+
+# Seconds between progress reports written to the job table while features are validated
+PROGRESS_INTERVAL = 1.0
+
+#--------------------------------------------------------------------------------------
+# Settings for the job queue: whether the validation form queues jobs instead of
+#   validating in the request, how many jobs a worker runs at once, and how many minutes
+#   a running job can go without a report before it is assumed lost and queued again
+#--------------------------------------------------------------------------------------
+def jobs_enabled():
+  return getattr(settings, 'VALIDATION_USE_JOBS', False)
+
+def job_concurrency():
+  return getattr(settings, 'VALIDATION_JOB_CONCURRENCY', 2)
+
+def stale_after():
+  return timedelta(minutes=getattr(settings, 'VALIDATION_JOB_STALE_MINUTES', 10))
+
+#--------------------------------------------------------------------------------------
+# Function to queue a validation. Returns the ValidationJob.
+#--------------------------------------------------------------------------------------
+def submit_job(url, feature_type, number_of_features, modelversion):
+  return ValidationJob.objects.create(
+    url=url,
+    feature_type=feature_type,
+    number_of_features=number_of_features,
+    modelversion=modelversion,
+    stage=STAGE_QUEUED
+  )
+
+#--------------------------------------------------------------------------------------
+# Function to take the oldest queued job. Jobs are claimed with a conditional UPDATE, so
+#   that several workers can share the table without running a job twice. Each claim
+#   counts as a new attempt, and a worker only reports on the attempt it claimed: a job
+#   requeued as stale while its worker is still going can't be overwritten by that
+#   worker once another one has claimed it. Returns the claimed job's (pk, attempt), or
+#   None if nothing is queued.
+#--------------------------------------------------------------------------------------
+def claim_next_job():
+  candidates = ValidationJob.objects.filter(status=ValidationJob.QUEUED).order_by('created')
+  for pk, attempt in candidates.values_list('pk', 'attempt')[:10]:
+    now = timezone.now()
+    claimed = ValidationJob.objects.filter(pk=pk, status=ValidationJob.QUEUED, attempt=attempt).update(
+      status=ValidationJob.RUNNING, stage=STAGE_CAPABILITIES, started=now, updated=now, attempt=attempt + 1
+    )
+    if claimed == 1: return pk, attempt + 1
+  return None
+
+#--------------------------------------------------------------------------------------
+# Function to queue again the jobs whose worker stopped reporting on them, for instance
+#   because it was killed. Returns the number of jobs requeued.
+#--------------------------------------------------------------------------------------
+def requeue_stale_jobs():
+  cutoff = timezone.now() - stale_after()
+  return requeue(ValidationJob.objects.filter(status=ValidationJob.RUNNING, updated__lt=cutoff))
+
+# Function to queue again jobs that a stopping worker leaves unfinished, by the
+#   (pk, attempt) it claimed them with
+def requeue_jobs(claims):
+  requeued = 0
+  for pk, attempt in claims:
+    requeued += requeue(ValidationJob.objects.filter(status=ValidationJob.RUNNING, pk=pk, attempt=attempt))
+  return requeued
+
+def requeue(jobs):
+  return jobs.update(status=ValidationJob.QUEUED, stage=STAGE_QUEUED, features_validated=0)
+
+# Function to update a running job, if it is still at the attempt the caller claimed.
+#   Returns False if the job has been requeued, or claimed again, since.
+def report(pk, attempt, **changes):
+  changes['updated'] = timezone.now()
+  return ValidationJob.objects.filter(pk=pk, attempt=attempt, status=ValidationJob.RUNNING).update(**changes) == 1
+
+#--------------------------------------------------------------------------------------
+# Class for the progress callback handed to WfsGetFeature.validate. Writes the number of
+#   features validated so far at most once every PROGRESS_INTERVAL seconds.
+#--------------------------------------------------------------------------------------
+class ProgressReporter(object):
+  def __init__(self, pk, attempt):
+    self.pk = pk
+    self.attempt = attempt
+    self.reported = time.time()
+
+  def __call__(self, results):
+    if time.time() - self.reported < PROGRESS_INTERVAL: return
+    report(self.pk, self.attempt, features_validated=results.number_of_elements)
+    self.reported = time.time()
+    
+  # Function to call as each page of a harvested layer is finished
+  def page(self, pages, results):
+    report(self.pk, self.attempt, stage=STAGE_PAGE % (pages + 1), features_validated=results.number_of_elements)
+    self.reported = time.time()
+
+#--------------------------------------------------------------------------------------
+# Function to run a claimed job, in a worker process. Whatever happens, the job ends up
+#   done or failed, unless it was requeued meanwhile and belongs to another attempt.
+#--------------------------------------------------------------------------------------
+def run_job(pk, attempt):
+  try:
+    job = ValidationJob.objects.select_related('modelversion').get(pk=pk)
+
+    # Find the GetFeature URL for the FeatureType
+    capabilities = WfsCapabilities(job.url)
+    if not capabilities.url_is_valid:
+      return fail_job(pk, attempt, 'The GetCapabilities document could not be read: %s' % describe_errors(capabilities.errors))
+    get_feature = feature_validator(capabilities, job.feature_type, job.number_of_features)
+    if get_feature.url is None:
+      return fail_job(pk, attempt, 'The WFS does not offer %s' % job.feature_type)
+
+    # Compile the schema, unless this worker already has it
+    report(pk, attempt, stage=STAGE_SCHEMA, get_feature_url=get_feature.url)
+    cached_schema(job.modelversion)
+
+    # Validate, following a whole layer page by page
+    progress = ProgressReporter(pk, attempt)
+    if isinstance(get_feature, WfsHarvest):
+      report(pk, attempt, stage=STAGE_PAGE % 1)
+      result = get_feature.validate(job.modelversion, progress=progress, page_progress=progress.page)
+    else:
+      report(pk, attempt, stage=STAGE_VALIDATING)
+      result = get_feature.validate(job.modelversion, progress=progress)
+    report(pk, attempt,
+      status=ValidationJob.DONE,
+      stage=STAGE_FINISHED,
+      features_validated=result.number_of_elements,
+      result=result.to_json(),
+      finished=timezone.now()
+    )
+
+  # The worker must carry on with other jobs, whatever went wrong with this one
+  except Exception, err:
+    fail_job(pk, attempt, '%s: %s' % (err.__class__.__name__, err))
+
+  finally:
+    connection.close()
+
+# WfsBase records errors as dictionaries of { kind: error }
+def describe_errors(errors):
+  return '; '.join( str(error) for logged in errors for error in logged.values() ) or 'unknown error'
+
+def fail_job(pk, attempt, message):
+  report(pk, attempt, status=ValidationJob.FAILED, stage=STAGE_FINISHED, error=message, finished=timezone.now())
@@ -0,0 +1,84 @@
+from django.core.management.base import BaseCommand
+from django.db import connection
+from optparse import make_option
+from validation.jobs import claim_next_job, requeue_stale_jobs, requeue_jobs, run_job, job_concurrency
+from validation.batch import claim_next_batch, requeue_batches, run_queued_batch
+from validation.validators.featurepool import can_use_pool, feature_pool, close_feature_pool
+from multiprocessing.pool import ThreadPool
+import time
+
+#--------------------------------------------------------------------------------------
+# Command to run queued WFS validation jobs. Jobs are claimed from the job table and run
+#   in a pool of threads, at most --concurrency at once (VALIDATION_JOB_CONCURRENCY by
+#   default), sharing the schemas compiled for the jobs that came before. Large
+#   validations are handed on to this process's pool of feature workers (see
+#   featurepool.py), which is started before the threads are; lxml doesn't hold the
+#   interpreter lock while it validates, so smaller jobs run side by side too.
+#   Batches POSTed to /validate/wfs/batch are run the same way, once no job is waiting.
+#   Several of these commands can share one job table.
+#   Usage: python manage.py run_validation_jobs [--concurrency=<n>] [--poll=<seconds>] [--once]
+#--------------------------------------------------------------------------------------
+class Command(BaseCommand):
+  help = 'Run queued WFS validation jobs'
+  option_list = BaseCommand.option_list + (
+    make_option('--concurrency', type='int', dest='concurrency', default=None,
+      help='The number of jobs to run at once'),
+    make_option('--poll', type='float', dest='poll', default=2.0,
+      help='Seconds to wait between looks at the job table'),
+    make_option('--once', action='store_true', dest='once', default=False,
+      help='Run the jobs that are queued, then stop'),
+  )
+
+  def handle(self, *args, **options):
+    concurrency = options['concurrency'] or job_concurrency()
+
+    # Feature workers are forked without the database connection, and before any thread
+    #   could be holding a lock
+    connection.close()
+    if can_use_pool(): feature_pool()
+    pool = ThreadPool(concurrency)
+    self.stdout.write('Running validation jobs, %s at a time\n' % concurrency)
+
+    # Running jobs and batches, by ('Job', pk) or ('Batch', pk), and the attempts the
+    #   jobs were claimed at
+    running = {}
+    attempts = {}
+    try:
+      while True:
+        for key, result in running.items():
+          if result.ready():
+            del running[key]
+            attempts.pop(key, None)
+            self.stdout.write('%s %s finished\n' % key)
+
+        requeued = requeue_stale_jobs()
+        if requeued > 0: self.stdout.write('Requeued %s jobs that stopped reporting\n' % requeued)
+
+        # Fill the free workers, with jobs before batches
+        while len(running) < concurrency:
+          claim = claim_next_job()
+          if claim is not None:
+            key = ('Job', claim[0])
+            running[key] = pool.apply_async(run_job, claim)
+            attempts[key] = claim[1]
+          else:
+            pk = claim_next_batch()
+            if pk is None: break
+            key = ('Batch', pk)
+            running[key] = pool.apply_async(run_queued_batch, (pk,))
+          self.stdout.write('%s %s started\n' % key)
+
+        if options['once'] and len(running) == 0: break
+        connection.close()
+        time.sleep(options['poll'])
+
+    # Unfinished jobs go back in the queue for the next worker
+    except KeyboardInterrupt:
+      pool.terminate()
+      requeue_jobs([ (pk, attempts[kind, pk]) for kind, pk in running.keys() if kind == 'Job' ])
+      requeue_batches([ pk for kind, pk in running.keys() if kind == 'Batch' ])
+      raise
+
+    pool.close()
+    pool.join()
+    close_feature_pool()
@@ -0,0 +1,57 @@
+from django.core.management.base import BaseCommand, CommandError
+from optparse import make_option
+from django.db import connection
+from validation.batch import parse_manifest, run_batch
+from validation.validators.featurepool import can_use_pool, feature_pool, close_feature_pool
+import json, sys
+
+#--------------------------------------------------------------------------------------
+# Command to validate many FeatureTypes against many ModelVersions, as described by a
+#   JSON manifest (see validation.batch), and write a JSON report of the results with
+#   how long each validation took. The report goes to standard output unless --output
+#   names a file. With --incremental, only features that changed since the last
+#   incremental run are validated.
+#   Usage: python manage.py validate_wfs_batch <manifest> [--concurrency=<n>] [--output=<file>] [--incremental]
+#--------------------------------------------------------------------------------------
+class Command(BaseCommand):
+  args = '<manifest>'
+  help = 'Validate the WFS FeatureTypes listed in a JSON manifest, and write a JSON report'
+  option_list = BaseCommand.option_list + (
+    make_option('--concurrency', type='int', dest='concurrency', default=None,
+      help='The number of validations to run at once'),
+    make_option('--output', dest='output', default=None,
+      help='The file to write the report to'),
+    make_option('--incremental', action='store_true', dest='incremental', default=False,
+      help='Carry forward the verdicts of features that have not changed since the last run'),
+  )
+
+  def handle(self, *args, **options):
+    if len(args) != 1: raise CommandError('Usage: validate_wfs_batch %s' % self.args)
+
+    try:
+      with open(args[0]) as manifest:
+        tasks = parse_manifest(json.load(manifest), options['incremental'])
+    except IOError, err:
+      raise CommandError('The manifest could not be read: %s' % err)
+    except ValueError, err:
+      raise CommandError('The manifest could not be understood: %s' % err)
+
+    # Feature workers are forked without the database connection, and before the batch's
+    #   threads are started, as in run_validation_jobs. They are stopped once it is done.
+    sys.stderr.write('Running %s validations\n' % len(tasks))
+    connection.close()
+    if can_use_pool(): feature_pool()
+    try:
+      report = run_batch(tasks, options['concurrency'])
+    finally:
+      close_feature_pool()
+
+    if options['output'] is None:
+      self.stdout.write(json.dumps(report, indent=2) + '\n')
+    else:
+      with open(options['output'], 'w') as output: json.dump(report, output, indent=2)
+
+    summary = report['summary']
+    sys.stderr.write('%s passed, %s failed, %s could not be validated, in %.3f seconds\n' % (
+        summary['passed'], summary['failed'], summary['error'], report['seconds']
+      ))
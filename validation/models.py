@@ -0,0 +1,184 @@
+from django.db import models
+from django.utils import timezone
+from contentmodels.models import ModelVersion
+import json
+
+#--------------------------------------------------------------------------------------
+# This class represents a WFS validation that is run outside of the web request that
+#   asked for it. Jobs are queued in this table and picked up by the worker processes
+#   of the run_validation_jobs command, which record the stage a job has reached and
+#   how many features it has validated as it goes. The results are stored as JSON.
+#--------------------------------------------------------------------------------------
+class ValidationJob(models.Model):
+  QUEUED = 'queued'
+  RUNNING = 'running'
+  DONE = 'done'
+  FAILED = 'failed'
+  STATUS_CHOICES = (
+    (QUEUED, 'Queued'),
+    (RUNNING, 'Running'),
+    (DONE, 'Done'),
+    (FAILED, 'Failed')
+  )
+
+  class Meta:
+    ordering = ['created']
+
+  # What to validate
+  url = models.CharField(max_length=2000) # The WFS GetCapabilities URL
+  feature_type = models.CharField(max_length=500)
+  number_of_features = models.PositiveIntegerField()
+  modelversion = models.ForeignKey(ModelVersion)
+
+  # How far the job has got
+  status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=QUEUED, db_index=True)
+  stage = models.CharField(max_length=100, blank=True)
+  features_validated = models.PositiveIntegerField(default=0)
+  created = models.DateTimeField(default=timezone.now)
+  started = models.DateTimeField(null=True, blank=True)
+  finished = models.DateTimeField(null=True, blank=True)
+  updated = models.DateTimeField(default=timezone.now) # When a worker last reported on the job
+  attempt = models.PositiveIntegerField(default=0) # How many times a worker has claimed the job
+
+  # The outcome
+  get_feature_url = models.CharField(max_length=2000, blank=True)
+  result = models.TextField(blank=True) # JSON
+  error = models.TextField(blank=True)
+
+  def __unicode__(self):
+    return '%s against %s' % (self.feature_type, self.modelversion)
+
+  def is_finished(self):
+    return self.status in [self.DONE, self.FAILED]
+
+  def result_data(self):
+    if not self.result: return None
+    return json.loads(self.result)
+
+  # Function to describe a finished job's results, along with what was validated
+  def result_document(self):
+    return dict(self.result_data(),
+      wfs_url=self.url,
+      get_feature_url=self.get_feature_url,
+      feature_type=self.feature_type,
+      model_version=self.modelversion.absolute_uri()
+    )
+
+  def absolute_url(self):
+    return '/validate/wfs/jobs/%s' % self.pk
+
+  # Function to describe the job's progress, for the status endpoint
+  def serialized(self):
+    return {
+      'id': self.pk,
+      'status': self.status,
+      'stage': self.stage,
+      'features_validated': self.features_validated,
+      'created': self.created.isoformat(),
+      'started': self.started.isoformat() if self.started else None,
+      'finished': self.finished.isoformat() if self.finished else None,
+      'error': self.error or None,
+      'url': self.absolute_url()
+    }
+
+#--------------------------------------------------------------------------------------
+# This class represents a batch of validations described by a JSON manifest (see
+#   batch.py) that was POSTed to /validate/wfs/batch. Batches are queued in this table
+#   and run by the run_validation_jobs command, like ValidationJobs, which record how
+#   many of the batch's validations have finished as they go. The report is stored as
+#   JSON.
+#--------------------------------------------------------------------------------------
+class ValidationBatch(models.Model):
+  QUEUED = ValidationJob.QUEUED
+  RUNNING = ValidationJob.RUNNING
+  DONE = ValidationJob.DONE
+  FAILED = ValidationJob.FAILED
+
+  class Meta:
+    ordering = ['created']
+
+  # What to validate
+  manifest = models.TextField() # JSON
+  number_of_tasks = models.PositiveIntegerField(default=0)
+
+  # How far the batch has got
+  status = models.CharField(max_length=10, choices=ValidationJob.STATUS_CHOICES, default=QUEUED, db_index=True)
+  tasks_finished = models.PositiveIntegerField(default=0)
+  created = models.DateTimeField(default=timezone.now)
+  started = models.DateTimeField(null=True, blank=True)
+  finished = models.DateTimeField(null=True, blank=True)
+  updated = models.DateTimeField(default=timezone.now)
+
+  # The outcome
+  report = models.TextField(blank=True) # JSON
+  error = models.TextField(blank=True)
+
+  def __unicode__(self):
+    return 'Batch of %s validations, %s' % (self.number_of_tasks, self.created)
+
+  def absolute_url(self):
+    return '/validate/wfs/batches/%s' % self.pk
+
+  def report_url(self):
+    return '%s/report' % self.absolute_url()
+
+  # Function to describe the batch's progress, for the status endpoint
+  def serialized(self):
+    return {
+      'id': self.pk,
+      'status': self.status,
+      'tasks': self.number_of_tasks,
+      'tasks_finished': self.tasks_finished,
+      'created': self.created.isoformat(),
+      'started': self.started.isoformat() if self.started else None,
+      'finished': self.finished.isoformat() if self.finished else None,
+      'error': self.error or None,
+      'url': self.absolute_url(),
+      'report_url': self.report_url()
+    }
+
+#--------------------------------------------------------------------------------------
+# This class represents an incremental validation of a FeatureType, see incremental.py.
+#   Runs are keyed by the WFS, the FeatureType, the ModelVersion and the hash of its
+#   schema, so that a changed XSD starts over. A run is complete once every feature's
+#   verdict has been saved; only complete runs are built on.
+#--------------------------------------------------------------------------------------
+class ValidationRun(models.Model):
+  class Meta:
+    ordering = ['created']
+
+  url = models.CharField(max_length=2000) # The WFS GetCapabilities URL
+  feature_type = models.CharField(max_length=500)
+  modelversion = models.ForeignKey(ModelVersion)
+  schema_hash = models.CharField(max_length=64)
+  created = models.DateTimeField(default=timezone.now)
+  finished = models.DateTimeField(null=True, blank=True)
+  complete = models.BooleanField(default=False)
+
+  # How many features the run saw, and how many of them had to be validated
+  number_of_features = models.PositiveIntegerField(default=0)
+  features_validated = models.PositiveIntegerField(default=0)
+
+  def __unicode__(self):
+    return '%s against %s, %s' % (self.feature_type, self.modelversion, self.created)
+
+  # The other runs with the same key
+  def siblings(self):
+    return ValidationRun.objects.filter(
+      url=self.url,
+      feature_type=self.feature_type,
+      modelversion=self.modelversion_id,
+      schema_hash=self.schema_hash
+    ).exclude(pk=self.pk)
+
+#--------------------------------------------------------------------------------------
+# This class represents what a ValidationRun found for one feature: whether it was valid,
+#   and its errors as a JSON list of [type, message, path]. Features are known by the
+#   hash of their canonical XML.
+#--------------------------------------------------------------------------------------
+class FeatureVerdict(models.Model):
+  run = models.ForeignKey(ValidationRun, related_name='verdicts')
+  digest = models.CharField(max_length=40)
+  feature_id = models.CharField(max_length=500, blank=True)
+  valid = models.BooleanField()
+  errors = models.TextField(blank=True) # JSON
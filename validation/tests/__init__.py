@@ -0,0 +1,8 @@
+from features import FeatureStreamTestCase
+from httpclient import HttpClientTestCase
+from jobs import JobQueueTestCase
+from parallel import ParallelValidationTestCase
+from harvest import HarvestTestCase
+from results import ValidationResultsTestCase
+from batch import ManifestTestCase, BatchViewTestCase
+from incremental import IncrementalRunTestCase, IncrementalTaskTestCase
@@ -0,0 +1,56 @@
+from django.test import TestCase
+from django.core.files.base import ContentFile
+from django.core.files import File
+from django.conf import settings
+from contentmodels.models import ContentModel, ModelVersion
+from contentmodels.schemacache import schema_cache
+import os, shutil
+
+NAMESPACE = 'http://example.com/validationtest'
+
+# A schema for features like <test:Feature gml:id="..."><test:Depth>12.5</test:Depth></test:Feature>
+SCHEMA = '''<?xml version="1.0"?>
+<xs:schema xmlns:xs="http://www.w3.org/2001/XMLSchema" targetNamespace="%s" elementFormDefault="qualified">
+  <xs:element name="Feature">
+    <xs:complexType>
+      <xs:sequence><xs:element name="Depth" type="xs:decimal"/></xs:sequence>
+      <xs:anyAttribute processContents="skip"/>
+    </xs:complexType>
+  </xs:element>
+</xs:schema>''' % NAMESPACE
+
+FEATURE_TYPE = 'test:Feature'
+
+# Function to write a FeatureCollection of features given as (gml:id, depth) pairs. A
+#   depth that isn't a number makes the feature invalid.
+def feature_collection(features, attributes=''):
+  members = ''.join( '<gml:featureMember><test:Feature gml:id="%s"><test:Depth>%s</test:Depth></test:Feature></gml:featureMember>' % feature for feature in features )
+  return '<?xml version="1.0"?><wfs:FeatureCollection xmlns:wfs="http://www.opengis.net/wfs" xmlns:gml="http://www.opengis.net/gml" xmlns:test="%s"%s>%s</wfs:FeatureCollection>' % (NAMESPACE, attributes, members)
+
+#--------------------------------------------------------------------------------------
+# Base class for the tests that validate against a ModelVersion, whose schema is SCHEMA
+#--------------------------------------------------------------------------------------
+class ValidationTestCase(TestCase):
+  fixtures = [
+      "tests/cm-example.json"
+    ]
+  
+  def setUp(self):
+    schema_cache.clear()
+    self.cm = ContentModel.objects.create(title="Validation Test", label="validationtest", description="Testing")
+    self.version = self.createVersion("1.0")
+  
+  def tearDown(self):
+    schema_cache.clear()
+    for cm in ContentModel.objects.all():
+      model_path = os.path.join(settings.MEDIA_ROOT, cm.folder_path())
+      if os.path.exists(model_path):
+        shutil.rmtree(model_path)
+  
+  def createVersion(self, version, schema=SCHEMA):
+    return ModelVersion.objects.create(
+        content_model = self.cm,
+        version = version,
+        xsd_file = File(ContentFile(schema), "schema.xsd"),
+        xls_file = File(ContentFile("Dummy Excel File"), "dummyFile.xls")
+      )
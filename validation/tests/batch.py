@@ -0,0 +1,142 @@
+from django.contrib.auth.models import User
+from django.http import Http404
+from django.test.client import Client, RequestFactory
+from django.test.utils import override_settings
+from validation.batch import parse_manifest, ManifestError, submit_batch, claim_next_batch, run_queued_batch, DEFAULT_NUMBER_OF_FEATURES, ERROR
+from validation.models import ValidationBatch
+from validation.validators.wfs import wfs_batch_report
+from base import ValidationTestCase
+from server import TestServer
+import json
+
+class ManifestTestCase(ValidationTestCase):
+  def manifest(self, **endpoint):
+    """A manifest with one endpoint, changed by endpoint"""
+    entry = {
+      'url': 'http://example.com/wfs?request=GetCapabilities',
+      'feature_types': ['test:Feature', 'test:Other'],
+      'model_versions': [ { 'content_model': 'validationtest', 'version': '1.0' } ]
+    }
+    entry.update(endpoint)
+    return { 'endpoints': [ entry ] }
+  
+  def assertInvalid(self, manifest, message):
+    try:
+      parse_manifest(manifest)
+      self.fail('No ManifestError was raised')
+    except ManifestError, err:
+      self.assertIn(message, str(err))
+  
+  def test_tasks(self):
+    tasks = parse_manifest(self.manifest())
+    self.assertEqual([ task.feature_type for task in tasks ], ['test:Feature', 'test:Other'])
+    self.assertEqual(tasks[0].modelversion, self.version)
+    self.assertEqual(tasks[0].number_of_features, DEFAULT_NUMBER_OF_FEATURES)
+    self.assertFalse(tasks[0].incremental)
+  
+  def test_defaults_overridden(self):
+    manifest = self.manifest(number_of_features=0, incremental=True)
+    manifest['number_of_features'] = 10
+    tasks = parse_manifest(manifest)
+    self.assertEqual(tasks[0].number_of_features, 0)
+    self.assertTrue(tasks[0].incremental)
+    self.assertTrue(parse_manifest(self.manifest(), incremental=True)[0].incremental)
+  
+  def test_not_a_manifest(self):
+    self.assertInvalid([], 'list of endpoints')
+    self.assertInvalid({ 'endpoints': {} }, 'list of endpoints')
+    self.assertInvalid({ 'endpoints': ['http://example.com/wfs'] }, 'Endpoint 1 is not an object')
+  
+  def test_bad_endpoint(self):
+    self.assertInvalid(self.manifest(url=''), 'Endpoint 1 has no url')
+    self.assertInvalid(self.manifest(feature_types=[]), 'Endpoint 1 needs a list of feature_types')
+    self.assertInvalid(self.manifest(feature_types=[3]), 'Endpoint 1 needs a list of feature_types')
+    self.assertInvalid(self.manifest(model_versions=None), 'Endpoint 1 has no model_versions')
+    self.assertInvalid(self.manifest(model_versions=['validationtest']), 'not an object')
+  
+  def test_unknown_model_version(self):
+    self.assertInvalid(self.manifest(model_versions=[ { 'content_model': 'validationtest', 'version': '9.9' } ]), 'version 9.9 of validationtest, which does not exist')
+  
+  def test_bad_values(self):
+    self.assertInvalid(self.manifest(number_of_features=-1), 'number_of_features')
+    self.assertInvalid(self.manifest(number_of_features=True), 'number_of_features')
+    self.assertInvalid(self.manifest(number_of_features='10'), 'number_of_features')
+    self.assertInvalid(self.manifest(incremental='yes'), 'incremental must be true or false')
+
+@override_settings(VALIDATION_API_TOKEN='secret')
+class BatchViewTestCase(ManifestTestCase):
+  def setUp(self):
+    super(BatchViewTestCase, self).setUp()
+    staff = User.objects.create_user('staff', 'staff@example.com', 'password')
+    staff.is_staff = True
+    staff.save()
+    User.objects.create_user('user', 'user@example.com', 'password')
+  
+  def post(self, manifest, client=None, **extra):
+    return (client or Client()).post('/validate/wfs/batch', json.dumps(manifest), content_type='application/json', **extra)
+  
+  def test_anonymous_refused(self):
+    self.assertEqual(self.post(self.manifest()).status_code, 403)
+    self.assertEqual(self.post(self.manifest(), HTTP_AUTHORIZATION='Token wrong').status_code, 403)
+    self.assertEqual(ValidationBatch.objects.count(), 0)
+  
+  def test_user_refused(self):
+    client = Client()
+    client.login(username='user', password='password')
+    self.assertEqual(self.post(self.manifest(), client).status_code, 403)
+  
+  @override_settings(VALIDATION_API_TOKEN=None)
+  def test_no_token_set(self):
+    self.assertEqual(self.post(self.manifest(), HTTP_AUTHORIZATION='Token ').status_code, 403)
+  
+  def test_queued_with_token(self):
+    response = self.post(self.manifest(), HTTP_AUTHORIZATION='Token secret')
+    self.assertEqual(response.status_code, 202)
+    data = json.loads(response.content)
+    batch = ValidationBatch.objects.get(pk=data['id'])
+    self.assertEqual(batch.status, ValidationBatch.QUEUED)
+    self.assertEqual(batch.number_of_tasks, 2)
+    self.assertEqual(data['report_url'], '/validate/wfs/batches/%s/report' % batch.pk)
+  
+  def test_staff_needs_csrf_token(self):
+    client = Client(enforce_csrf_checks=True)
+    client.login(username='staff', password='password')
+    self.assertEqual(self.post(self.manifest(), client).status_code, 403)
+    client = Client()
+    client.login(username='staff', password='password')
+    self.assertEqual(self.post(self.manifest(), client).status_code, 202)
+  
+  def test_bad_manifest(self):
+    response = self.post(self.manifest(url=''), HTTP_AUTHORIZATION='Token secret')
+    self.assertEqual(response.status_code, 400)
+    self.assertIn('no url', json.loads(response.content)['error'])
+    response = Client().post('/validate/wfs/batch', '{', content_type='application/json', HTTP_AUTHORIZATION='Token secret')
+    self.assertEqual(response.status_code, 400)
+  
+  def test_only_post(self):
+    self.assertEqual(Client().get('/validate/wfs/batch', HTTP_AUTHORIZATION='Token secret').status_code, 405)
+  
+  def test_run_batch(self):
+    """A queued batch is run, and its report served once it is done"""
+    server = TestServer(lambda handler: handler.send(404, 'Not found'))
+    try:
+      batch = submit_batch(self.manifest(url=server.url('/wfs?request=GetCapabilities')))
+      client = Client(HTTP_AUTHORIZATION='Token secret')
+      self.assertEqual(client.get(batch.absolute_url()).status_code, 200)
+      self.assertEqual(Client().get(batch.absolute_url()).status_code, 403)
+      unfinished = RequestFactory().get(batch.report_url(), HTTP_AUTHORIZATION='Token secret')
+      self.assertRaises(Http404, wfs_batch_report, unfinished, batch.pk)
+      
+      self.assertEqual(claim_next_batch(), batch.pk)
+      self.assertEqual(claim_next_batch(), None)
+      run_queued_batch(batch.pk)
+    finally:
+      server.stop()
+    
+    status = json.loads(client.get(batch.absolute_url()).content)
+    self.assertEqual(status['status'], ValidationBatch.DONE)
+    self.assertEqual(status['tasks_finished'], 2)
+    report = json.loads(client.get(batch.report_url()).content)
+    self.assertEqual(report['summary']['tasks'], 2)
+    self.assertEqual(report['summary'][ERROR], 2)
+    self.assertIn('GetCapabilities', report['tasks'][0]['error'])
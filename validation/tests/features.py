@@ -0,0 +1,79 @@
+from django.test import TestCase
+from validation.validators.WfsGetFeature import WfsGetFeature, feature_tag, release
+from lxml import etree
+from StringIO import StringIO
+
+# A FeatureCollection whose features are in a namespace declared on the root, with the
+#   prefix the FeatureType is asked for by, and a different prefix used by a nested element
+COLLECTION = '''<?xml version="1.0"?>
+<wfs:FeatureCollection xmlns:wfs="http://www.opengis.net/wfs" xmlns:gml="http://www.opengis.net/gml" xmlns:aasg="http://stategeothermaldata.org/uri-gin/aasg/xmlschema/test">
+  <gml:featureMember>
+    <aasg:Borehole gml:id="b1"><aasg:Name>One</aasg:Name></aasg:Borehole>
+  </gml:featureMember>
+  <gml:featureMember>
+    <aasg:Borehole gml:id="b2"><aasg:Name>Two</aasg:Name></aasg:Borehole>
+  </gml:featureMember>
+  <gml:featureMember>
+    <other:Borehole xmlns:other="http://example.com/other" gml:id="x1"/>
+  </gml:featureMember>
+  <gml:featureMember>
+    <aasg:Borehole gml:id="b3"><aasg:Name>Three</aasg:Name></aasg:Borehole>
+  </gml:featureMember>
+</wfs:FeatureCollection>'''
+
+NAMESPACE = 'http://stategeothermaldata.org/uri-gin/aasg/xmlschema/test'
+GML_ID = '{http://www.opengis.net/gml}id'
+
+# Stand-in for WfsCapabilities, which would read a GetCapabilities document
+class Capabilities(object):
+  def get_feature_url(self, feature_type, number_of_features):
+    return 'http://example.com/wfs?typeName=%s' % feature_type
+
+class FeatureStreamTestCase(TestCase):
+  def features(self, feature_type, collection=COLLECTION):
+    """Make a WfsGetFeature, and the generator of its features in collection"""
+    validator = WfsGetFeature(Capabilities(), feature_type, 10)
+    return validator.iter_features(StringIO(collection))
+  
+  def test_namespaced_features(self):
+    ids = [ item.get(GML_ID) for item in self.features('aasg:Borehole') ]
+    self.assertEqual(ids, ['b1', 'b2', 'b3'])
+  
+  def test_whole_features(self):
+    """Each feature is complete when it is handed out"""
+    for item in self.features('aasg:Borehole'):
+      self.assertEqual(item.tag, '{%s}Borehole' % NAMESPACE)
+      self.assertEqual(len(item), 1)
+      self.assertEqual(item[0].tag, '{%s}Name' % NAMESPACE)
+  
+  def test_undeclared_prefix(self):
+    self.assertEqual(list(self.features('nope:Borehole')), [])
+  
+  def test_unprefixed_feature_type(self):
+    collection = '<FeatureCollection><Borehole id="1"/><Borehole id="2"/></FeatureCollection>'
+    self.assertEqual([ item.get('id') for item in self.features('Borehole', collection) ], ['1', '2'])
+  
+  def test_features_released(self):
+    """Features are cleared and dropped from the tree once the loop has moved on"""
+    seen = []
+    for item in self.features('aasg:Borehole'):
+      root = item.getroottree().getroot()
+      for previous in seen:
+        self.assertEqual(len(previous), 0)
+      # Only the feature just before this one, or this one, is left at the top
+      self.assertIn(root[0][0], seen[-1:] + [item])
+      seen.append(item)
+    self.assertEqual(len(seen), 3)
+  
+  def test_feature_tag(self):
+    namespaces = { 'aasg': NAMESPACE }
+    self.assertEqual(feature_tag('aasg', 'Borehole', namespaces), '{%s}Borehole' % NAMESPACE)
+    self.assertEqual(feature_tag('', 'Borehole', namespaces), 'Borehole')
+    self.assertEqual(feature_tag('gml', 'Borehole', namespaces), None)
+  
+  def test_release(self):
+    root = etree.fromstring('<root><member><a/></member><member><b><c/></b></member><member><d/></member></root>')
+    second = root[1][0]
+    release(second)
+    self.assertEqual(len(second), 0)
+    self.assertEqual([ member[0].tag for member in root ], ['b', 'd'])
@@ -0,0 +1,120 @@
+from validation.validators.WfsCapabilities import WfsCapabilities, forget_capabilities
+from validation.validators.WfsHarvest import WfsHarvest, ALL_FEATURES
+from validation.validators.wfs import WfsValidationParametersForm
+from django.test.utils import override_settings
+from base import ValidationTestCase, FEATURE_TYPE, feature_collection
+from server import TestServer
+from urlparse import urlparse, parse_qs
+
+CAPABILITIES = '''<?xml version="1.0"?>
+<wfs:WFS_Capabilities version="2.0.0" xmlns:wfs="http://www.opengis.net/wfs/2.0" xmlns:ows="http://www.opengis.net/ows/1.1" xmlns:xlink="http://www.w3.org/1999/xlink">
+  <ows:OperationsMetadata>
+    <ows:Operation name="GetFeature">
+      <ows:DCP><ows:HTTP><ows:Get xlink:href="%s"/></ows:HTTP></ows:DCP>
+    </ows:Operation>
+    <ows:Constraint name="ImplementsResultPaging"><ows:NoValues/><ows:DefaultValue>%s</ows:DefaultValue></ows:Constraint>
+  </ows:OperationsMetadata>
+  <wfs:FeatureTypeList>
+    <wfs:FeatureType><wfs:Name>%s</wfs:Name></wfs:FeatureType>
+  </wfs:FeatureTypeList>
+</wfs:WFS_Capabilities>'''
+
+#--------------------------------------------------------------------------------------
+# A WFS with self.total features, that returns at most self.cap of them at once however
+#   many are asked for, like servers with a maximum page size do. Only the first
+#   self.served features are actually returned.
+#--------------------------------------------------------------------------------------
+class HarvestTestCase(ValidationTestCase):
+  def setUp(self):
+    super(HarvestTestCase, self).setUp()
+    self.total = 23
+    self.served = 23
+    self.cap = 4
+    self.paging = 'TRUE'
+    self.matched = True
+    self.server = TestServer(self.respond)
+    self.capabilities_url = self.server.url('/capabilities?request=GetCapabilities')
+  
+  def tearDown(self):
+    self.server.stop()
+    forget_capabilities(self.capabilities_url)
+    super(HarvestTestCase, self).tearDown()
+  
+  def respond(self, handler):
+    if handler.path.startswith('/capabilities'):
+      return handler.send(200, CAPABILITIES % (self.server.url('/wfs?'), self.paging, FEATURE_TYPE))
+    query = parse_qs(urlparse(handler.path).query)
+    start = int(query.get('startIndex', ['0'])[0])
+    count = min(int(query.get('count', [self.total])[0]), self.cap)
+    numbers = range(start, min(start + count, self.served))
+    attributes = ' numberMatched="%s" numberReturned="%s"' % (self.total, len(numbers)) if self.matched else ''
+    handler.send(200, feature_collection([ ('f%s' % number, number) for number in numbers ], attributes))
+  
+  def harvest(self):
+    capabilities = WfsCapabilities(self.capabilities_url)
+    self.harvester = WfsHarvest(capabilities, FEATURE_TYPE, page_size=10)
+    return self.harvester.validate(self.version)
+  
+  def start_indexes(self):
+    return [ parse_qs(urlparse(path).query)['startIndex'][0] for path, headers in self.server.requests if path.startswith('/wfs') ]
+  
+  def test_capped_pages(self):
+    results = self.harvest()
+    self.assertTrue(results.valid)
+    self.assertEqual(results.number_of_elements, 23)
+    self.assertEqual(self.harvester.pages, 6)
+    # Every page starts where the last one ended; guesses that were wrong are dropped
+    for start in ['0', '4', '8', '12', '16', '20']: self.assertIn(start, self.start_indexes())
+  
+  def test_capped_pages_without_number_matched(self):
+    """Without numberMatched, the walk goes on until a page comes back empty"""
+    self.matched = False
+    results = self.harvest()
+    self.assertTrue(results.valid)
+    self.assertEqual(results.number_of_elements, 23)
+    self.assertEqual(self.harvester.pages, 7)
+  
+  def test_full_pages(self):
+    self.cap = 10
+    results = self.harvest()
+    self.assertTrue(results.valid)
+    self.assertEqual(results.number_of_elements, 23)
+    self.assertEqual(self.harvester.pages, 3)
+    self.assertEqual(self.start_indexes()[:3], ['0', '10', '20'])
+  
+  def test_truncated_layer(self):
+    self.served = 13
+    results = self.harvest()
+    self.assertFalse(results.valid)
+    self.assertEqual(results.number_of_elements, 13)
+    self.assertIn('Only 13 of the 23 features', results.errors[0].message)
+  
+  def test_truncated_unpaged_layer(self):
+    self.paging = 'FALSE'
+    self.cap = 20
+    results = self.harvest()
+    self.assertFalse(results.valid)
+    self.assertEqual(results.number_of_elements, 20)
+    self.assertIn('Only 20 of the 23 features', results.errors[0].message)
+  
+  def form(self, number_of_features):
+    return WfsValidationParametersForm(self.capabilities_url, {
+      'url': self.capabilities_url,
+      'content_model': self.cm.pk,
+      'version': self.version.pk,
+      'feature_type': FEATURE_TYPE,
+      'number_of_features': number_of_features
+    })
+  
+  def test_whole_layer_only_as_job(self):
+    """Whole layers, and other numbers not offered, should be refused unless jobs are used"""
+    form = self.form(10)
+    self.assertTrue(form.is_valid())
+    self.assertEqual(form.cleaned_data['number_of_features'], 10)
+    self.assertFalse(self.form(ALL_FEATURES).is_valid())
+    self.assertFalse(self.form(1000).is_valid())
+    self.assertFalse(self.form(7).is_valid())
+    with override_settings(VALIDATION_USE_JOBS=True):
+      form = self.form(ALL_FEATURES)
+      self.assertTrue(form.is_valid())
+      self.assertEqual(form.cleaned_data['number_of_features'], ALL_FEATURES)
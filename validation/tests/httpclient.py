@@ -0,0 +1,92 @@
+from django.test import TestCase
+from django.test.utils import override_settings
+from validation.validators.httpclient import HttpClient, HttpError, MAX_REDIRECTS
+from validation.validators.WfsCapabilities import WfsCapabilities, forget_capabilities
+from server import TestServer
+
+CAPABILITIES = '''<?xml version="1.0"?>
+<wfs:WFS_Capabilities version="1.1.0" xmlns:wfs="http://www.opengis.net/wfs" xmlns:ows="http://www.opengis.net/ows" xmlns:xlink="http://www.w3.org/1999/xlink">
+  <ows:OperationsMetadata>
+    <ows:Operation name="GetFeature">
+      <ows:DCP><ows:HTTP><ows:Get xlink:href="http://example.com/wfs?"/></ows:HTTP></ows:DCP>
+    </ows:Operation>
+  </ows:OperationsMetadata>
+  <wfs:FeatureTypeList>
+    <wfs:FeatureType><wfs:Name>%s</wfs:Name></wfs:FeatureType>
+  </wfs:FeatureTypeList>
+</wfs:WFS_Capabilities>'''
+
+class HttpClientTestCase(TestCase):
+  def setUp(self):
+    self.feature_type = 'aasg:Borehole'
+    self.etag = '"one"'
+    self.server = TestServer(self.respond)
+    self.client = HttpClient(timeout=5)
+    self.capabilities_url = self.server.url('/wfs?request=GetCapabilities')
+  
+  def tearDown(self):
+    self.client.close()
+    self.server.stop()
+    forget_capabilities(self.capabilities_url)
+  
+  def respond(self, handler):
+    path = handler.path
+    if path == '/moved': return handler.send(301, headers={ 'Location': '/elsewhere/moved-again' })
+    if path == '/elsewhere/moved-again': return handler.send(302, headers={ 'Location': self.server.url('/document') })
+    if path == '/document': return handler.send(200, 'The document')
+    if path.startswith('/loop'): return handler.send(302, headers={ 'Location': '/loop%s' % (int(path[5:] or 0) + 1) })
+    if path.startswith('/wfs'):
+      if handler.headers.get('If-None-Match') == self.etag: return handler.send(304, headers={ 'ETag': self.etag })
+      return handler.send(200, CAPABILITIES % self.feature_type, { 'ETag': self.etag })
+    handler.send(404, 'Not found')
+  
+  def paths(self):
+    return [ path for path, headers in self.server.requests ]
+  
+  def test_follows_redirects(self):
+    response = self.client.get(self.server.url('/moved'))
+    self.assertEqual(response.status, 200)
+    self.assertEqual(response.read(), 'The document')
+    self.assertEqual(self.paths(), ['/moved', '/elsewhere/moved-again', '/document'])
+  
+  def test_too_many_redirects(self):
+    self.assertRaises(HttpError, self.client.get, self.server.url('/loop'))
+    self.assertEqual(len(self.server.requests), MAX_REDIRECTS + 1)
+  
+  def test_error_status(self):
+    try:
+      self.client.get(self.server.url('/missing'))
+      self.fail('No HttpError was raised')
+    except HttpError, err:
+      self.assertEqual(err.status, 404)
+  
+  def test_connection_reused(self):
+    """A response read to the end hands its connection back to the pool"""
+    self.client.get(self.server.url('/document')).read()
+    self.client.get(self.server.url('/document')).read()
+    self.assertEqual(sum( len(idle) for idle in self.client.idle.values() ), 1)
+  
+  def test_fresh_summary_reused(self):
+    WfsCapabilities(self.capabilities_url)
+    capabilities = WfsCapabilities(self.capabilities_url)
+    self.assertEqual(capabilities.feature_types, [self.feature_type])
+    self.assertEqual(len(self.server.requests), 1)
+  
+  @override_settings(VALIDATION_CAPABILITIES_TTL=0)
+  def test_revalidated_not_modified(self):
+    """A stale summary is revalidated, and kept when the server answers 304"""
+    WfsCapabilities(self.capabilities_url)
+    self.feature_type = 'aasg:Changed'
+    capabilities = WfsCapabilities(self.capabilities_url)
+    self.assertEqual(self.server.requests[1][1].get('If-None-Match'), '"one"')
+    self.assertEqual(capabilities.feature_types, ['aasg:Borehole'])
+    self.assertTrue(capabilities.url_is_valid)
+  
+  @override_settings(VALIDATION_CAPABILITIES_TTL=0)
+  def test_revalidated_changed(self):
+    """A document that has changed is summarized again"""
+    WfsCapabilities(self.capabilities_url)
+    self.feature_type = 'aasg:Changed'
+    self.etag = '"two"'
+    capabilities = WfsCapabilities(self.capabilities_url)
+    self.assertEqual(capabilities.feature_types, ['aasg:Changed'])
@@ -0,0 +1,126 @@
+from validation.incremental import IncrementalRun
+from validation.batch import BatchTask, run_task
+from validation.models import ValidationRun, FeatureVerdict
+from validation.validators.WfsCapabilities import WfsCapabilities, forget_capabilities
+from contentmodels.schemacache import cached_schema
+from base import ValidationTestCase, FEATURE_TYPE, SCHEMA, feature_collection
+from server import TestServer
+from lxml import etree
+
+URL = 'http://example.com/wfs?request=GetCapabilities'
+
+CAPABILITIES = '''<?xml version="1.0"?>
+<wfs:WFS_Capabilities version="1.1.0" xmlns:wfs="http://www.opengis.net/wfs" xmlns:ows="http://www.opengis.net/ows" xmlns:xlink="http://www.w3.org/1999/xlink">
+  <ows:OperationsMetadata>
+    <ows:Operation name="GetFeature">
+      <ows:DCP><ows:HTTP><ows:Get xlink:href="%s"/></ows:HTTP></ows:DCP>
+    </ows:Operation>
+  </ows:OperationsMetadata>
+  <wfs:FeatureTypeList>
+    <wfs:FeatureType><wfs:Name>%s</wfs:Name></wfs:FeatureType>
+  </wfs:FeatureTypeList>
+</wfs:WFS_Capabilities>'''
+
+class IncrementalRunTestCase(ValidationTestCase):
+  def check_all(self, features):
+    """Run an IncrementalRun over features, given as (gml:id, depth) pairs, and finish it"""
+    verdicts = IncrementalRun(URL, FEATURE_TYPE, self.version)
+    compiled = cached_schema(self.version)
+    outcome = {}
+    for element in etree.fromstring(feature_collection(features)).iter('{*}Feature'):
+      id = element.get('{http://www.opengis.net/gml}id')
+      outcome[id] = verdicts.check(element, id, compiled)
+    verdicts.finish()
+    return verdicts, outcome
+  
+  def test_carry_forward(self):
+    first, first_outcome = self.check_all([('f1', 1), ('f2', 'deep'), ('f3', 3)])
+    self.assertEqual(first.run.features_validated, 3)
+    self.assertEqual(first.based_on, None)
+    
+    second, second_outcome = self.check_all([('f1', 1), ('f2', 'deep'), ('f3', 'shallow'), ('f4', 4)])
+    self.assertEqual(second.based_on, first.run)
+    self.assertEqual(second.run.number_of_features, 4)
+    self.assertEqual(second.run.features_validated, 2)
+    self.assertEqual(second_outcome['f2'], first_outcome['f2'])
+    self.assertFalse(second_outcome['f2'][0])
+    self.assertFalse(second_outcome['f3'][0])
+    self.assertTrue(second_outcome['f4'][0])
+    summary = second.summary()
+    self.assertEqual(summary['carried_forward'], 2)
+    self.assertTrue(summary['complete'])
+    
+    # Only the verdicts of the latest complete run are kept
+    self.assertEqual(FeatureVerdict.objects.filter(run=first.run).count(), 0)
+    self.assertEqual(FeatureVerdict.objects.filter(run=second.run).count(), 4)
+  
+  def test_schema_changed(self):
+    """A change to the XSD file starts over"""
+    first, outcome = self.check_all([('f1', 1), ('f2', 2)])
+    with open(self.version.xsd_file.path, 'w') as xsd: xsd.write(SCHEMA.replace('xs:decimal', 'xs:integer'))
+    second, outcome = self.check_all([('f1', 1), ('f2', 2)])
+    self.assertNotEqual(second.run.schema_hash, first.run.schema_hash)
+    self.assertEqual(second.based_on, None)
+    self.assertEqual(second.run.features_validated, 2)
+    # The first run has a different key, so its verdicts are left alone
+    self.assertEqual(FeatureVerdict.objects.filter(run=first.run).count(), 2)
+  
+  def test_other_feature_type(self):
+    self.check_all([('f1', 1)])
+    verdicts = IncrementalRun(URL, 'test:Other', self.version)
+    self.assertEqual(verdicts.based_on, None)
+
+#--------------------------------------------------------------------------------------
+# Incremental batch tasks against a local WFS, whose response can be cut short
+#--------------------------------------------------------------------------------------
+class IncrementalTaskTestCase(ValidationTestCase):
+  def setUp(self):
+    super(IncrementalTaskTestCase, self).setUp()
+    self.features = [('f1', 1), ('f2', 2), ('f3', 3)]
+    self.cut = None
+    self.server = TestServer(self.respond)
+    self.capabilities_url = self.server.url('/capabilities?request=GetCapabilities')
+  
+  def tearDown(self):
+    self.server.stop()
+    forget_capabilities(self.capabilities_url)
+    super(IncrementalTaskTestCase, self).tearDown()
+  
+  def respond(self, handler):
+    if handler.path.startswith('/capabilities'):
+      return handler.send(200, CAPABILITIES % (self.server.url('/wfs?'), FEATURE_TYPE))
+    body = feature_collection(self.features)
+    if self.cut is not None: body = body[:body.index('gml:id="%s"' % self.cut)]
+    handler.send(200, body)
+  
+  def run_task(self):
+    task = BatchTask(self.capabilities_url, FEATURE_TYPE, self.version, 10, incremental=True)
+    task.capabilities = WfsCapabilities(self.capabilities_url)
+    run_task(task)
+    return task
+  
+  def test_complete_runs_built_on(self):
+    first = self.run_task()
+    self.assertTrue(first.incremental_summary['complete'])
+    second = self.run_task()
+    self.assertEqual(second.incremental_summary['carried_forward'], 3)
+  
+  def test_cut_short_run_abandoned(self):
+    """A run whose response was cut short isn't completed, nor built on"""
+    self.run_task()
+    self.features.append(('f4', 4))
+    self.cut = 'f3'
+    second = self.run_task()
+    self.assertEqual(second.status, 'failed')
+    self.assertFalse(second.incremental_summary['complete'])
+    run = ValidationRun.objects.order_by('-created', '-pk')[0]
+    self.assertFalse(run.complete)
+    self.assertEqual(FeatureVerdict.objects.filter(run=run).count(), 0)
+    
+    # The first run's verdicts are still there to build on
+    first_run = ValidationRun.objects.get(complete=True)
+    self.cut = None
+    third = self.run_task()
+    self.assertTrue(third.incremental_summary['complete'])
+    self.assertEqual(third.incremental_summary['based_on'], first_run.created.isoformat())
+    self.assertEqual(third.incremental_summary['validated'], 1)
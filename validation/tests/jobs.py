@@ -0,0 +1,82 @@
+from django.utils import timezone
+from django.test.utils import override_settings
+from validation.models import ValidationJob
+from validation.jobs import submit_job, claim_next_job, requeue_stale_jobs, requeue_jobs, report, fail_job, STAGE_QUEUED, STAGE_CAPABILITIES, STAGE_FINISHED
+from base import ValidationTestCase, FEATURE_TYPE
+from datetime import timedelta
+
+class JobQueueTestCase(ValidationTestCase):
+  def submit(self, minutes_ago=0):
+    job = submit_job('http://example.com/wfs', FEATURE_TYPE, 10, self.version)
+    ValidationJob.objects.filter(pk=job.pk).update(created=timezone.now() - timedelta(minutes=minutes_ago))
+    return job
+  
+  def job(self, job):
+    return ValidationJob.objects.get(pk=job.pk)
+  
+  def test_claim_oldest(self):
+    newer = self.submit()
+    older = self.submit(minutes_ago=5)
+    self.assertEqual(claim_next_job(), (older.pk, 1))
+    claimed = self.job(older)
+    self.assertEqual(claimed.status, ValidationJob.RUNNING)
+    self.assertEqual(claimed.stage, STAGE_CAPABILITIES)
+    self.assertNotEqual(claimed.started, None)
+    self.assertEqual(claim_next_job(), (newer.pk, 1))
+    self.assertEqual(claim_next_job(), None)
+  
+  def test_claim_skips_taken(self):
+    """A job another worker has claimed, or that is finished, isn't claimed again"""
+    taken = self.submit(minutes_ago=10)
+    finished = self.submit(minutes_ago=5)
+    queued = self.submit()
+    ValidationJob.objects.filter(pk=taken.pk).update(status=ValidationJob.RUNNING)
+    ValidationJob.objects.filter(pk=finished.pk).update(status=ValidationJob.DONE)
+    self.assertEqual(claim_next_job(), (queued.pk, 1))
+    self.assertEqual(claim_next_job(), None)
+  
+  def test_requeue_stale(self):
+    stale = self.submit()
+    fresh = self.submit()
+    claim_next_job()
+    claim_next_job()
+    ValidationJob.objects.filter(pk=stale.pk).update(updated=timezone.now() - timedelta(minutes=11), features_validated=40)
+    self.assertEqual(requeue_stale_jobs(), 1)
+    requeued = self.job(stale)
+    self.assertEqual(requeued.status, ValidationJob.QUEUED)
+    self.assertEqual(requeued.stage, STAGE_QUEUED)
+    self.assertEqual(requeued.features_validated, 0)
+    self.assertEqual(self.job(fresh).status, ValidationJob.RUNNING)
+    self.assertEqual(claim_next_job(), (stale.pk, 2))
+  
+  @override_settings(VALIDATION_JOB_STALE_MINUTES=60)
+  def test_stale_setting(self):
+    job = self.submit()
+    claim_next_job()
+    ValidationJob.objects.filter(pk=job.pk).update(updated=timezone.now() - timedelta(minutes=11))
+    self.assertEqual(requeue_stale_jobs(), 0)
+  
+  def test_finished_not_requeued(self):
+    job = self.submit()
+    claim_next_job()
+    ValidationJob.objects.filter(pk=job.pk).update(status=ValidationJob.DONE, updated=timezone.now() - timedelta(days=1))
+    self.assertEqual(requeue_stale_jobs(), 0)
+    self.assertEqual(requeue_jobs([(job.pk, 1)]), 0)
+    self.assertEqual(self.job(job).status, ValidationJob.DONE)
+  
+  def test_requeued_attempt_superseded(self):
+    """A worker still running a job that was requeued can't overwrite the next attempt"""
+    job = self.submit()
+    pk, first = claim_next_job()
+    ValidationJob.objects.filter(pk=pk).update(updated=timezone.now() - timedelta(minutes=11))
+    requeue_stale_jobs()
+    self.assertFalse(report(pk, first, features_validated=10))
+    self.assertEqual(claim_next_job(), (pk, first + 1))
+    
+    fail_job(pk, first, 'Too late')
+    self.assertFalse(report(pk, first, status=ValidationJob.DONE, stage=STAGE_FINISHED))
+    self.assertEqual(self.job(job).status, ValidationJob.RUNNING)
+    self.assertEqual(self.job(job).error, '')
+    self.assertTrue(report(pk, first + 1, features_validated=10))
+    self.assertEqual(requeue_jobs([(pk, first)]), 0)
+    self.assertEqual(requeue_jobs([(pk, first + 1)]), 1)
@@ -0,0 +1,73 @@
+from django.test.utils import override_settings
+from validation.validators.WfsGetFeature import WfsGetFeature
+from validation.validators.featurepool import can_use_pool, use_pool_for, close_feature_pool
+from base import ValidationTestCase, FEATURE_TYPE, SCHEMA, feature_collection
+from server import TestServer
+import os, json, shutil, tempfile
+
+# Stand-in for WfsCapabilities, sending every GetFeature request to url
+class Capabilities(object):
+  def __init__(self, url):
+    self.url = url
+  
+  def get_feature_url(self, feature_type, number_of_features):
+    return self.url
+
+@override_settings(VALIDATION_PROCESSES=2)
+class ParallelValidationTestCase(ValidationTestCase):
+  def setUp(self):
+    super(ParallelValidationTestCase, self).setUp()
+    # Every seventh feature is invalid, and every thirteenth has a second kind of error
+    features = []
+    for number in range(1, 301):
+      depth = 'deep' if number % 7 == 0 else '%s.5' % number
+      if number % 13 == 0: depth += '<test:Extra/>'
+      features.append(('f%s' % number, depth))
+    self.collection = feature_collection(features)
+    self.server = TestServer(lambda handler: handler.send(200, self.collection))
+  
+  def tearDown(self):
+    self.server.stop()
+    close_feature_pool()
+    super(ParallelValidationTestCase, self).tearDown()
+  
+  def validator(self):
+    return WfsGetFeature(Capabilities(self.server.url('/wfs')), FEATURE_TYPE, 300)
+  
+  def test_parallel_matches_serial(self):
+    serial = self.validator().validate(self.version, parallel=False).serialized()
+    parallel = self.validator().parallel_validate(self.version, chunk_size=16).serialized()
+    self.assertEqual(serial['number_of_elements'], 300)
+    self.assertFalse(serial['valid'])
+    self.assertEqual(len(serial['error_groups']), 2)
+    self.assertEqual(parallel, serial)
+  
+  def test_parallel_matches_serial_capped(self):
+    """With fewer groups kept than there are kinds of errors, the rest are counted alike"""
+    serial = self.validator().stream_validate(self.version, max_groups=1).serialized()
+    parallel = self.validator().parallel_validate(self.version, max_groups=1, chunk_size=16).serialized()
+    self.assertTrue(serial['ungrouped_error_count'] > 0)
+    self.assertEqual(parallel, serial)
+  
+  def test_schema_not_pinned(self):
+    """Either way, a schema that imports unpinned schemas is reported as an error"""
+    unpinned = self.createVersion("2.0", SCHEMA.replace('<xs:element name="Feature">',
+      '<xs:import namespace="http://example.com/unpinned" schemaLocation="http://example.com/unpinned.xsd"/><xs:element name="Feature">'))
+    
+    # Something else is pinned, or the imports would be fetched over the network instead
+    repository = tempfile.mkdtemp()
+    with open(os.path.join(repository, 'catalog.json'), 'w') as f:
+      json.dump({ 'http://example.com/pinned.xsd': { 'path': 'example.com/pinned.xsd', 'sha256': '' } }, f)
+    try:
+      with override_settings(CONTENTMODELS_SCHEMA_REPOSITORY=repository):
+        for results in [ self.validator().validate(unpinned, parallel=False), self.validator().validate(unpinned, parallel=True) ]:
+          self.assertFalse(results.valid)
+          self.assertIn('pin_schemas', results.errors[0].message)
+    finally:
+      shutil.rmtree(repository)
+  
+  @override_settings(VALIDATION_PARALLEL_THRESHOLD=1000)
+  def test_threshold(self):
+    self.assertTrue(can_use_pool())
+    self.assertTrue(use_pool_for(1000))
+    self.assertFalse(use_pool_for(50))
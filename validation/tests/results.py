@@ -0,0 +1,99 @@
+from django.test import TestCase
+from validation.validators.validationresults import ValidationResults, feature_id, feature_digest, FEATURE_ID_SAMPLE
+from lxml import etree
+import json
+
+DATATYPE = ('SCHEMAV_CVC_DATATYPE_VALID_1_2_1', "'deep' is not a valid value", '/test:Feature/test:Depth')
+MISSING = ('SCHEMAV_ELEMENT_CONTENT', 'Missing child element(s)', '/test:Feature')
+EXTRA = ('SCHEMAV_ELEMENT_CONTENT', 'This element is not expected', '/test:Feature/test:Extra')
+
+class ValidationResultsTestCase(TestCase):
+  def test_counts(self):
+    results = ValidationResults()
+    results.add_verdict(True, [], 'f1')
+    results.add_verdict(False, [DATATYPE], 'f2')
+    results.add_verdict(False, [DATATYPE, MISSING], 'f3')
+    self.assertEqual(results.number_of_elements, 3)
+    self.assertEqual(results.valid_count(), 1)
+    self.assertEqual(results.invalid_count(), 2)
+    self.assertEqual(results.error_count, 3)
+    self.assertFalse(results.valid)
+    self.assertEqual([ (group.type, group.message, group.path) for group in results.errors ], [DATATYPE, MISSING])
+    self.assertEqual(results.errors[0].count, 2)
+    self.assertEqual(results.errors[0].feature_ids, ['f2', 'f3'])
+  
+  def test_features_numbered(self):
+    """Features without an id are known by their position"""
+    results = ValidationResults()
+    results.add_verdict(True, [])
+    results.add_verdict(False, [DATATYPE])
+    self.assertEqual(results.errors[0].feature_ids, ['#2'])
+  
+  def test_feature_id_sample(self):
+    results = ValidationResults()
+    for number in range(FEATURE_ID_SAMPLE + 3): results.add_verdict(False, [DATATYPE], 'f%s' % number)
+    self.assertEqual(results.errors[0].count, FEATURE_ID_SAMPLE + 3)
+    self.assertEqual(len(results.errors[0].feature_ids), FEATURE_ID_SAMPLE)
+  
+  def test_max_groups(self):
+    """Errors that would start a group past max_groups are only counted"""
+    results = ValidationResults(max_groups=2)
+    results.add_verdict(False, [DATATYPE, MISSING], 'f1')
+    results.add_verdict(False, [EXTRA], 'f2')
+    results.add_verdict(False, [DATATYPE, EXTRA], 'f3')
+    self.assertEqual(len(results.errors), 2)
+    self.assertEqual(results.errors[0].count, 2)
+    self.assertEqual(results.error_count, 5)
+    self.assertEqual(results.ungrouped_count, 2)
+  
+  def test_merge(self):
+    first = ValidationResults()
+    first.add_verdict(False, [DATATYPE], 'f1')
+    first.add_verdict(True, [], 'f2')
+    second = ValidationResults(max_groups=1)
+    second.add_verdict(False, [MISSING], 'f3')
+    second.add_verdict(False, [DATATYPE, EXTRA], 'f4')
+    
+    merged = ValidationResults(max_groups=2)
+    merged.merge(first.serialized())
+    merged.merge(json.loads(second.to_json()))
+    self.assertEqual(merged.number_of_elements, 4)
+    self.assertEqual(merged.valid_count(), 1)
+    self.assertEqual(merged.error_count, 4)
+    self.assertEqual([ (group.type, group.message, group.path) for group in merged.errors ], [DATATYPE, MISSING])
+    # The DATATYPE error of f4 was ungrouped in second, so it is only counted
+    self.assertEqual(merged.errors[0].count, 1)
+    self.assertEqual(merged.ungrouped_count, 2)
+  
+  def test_merge_valid(self):
+    results = ValidationResults()
+    part = ValidationResults()
+    part.add_verdict(True, [], 'f1')
+    results.merge(part.serialized())
+    self.assertTrue(results.finish().valid)
+  
+  def test_nothing_validated(self):
+    results = ValidationResults().finish()
+    self.assertFalse(results.valid)
+    self.assertEqual(results.errors[0].message, 'No elements were validated.')
+  
+  def test_error_not_about_a_feature(self):
+    results = ValidationResults()
+    results.add_verdict(True, [], 'f1')
+    results.add_error('The GetFeature response could not be read')
+    self.assertFalse(results.finish().valid)
+    self.assertEqual(results.number_of_elements, 1)
+    self.assertEqual(len(results.errors), 1)
+  
+  def test_feature_id(self):
+    self.assertEqual(feature_id(etree.fromstring('<F xmlns:gml="http://www.opengis.net/gml/3.2" gml:id="a"/>')), 'a')
+    self.assertEqual(feature_id(etree.fromstring('<F fid="b"/>')), 'b')
+    self.assertEqual(feature_id(etree.fromstring('<F id="c"/>')), None)
+  
+  def test_feature_digest(self):
+    """Features hash the same whatever namespaces the response around them declares"""
+    one = etree.fromstring('<a:C xmlns:a="urn:a" xmlns:b="urn:b"><a:F><a:v>1</a:v></a:F></a:C>')[0]
+    two = etree.fromstring('<C xmlns:a="urn:a"><a:F><a:v>1</a:v></a:F></C>')[0]
+    three = etree.fromstring('<C xmlns:a="urn:a"><a:F><a:v>2</a:v></a:F></C>')[0]
+    self.assertEqual(feature_digest(one), feature_digest(two))
+    self.assertNotEqual(feature_digest(one), feature_digest(three))
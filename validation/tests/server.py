@@ -0,0 +1,59 @@
+from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+from SocketServer import ThreadingMixIn
+import socket, threading
+
+#--------------------------------------------------------------------------------------
+# A small HTTP server for the tests, running in a thread of its own on a free port.
+#   Requests are answered by respond(handler), which each test case supplies; every
+#   request is remembered as (path, headers). Connections are kept open between
+#   requests, and closed when the server stops.
+#--------------------------------------------------------------------------------------
+class TestServer(ThreadingMixIn, HTTPServer):
+  daemon_threads = True
+
+  def __init__(self, respond):
+    HTTPServer.__init__(self, ('127.0.0.1', 0), Handler)
+    self.respond = respond
+    self.requests = []
+    self.connections = []
+    self.thread = threading.Thread(target=self.serve_forever, args=(0.05,))
+    self.thread.daemon = True
+    self.thread.start()
+
+  def process_request(self, request, client_address):
+    self.connections.append(request)
+    ThreadingMixIn.process_request(self, request, client_address)
+
+  # Clients going away is what the tests expect, not an error
+  def handle_error(self, request, client_address):
+    pass
+
+  def url(self, path):
+    return 'http://127.0.0.1:%s%s' % (self.server_address[1], path)
+
+  def stop(self):
+    self.shutdown()
+    self.server_close()
+    for connection in self.connections:
+      try:
+        connection.shutdown(socket.SHUT_RDWR)
+      except socket.error:
+        pass
+
+class Handler(BaseHTTPRequestHandler):
+  protocol_version = 'HTTP/1.1'
+
+  def do_GET(self):
+    self.server.requests.append((self.path, self.headers))
+    self.server.respond(self)
+
+  # Function to send a whole response, with its length so the connection can be kept
+  def send(self, status, body='', headers={}):
+    self.send_response(status)
+    for name, value in headers.items(): self.send_header(name, value)
+    self.send_header('Content-Length', str(len(body)))
+    self.end_headers()
+    self.wfile.write(body)
+
+  def log_message(self, format, *args):
+    pass
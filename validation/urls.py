@@ -3,6 +3,17 @@ from django.conf.urls import patterns, url
 urlpatterns = patterns('validation.validators',
 
   # Validation form, and form submission
-  url('^wfs$', 'validate_wfs_form')
+  url('^wfs$', 'validate_wfs_form'),
+
+  # Many validations at once, described by a JSON manifest: submission, progress as
+  #   JSON, and the report as JSON
+  url('^wfs/batch$', 'validate_wfs_batch'),
+  url('^wfs/batches/(?P<batch_id>\d+)$', 'wfs_batch'),
+  url('^wfs/batches/(?P<batch_id>\d+)/report$', 'wfs_batch_report'),
+  
+  # Queued validations: results or progress, progress as JSON, and results as JSON
+  url('^wfs/jobs/(?P<job_id>\d+)$', 'wfs_job'),
+  url('^wfs/jobs/(?P<job_id>\d+)/status$', 'wfs_job_status'),
+  url('^wfs/jobs/(?P<job_id>\d+)/result$', 'wfs_job_result')
 
 )
\ No newline at end of file
@@ -1,4 +1,4 @@
-import urllib2
+from httpclient import http_client, HttpError
 from lxml import etree
 
 class WfsBase():  
@@ -8,22 +8,25 @@ class WfsBase():
   doc = None              # The document returned from the given URL
   parsed_doc = None       # The document parsed by lxml and represented as an ElementTree
     
-  # Function to perform an HTTP request to get the document at the given URL
-  def fetch_document(self):
+  # Function to perform an HTTP request to get the document at the given URL. Requests
+  #   go through a shared client that pools connections and times out; headers are sent
+  #   along with the request, for instance to make it conditional.
+  def fetch_document(self, headers=None):
     # Just return the document if it has already been fetched
     if self.doc is not None: return self.doc
     
+    # There's nothing to fetch if the URL could not be worked out
+    if self.url is None:
+      self.url_is_valid = False
+      return None
+    
     # Open the URL and return the response
     try:
-      self.doc = urllib2.urlopen(self.url)
+      self.doc = http_client.get(self.url, headers)
       return self.doc
     
-    # There was an error processing the URL
-    except urllib2.URLError, err:
-      self.errors.append({"urlError": err})
-    
-    # There was an HTTP error retrieving the document  
-    except urllib2.HTTPError, err:
+    # There was an error retrieving the document, or the server answered with an error
+    except HttpError, err:
       self.errors.append({"httpError": err})
     
     # Some error was encountered, set the invalid flag and return nothing
@@ -37,6 +40,7 @@ class WfsBase():
     
     # Fetch the document
     doc = self.fetch_document()
+    if doc is None: return None
 
     # Parse the document using lxml.etree and return the ElementTree
     try:
@@ -47,6 +51,10 @@ class WfsBase():
     except etree.ParseError, err:
       self.errors.append({"parseError": err})
     
+    # The connection failed while the document was being read
+    except HttpError, err:
+      self.errors.append({"httpError": err})
+    
     # Some error was encountered, set the invalid flag and return nothing  
     self.url_is_valid = False
     return None    
\ No newline at end of file
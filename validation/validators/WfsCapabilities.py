@@ -1,4 +1,48 @@
 from WfsBase import WfsBase
+from django.conf import settings
+from django.core.cache import get_cache
+import hashlib, time
+
+# Namespaces for XPath expressions, by WFS version
+NAMESPACES = {
+  '1.0.0': { 'wfs': 'http://www.opengis.net/wfs' },
+  '1.1.0': { 'wfs': 'http://www.opengis.net/wfs', 'ows': 'http://www.opengis.net/ows', 'xlink': 'http://www.w3.org/1999/xlink' },
+  '2.0.0': { 'wfs': 'http://www.opengis.net/wfs/2.0', 'ows': 'http://www.opengis.net/ows/1.1', 'xlink': 'http://www.w3.org/1999/xlink' }
+}
+
+# Where each version's GetCapabilities document gives the URL for GetFeature requests
+GET_FEATURE_XPATHS = {
+  '1.0.0': '//wfs:Capability/wfs:Request/wfs:GetFeature/wfs:DCPType/wfs:HTTP/wfs:Get/@onlineResource',
+  '1.1.0': '//ows:OperationsMetadata/ows:Operation[@name="GetFeature"]/ows:DCP/ows:HTTP/ows:Get/@xlink:href',
+  '2.0.0': '//ows:OperationsMetadata/ows:Operation[@name="GetFeature"]/ows:DCP/ows:HTTP/ows:Get/@xlink:href'
+}
+
+# Where a WFS 2.0 GetCapabilities document says whether results can be paged
+PAGING_XPATH = '//ows:OperationsMetadata/ows:Constraint[@name="ImplementsResultPaging"]/ows:DefaultValue/text()'
+
+# How long a cached summary is kept, in seconds, so that it can be revalidated once it
+#   is no longer fresh
+CAPABILITIES_KEEP = 24 * 60 * 60
+
+#--------------------------------------------------------------------------------------
+# GetCapabilities documents are summarized (WFS version, FeatureType names and the
+#   GetFeature URL, and whether it pages) and the summary is cached by URL in the cache chosen by the
+#   VALIDATION_CACHE setting, an alias from CACHES. A summary is used as it is for
+#   VALIDATION_CAPABILITIES_TTL seconds. After that, the document is requested again
+#   with the ETag and Last-Modified date it was served with, and is only parsed again
+#   if the server says it has changed.
+#--------------------------------------------------------------------------------------
+def get_capabilities_cache():
+  return get_cache(getattr(settings, 'VALIDATION_CACHE', 'default'))
+
+def capabilities_key(url):
+  return 'validation:capabilities:%s' % hashlib.md5(url.encode('utf-8')).hexdigest()
+
+def capabilities_ttl():
+  return getattr(settings, 'VALIDATION_CAPABILITIES_TTL', 300)
+
+def forget_capabilities(url):
+  get_capabilities_cache().delete(capabilities_key(url))
 
 #--------------------------------------------------------------------------------------
 # A class representing a WFS GetCapabilities document.
@@ -6,78 +50,118 @@ from WfsBase import WfsBase
 #   Inherits from WfsBase, which performs HTTP requests and XML parsing
 #--------------------------------------------------------------------------------------
 class WfsCapabilities(WfsBase):
-  version = None          # The WFS version, parsed from the GetCapabilites document
-  feature_types = []      # The names of FeatureTypes available from the WFS
-  
+  version = None              # The WFS version, parsed from the GetCapabilites document
+  feature_types = []          # The names of FeatureTypes available from the WFS
+  get_feature_base_url = None # The URL that GetFeature requests are sent to
+  paging = False              # Whether GetFeature results can be requested a page at a time
+
   # Constructor function. Requires a URL passed in as a string
   def __init__(self, url):
     # Set the object's URL value
     self.url = url
-    
+    self.errors = []
+
     # Get a list of FeatureTypes. Any errors encountered in the process will be logged to self.errors
     self.set_feature_types()
-      
-  # Function to set FeatureType list according to the document at the given URL
+
+  # Function to set FeatureType list according to the document at the given URL, or
+  #   according to its cached summary
   def set_feature_types(self):
+    cache = get_capabilities_cache()
+    key = capabilities_key(self.url)
+    entry = cache.get(key)
+
+    # A fresh summary is used without asking the server
+    if entry is not None and time.time() - entry['checked'] < capabilities_ttl():
+      return self.use_summary(entry)
+
+    # Otherwise ask the server whether the document has changed since it was summarized
+    headers = {}
+    if entry is not None:
+      if entry['etag']: headers['If-None-Match'] = entry['etag']
+      if entry['last_modified']: headers['If-Modified-Since'] = entry['last_modified']
+    doc = self.fetch_document(headers)
+    if doc is None: return
+
+    if doc.status == 304 and entry is not None:
+      entry['checked'] = time.time()
+    else:
+      summary = self.summarize()
+      if summary is None: return
+      entry = dict(summary,
+        etag=doc.getheader('etag'),
+        last_modified=doc.getheader('last-modified'),
+        checked=time.time()
+      )
+
+    cache.set(key, entry, CAPABILITIES_KEEP)
+    self.use_summary(entry)
+
+  def use_summary(self, entry):
+    self.version = entry['version']
+    self.feature_types = entry['feature_types']
+    self.get_feature_base_url = entry['get_feature_base_url']
+    self.paging = entry.get('paging', False)
+
+  # Function to read the summary out of the GetCapabilities document
+  #   Returns a dictionary, or None if the document could not be understood
+  def summarize(self):
     # Fetch the parsed document
     parsed_doc = self.fetch_parsed_doc()
-    
+    if parsed_doc is None: return None
+
     # Determine the WFS version, drop lxml's "smart string" in this case
-    self.version = parsed_doc.xpath('@version', smart_strings=False)
-    if len(self.version) > 0: self.version = self.version[0]
-    
+    version = parsed_doc.xpath('@version', smart_strings=False)
+    if len(version) > 0: version = version[0]
+
     # Namespaces are different depending on the version
-    if self.version is '1.0.0' or '1.1.0':
-      ns = { 'wfs': 'http://www.opengis.net/wfs' }
-    elif self.version is '2.0.0':
-      ns = { 'wfs': 'http://www.opengis.net/wfs/2.0' }
-    else:
+    if version not in NAMESPACES:
       # There was some issue with getting the WFS version
       self.errors.append({"capabilitiesError": "Could not determine WFS version"})
       self.url_is_valid = False
-      return
-    
-    # Get the FeatureType Names via XPath, plug them into self.feature_types
+      return None
+    ns = NAMESPACES[version]
+
+    # Get the FeatureType Names via XPath
     feature_type_elements = parsed_doc.xpath('//wfs:FeatureTypeList/wfs:FeatureType/wfs:Name', namespaces=ns)
-    self.feature_types = [ ftype.text for ftype in feature_type_elements ]
-    
+
+    # Read the URL for GetFeature operations
+    base_url = parsed_doc.xpath(GET_FEATURE_XPATHS[version], namespaces=ns, smart_strings=False)
+
+    # Only WFS 2.0 has a standard way to page through results
+    paging = version == '2.0.0' and parsed_doc.xpath(PAGING_XPATH, namespaces=ns, smart_strings=False) == ['TRUE']
+
+    return {
+      'version': version,
+      'feature_types': [ ftype.text for ftype in feature_type_elements ],
+      'get_feature_base_url': base_url[0] if len(base_url) > 0 else None,
+      'paging': paging
+    }
+
   # Function to spell out a GetFeature URL given the name of a FeatureType and the number of features
+  #   With None as the number of features, every feature is asked for
   def get_feature_url(self, feature_type_name, number_of_features):
     # Return nothing if the URL is invalid
     if not self.url_is_valid: return None
-    
-    # Fetch the parsed_doc
-    parsed_doc = self.fetch_parsed_doc()
-    
+
     # Make sure that the FeatureType requested is one of the available FeatureTypes
-    if feature_type_name not in self.feature_types: return None 
-    
-    # Namespace setup for later XPath expressions
-    ns = { 
-        'wfs': 'http://www.opengis.net/wfs', 
-        'ows': 'http://www.opengis.net/ows',
-        'xlink': 'http://www.w3.org/1999/xlink'
-      }
-    
-    # Read URLs for GetFeature operations from the GetCapabilities document
-    if self.version == '1.0.0':
-      base_url = parsed_doc.xpath(
-          '//wfs:Capability/wfs:Request/wfs:GetFeature/wfs:DCPType/wfs:HTTP/wfs:Get/@onlineResource',
-          namespaces=ns
-        )
-    elif self.version in ['1.1.0', '2.0.0']:
-      base_url = parsed_doc.xpath(
-          '//ows:OperationsMetadata/ows:Operation[@name="GetFeature"]/ows:DCP/ows:HTTP/ows:Get/@xlink:href',
-          namespaces=ns
-        )
-    else:
+    if feature_type_name not in self.feature_types: return None
+
+    if self.get_feature_base_url is None:
       # There was some issue locating the GetFeature operation's description
       self.errors.append({"capabilitiesError": "Could not determine the GetFeature URL"})
       self.url_is_valid = False
       return None
 
-      
     # Append query parameters and return
-    if len(base_url) > 0: base_url = base_url[0]
-    param_values = (base_url, self.version, feature_type_name, str(number_of_features))
-    return "%s&service=WFS&version=%s&request=GetFeature&typename=%s&maxfeatures=%s" % param_values
\ No newline at end of file
+    param_values = (self.get_feature_base_url, self.version, feature_type_name)
+    url = "%s&service=WFS&version=%s&request=GetFeature&typename=%s" % param_values
+    if number_of_features is None: return url
+    return "%s&maxfeatures=%s" % (url, number_of_features)
+
+  # Function to spell out the GetFeature URL for one page of a FeatureType's features, for
+  #   a WFS that supports paging
+  def get_page_url(self, feature_type_name, start_index, count):
+    url = self.get_feature_url(feature_type_name, None)
+    if url is None or not self.paging: return None
+    return "%s&count=%s&startIndex=%s" % (url, count, start_index)
@@ -1,4 +1,14 @@
 from WfsBase import WfsBase
+from httpclient import HttpError
+from featurepool import feature_pool, pool_size, use_pool_for, validate_chunk
+from validationresults import ValidationResults, feature_id, MAX_ERROR_GROUPS
+from contentmodels.schemacache import cached_schema, file_fingerprint
+from contentmodels.schemarepository import SchemaNotPinned
+from collections import deque
+from lxml import etree
+
+# The number of features sent to a worker process at once when validating in parallel
+CHUNK_SIZE = 200
 
 #--------------------------------------------------------------------------------------
 # A class representing a WFS GetFeature document.
@@ -10,12 +20,34 @@ class WfsGetFeature(WfsBase):
     # WfsCapabilites object constructs the GetFeature URL
     self.url = capabilities.get_feature_url(feature_type, number_of_features)
     self.feature_type = feature_type
+    self.number_of_features = number_of_features
+    self.number_matched = None
+    self.errors = []
   
   #--------------------------------------------------------------------------------------
-  # Function to setup for schema validation by finding the appropriate elements and
-  #   passing them to the ValidationResults class to actually perform validation
+  # Function to validate the GetFeature response against a ModelVersion's schema. By
+  #   default the response is validated as it is downloaded, see stream_validate, and on
+  #   several cores when many features were asked for, see parallel_validate. With
+  #   streaming=False it is parsed as a whole first. Streamed results are added to
+  #   results, if it is given. With verdicts, an IncrementalRun (see incremental.py),
+  #   only new or changed features are validated, one after the other, since there are
+  #   usually few of them. Returns a ValidationResults. A schema that imports schemas
+  #   which haven't been pinned (see schemarepository.py) is reported as an error.
   #--------------------------------------------------------------------------------------  
-  def validate(self, modelversion):
+  def validate(self, modelversion, streaming=True, progress=None, parallel=None, results=None, verdicts=None):
+    try:
+      if verdicts is not None: return self.stream_validate(modelversion, progress=progress, results=results, verdicts=verdicts)
+      if parallel is None: parallel = use_pool_for(self.number_of_features)
+      if streaming and parallel: return self.parallel_validate(modelversion, progress=progress, results=results)
+      if streaming: return self.stream_validate(modelversion, progress=progress, results=results)
+      return self.parsed_validate(modelversion)
+    except SchemaNotPinned, err:
+      if results is None: results = ValidationResults()
+      results.add_error(str(err))
+      return results.finish()
+  
+  # Function to validate the GetFeature response once it has been parsed as a whole
+  def parsed_validate(self, modelversion):
     # Retrieve the GetFeature document, parsed by lxml
     parsed_doc = self.fetch_parsed_doc()
     
@@ -25,76 +57,164 @@ class WfsGetFeature(WfsBase):
     # Gather elements of the requested FeatureType
     elements = parsed_doc.xpath("//%s" % self.feature_type, namespaces=ns)
     
-    # Retrieve the XMLSchema object responsible for validating this ModelVersion's schema
-    schema = modelversion.schema_validator()
+    # Retrieve the compiled XMLSchema responsible for validating this ModelVersion's schema
+    compiled = cached_schema(modelversion)
     
     # Perform validation on each element
-    return ValidationResults(elements, schema)
+    results = ValidationResults()
+    for element in elements:
+      valid, errors = compiled.validate(element)
+      results.add(valid, errors, feature_id(element))
+    return results.finish()
     
-  def get_namespaces(self):
-    # Retrieve the GetFeature document, parsed by lxml
-    parsed_doc = self.fetch_parsed_doc()
+  #--------------------------------------------------------------------------------------
+  # Function to validate the GetFeature response while it is being read. Each element of
+  #   the requested FeatureType is validated as soon as its end tag has been parsed, and
+  #   then dropped along with whatever came before it, so memory use does not grow with
+  #   the size of the response. progress, if given, is called with the results after
+  #   each element. Returns a ValidationResults: results, if one is given to add to, or a
+  #   new one. Features are checked through verdicts instead, if it is given.
+  #--------------------------------------------------------------------------------------
+  def stream_validate(self, modelversion, max_groups=MAX_ERROR_GROUPS, progress=None, results=None, verdicts=None):
+    compiled = cached_schema(modelversion)
+    if results is None: results = ValidationResults(max_groups)
     
+    # Open the response, without reading it yet
+    doc = self.fetch_document()
+    if doc is None:
+      results.add_error("The GetFeature response could not be retrieved.")
+      return results.finish()
     
-  
-#--------------------------------------------------------------------------------------
-# Class to perform schema validation for each element in a wfs:FeatureCollection
-#--------------------------------------------------------------------------------------
-class ValidationResults():
-  results = []
-  errors = []
-  valid = True
-  
-  # Constructor function requires a set of elements to validate and a schema
-  #   to validate them against.
-  def __init__(self, elements, schema):
-    # Provide a count for the total number of elements validated
-    self.number_of_elements = len(elements)
-    
-    # If no elements were passed in, the result is not valid
-    if self.number_of_elements == 0:
-      self.valid = False
-      
-      # A little class to mimic the error objects that lxml would spit out
-      class Error(object):
-        def __init__(self, message):
-          self.message = message
-      
-      # Append an error to the array and drop out of the function    
-      self.errors.append(Error("No elements were validated."))
-      return
+    try:
+      for item in self.iter_features(doc):
+        id = feature_id(item)
+        if verdicts is None:
+          valid, errors = compiled.validate(item)
+          results.add(valid, errors, id)
+        else:
+          valid, errors = verdicts.check(item, id, compiled)
+          results.add_verdict(valid, errors, id)
+        if progress is not None: progress(results)
+        
+    # The response was cut short, or isn't XML
+    except etree.XMLSyntaxError, err:
+      results.add_error("The GetFeature response could not be parsed: %s" % err)
+    except HttpError, err:
+      results.add_error("The GetFeature response could not be read: %s" % err)
     
-    # Otherwise, loop through elements
-    for element in elements:
-      # Validate each element
-      valid = schema.validate(element)
-      
-      # Mark the entire result invalid if any one element fails
-      if not valid: self.valid = False
-      
-      # Append the element and whether or not it validated to the results set
-      self.results.append({
-          "valid": valid,
-          "element": element                   
-        })
+    return results.finish()
+    
+  #--------------------------------------------------------------------------------------
+  # Function to validate the GetFeature response on several cores. Features are read as
+  #   in stream_validate, serialized into chunks of chunk_size, and validated by the
+  #   worker processes of featurepool.py. A few chunks per worker are kept on the way,
+  #   so memory use stays bounded. Results are merged in the order the chunks were sent,
+  #   so errors are grouped as if features were validated one after the other.
+  #--------------------------------------------------------------------------------------
+  def parallel_validate(self, modelversion, max_groups=MAX_ERROR_GROUPS, progress=None, chunk_size=CHUNK_SIZE, results=None):
+    path = modelversion.xsd_file.path
+    fingerprint = file_fingerprint(path)
+    if results is None: results = ValidationResults(max_groups)
+    
+    doc = self.fetch_document()
+    if doc is None:
+      results.add_error("The GetFeature response could not be retrieved.")
+      return results.finish()
+    
+    pool = feature_pool()
+    max_pending = 2 * pool_size()
+    pending = deque()
+    
+    # Function to merge finished chunks until no more than limit are pending
+    def collect(limit):
+      while len(pending) > limit:
+        results.merge(pending.popleft().get())
+        if progress is not None: progress(results)
+    
+    # Features are numbered here, so that those without an id can be told apart
+    number = results.number_of_elements
+    chunk = []
+    failure = None
+    try:
+      for item in self.iter_features(doc):
+        number += 1
+        chunk.append((feature_id(item) or '#%s' % number, etree.tostring(item)))
+        if len(chunk) < chunk_size: continue
+        pending.append(pool.apply_async(validate_chunk, (path, fingerprint, chunk)))
+        chunk = []
+        collect(max_pending)
         
-      # Grab the error log from the etree.XMLSchema object
-      self.errors = schema.error_log
+    # The response was cut short, or isn't XML. What was read is still validated.
+    except etree.XMLSyntaxError, err:
+      failure = "The GetFeature response could not be parsed: %s" % err
+    except HttpError, err:
+      failure = "The GetFeature response could not be read: %s" % err
+    
+    if len(chunk) > 0: pending.append(pool.apply_async(validate_chunk, (path, fingerprint, chunk)))
+    collect(0)
+    if failure is not None: results.add_error(failure)
+    return results.finish()
+    
+  #--------------------------------------------------------------------------------------
+  # Generator for the elements of the requested FeatureType in the response, as they are
+  #   parsed. Each element is released once the loop over them has moved on. The number
+  #   of features the response says match the request is kept as number_matched.
+  #--------------------------------------------------------------------------------------
+  def iter_features(self, doc):
+    # The FeatureType's prefix is looked up in the namespaces declared by the response
+    prefix, colon, local_name = self.feature_type.rpartition(':')
+    namespaces = {}
+    tag = None
+    root = None
+    
+    for event, item in etree.iterparse(doc, events=('start-ns', 'end')):
+      # Remember the first namespace declared for each prefix
+      if event == 'start-ns':
+        namespaces.setdefault(item[0], item[1])
+        continue
       
-      # De-duplicate the error log
-      self.deduplicate_errors()
+      if root is None:
+        root = item.getroottree().getroot()
+        self.number_matched = number_matched(root)
+      if tag is None: tag = feature_tag(prefix, local_name, namespaces)
+      if item.tag != tag: continue
       
-  # Function to count the number of valid elements
-  def valid_count(self):
-    return len([ result for result in self.results if result['valid'] ])
-  
-  # Function to count the number of invalid elements
-  def invalid_count(self):
-    return len([ result for result in self.results if not result['valid'] ])
+      yield item
+      release(item)
+    
+  def get_namespaces(self):
+    # Retrieve the GetFeature document, parsed by lxml
+    parsed_doc = self.fetch_parsed_doc()
     
-  # Function to remove duplicate errors from the log
-  def deduplicate_errors(self):
-    self.errors = list(set(self.errors))
-      
     
-    
\ No newline at end of file
+  
+#--------------------------------------------------------------------------------------
+# Function to read how many features match the request from a WFS 2.0 response's
+#   numberMatched attribute. Returns None if the response doesn't say, or says "unknown".
+#--------------------------------------------------------------------------------------
+def number_matched(root):
+  value = root.get('numberMatched')
+  if value is None or not value.isdigit(): return None
+  return int(value)
+
+#--------------------------------------------------------------------------------------
+# Function to spell out the tag, in lxml's {namespace}name form, of the elements being
+#   validated. Returns None until the FeatureType's prefix has been declared.
+#--------------------------------------------------------------------------------------
+def feature_tag(prefix, local_name, namespaces):
+  if prefix in namespaces: return '{%s}%s' % (namespaces[prefix], local_name)
+  if prefix == '': return local_name
+  return None
+
+#--------------------------------------------------------------------------------------
+# Function to free a parsed element once it has been validated. Its content is cleared,
+#   and the siblings that precede it or any of its ancestors, i.e. the features and
+#   feature members already dealt with, are removed from the tree.
+#--------------------------------------------------------------------------------------
+def release(element):
+  element.clear()
+  node = element
+  while node.getparent() is not None:
+    while node.getprevious() is not None:
+      del node.getparent()[0]
+    node = node.getparent()
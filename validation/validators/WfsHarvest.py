@@ -0,0 +1,158 @@
+from WfsGetFeature import WfsGetFeature
+from validationresults import ValidationResults, MAX_ERROR_GROUPS
+from featurepool import can_use_pool
+from httpclient import http_client
+from django.conf import settings
+import tempfile, shutil, threading
+
+# The number_of_features that asks for every feature of a FeatureType
+ALL_FEATURES = 0
+
+# Pages are downloaded into temporary files, which are kept in memory up to this size
+SPOOL_SIZE = 8 * 1024 * 1024
+
+# The number of features asked for in each page, set by VALIDATION_PAGE_SIZE
+def default_page_size():
+  return getattr(settings, 'VALIDATION_PAGE_SIZE', 1000)
+
+#--------------------------------------------------------------------------------------
+# Function to choose how to validate number_of_features features: with a single
+#   GetFeature request, or by harvesting the whole layer when ALL_FEATURES are asked for.
+#   Both kinds of validator have a url and a validate(modelversion, progress, parallel)
+#   function.
+#--------------------------------------------------------------------------------------
+def feature_validator(capabilities, feature_type, number_of_features):
+  if number_of_features == ALL_FEATURES: return WfsHarvest(capabilities, feature_type)
+  return WfsGetFeature(capabilities, feature_type, number_of_features)
+
+#--------------------------------------------------------------------------------------
+# Class for a page of features being downloaded in the background
+#--------------------------------------------------------------------------------------
+class PageDownload(threading.Thread):
+  def __init__(self, url):
+    threading.Thread.__init__(self)
+    self.daemon = True
+    self.url = url
+    self.file = None
+    self.error = None
+    self.start()
+
+  def run(self):
+    try:
+      response = http_client.get(self.url)
+      spool = tempfile.SpooledTemporaryFile(SPOOL_SIZE)
+      shutil.copyfileobj(response, spool)
+      spool.seek(0)
+      self.file = spool
+    except IOError, err:
+      self.error = err
+
+  # Function to wait for the download to finish. Returns the downloaded file, or None.
+  def result(self):
+    self.join()
+    return self.file
+
+  def discard(self):
+    if self.result() is not None: self.file.close()
+
+#--------------------------------------------------------------------------------------
+# A class to validate every feature of a FeatureType, beyond what a single GetFeature
+#   request would return. When the WFS supports paging (WFS 2.0's ImplementsResultPaging)
+#   the layer is walked with startIndex and count, VALIDATION_PAGE_SIZE features at a
+#   time, and the next page is downloaded while the current one is validated. Servers
+#   may return fewer features than were asked for, so each page starts after the
+#   features the last one actually had, and the walk ends with an empty page or once
+#   the numberMatched the WFS reports has been reached. Otherwise the whole layer is
+#   asked for at once, and validated as it streams in. Either way, a layer that ends up
+#   with fewer features than numberMatched is reported as cut short.
+#   Constructor requires a WfsCapabilities object and the requested TypeName
+#--------------------------------------------------------------------------------------
+class WfsHarvest(object):
+  def __init__(self, capabilities, feature_type, page_size=None):
+    self.capabilities = capabilities
+    self.feature_type = feature_type
+    self.page_size = page_size or default_page_size()
+    self.paged = capabilities.paging
+    self.pages = 0
+    self.errors = []
+
+    # The first request, which the results page links to
+    self.url = self.page_url(0)
+
+  def page_url(self, start_index):
+    if not self.paged: return self.capabilities.get_feature_url(self.feature_type, None)
+    return self.capabilities.get_page_url(self.feature_type, start_index, self.page_size)
+
+  #--------------------------------------------------------------------------------------
+  # Function to validate the whole layer against a ModelVersion's schema. progress is
+  #   called with the results after each feature, as in WfsGetFeature.validate, and
+  #   page_progress with the number of pages done and the results after each page.
+  #   verdicts, if given, is passed on to each page's WfsGetFeature.validate, and so is
+  #   parallel; by default an unpaged layer is validated on several cores if it can be.
+  #   Returns a ValidationResults covering every page.
+  #--------------------------------------------------------------------------------------
+  def validate(self, modelversion, progress=None, page_progress=None, max_groups=MAX_ERROR_GROUPS, verdicts=None, parallel=None):
+    results = ValidationResults(max_groups)
+    if self.url is None:
+      results.add_error("The GetFeature URL could not be determined.")
+      return results.finish()
+
+    # Without paging, the layer comes in a single response, validated as it is read
+    if not self.paged:
+      page = self.page_validator(None)
+      if parallel is None: parallel = can_use_pool()
+      page.validate(modelversion, progress=progress, parallel=parallel, results=results, verdicts=verdicts)
+      self.pages = 1
+      if page_progress is not None: page_progress(self.pages, results)
+      self.check_complete(results, page.number_matched)
+      return results.finish()
+
+    start_index = 0
+    number_matched = None
+    download = PageDownload(self.url)
+    while download is not None:
+      doc = download.result()
+      if doc is None:
+        results.add_error("Page %s of the layer could not be retrieved: %s" % (self.pages + 1, download.error))
+        break
+
+      # Start on the next page while this one is validated, guessing that this one is full
+      following_index = start_index + self.page_size
+      following = PageDownload(self.page_url(following_index))
+
+      validated = results.number_of_elements
+      page = self.page_validator(doc)
+      page.validate(modelversion, progress=progress, parallel=parallel, results=results, verdicts=verdicts)
+      doc.close()
+      returned = results.number_of_elements - validated
+      if page.number_matched is not None: number_matched = page.number_matched
+      self.pages += 1
+      if page_progress is not None: page_progress(self.pages, results)
+
+      # An empty page is the last one, and so is the one that reaches numberMatched
+      if returned == 0 or (number_matched is not None and start_index + returned >= number_matched):
+        following.discard()
+        break
+
+      # A page the server cut short starts the next one sooner than was guessed
+      start_index += returned
+      if start_index != following_index:
+        following.discard()
+        following = PageDownload(self.page_url(start_index))
+      download = following
+
+    self.check_complete(results, number_matched)
+    return results.finish()
+
+  # Function to report a layer that has fewer features than the WFS says it has
+  def check_complete(self, results, number_matched):
+    if number_matched is None or results.number_of_elements >= number_matched: return
+    results.add_error("Only %s of the %s features the WFS reports were validated; the layer appears to have been cut short." % (results.number_of_elements, number_matched))
+
+  # Function to make a WfsGetFeature that validates a page, downloaded or not. Pages are
+  #   validated on several cores when they are big enough to be worth it.
+  def page_validator(self, doc):
+    page = WfsGetFeature(self.capabilities, self.feature_type, self.page_size)
+    page.url = self.url
+    page.doc = doc
+    return page
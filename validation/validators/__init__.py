@@ -1 +1 @@
-from wfs import validate_wfs_form
\ No newline at end of file
+from wfs import validate_wfs_form, validate_wfs_batch, wfs_batch, wfs_batch_report, wfs_job, wfs_job_status, wfs_job_result
@@ -0,0 +1,72 @@
+from django.conf import settings
+from contentmodels.schemacache import compile_schema
+from contentmodels.lru import LRUCache
+from validationresults import ValidationResults
+from lxml import etree
+import multiprocessing, sys, threading
+
+#--------------------------------------------------------------------------------------
+# Large FeatureCollections can be validated on several cores. The process reading the
+#   GetFeature response serializes features into chunks, and a pool of worker processes
+#   validates the chunks. The pool lives as long as the process that started it, and
+#   each worker compiles a schema the first time it is asked for it, then keeps it.
+#   VALIDATION_PROCESSES sets the size of the pool, by default the number of cores.
+#--------------------------------------------------------------------------------------
+def pool_size():
+  return getattr(settings, 'VALIDATION_PROCESSES', None) or multiprocessing.cpu_count()
+
+# Validations of at least this many features are run in parallel, when it's possible
+def parallel_threshold():
+  return getattr(settings, 'VALIDATION_PARALLEL_THRESHOLD', 1000)
+
+# Pool workers are daemonic processes, which may not start processes of their own, so a
+#   validation running in one can't use the pool. Queued jobs run in threads of the
+#   run_validation_jobs process instead, which owns the pool (see close_feature_pool).
+def can_use_pool():
+  return pool_size() > 1 and not multiprocessing.current_process().daemon
+
+def use_pool_for(number_of_features):
+  return can_use_pool() and number_of_features >= parallel_threshold()
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def feature_pool():
+  global _pool
+  with _pool_lock:
+    if _pool is None: _pool = multiprocessing.Pool(pool_size())
+    return _pool
+
+# Function to stop the pool's workers, once nothing is being validated any more
+def close_feature_pool():
+  global _pool
+  with _pool_lock:
+    if _pool is None: return
+    _pool.close()
+    _pool.join()
+    _pool = None
+
+#--------------------------------------------------------------------------------------
+# What follows runs in the pool's workers. Compiled schemas are keyed by the fingerprint
+#   of their XSD file (see contentmodels.schemacache), so an uploaded schema is compiled
+#   afresh.
+#--------------------------------------------------------------------------------------
+worker_schemas = LRUCache(getattr(settings, 'CONTENTMODELS_SCHEMA_CACHE_SIZE', 10))
+
+#--------------------------------------------------------------------------------------
+# Function to validate a chunk of (feature id, serialized feature) pairs
+#   Returns the serialized ValidationResults. Every group of errors is kept, whatever
+#   the limit, so that once the chunks are merged the groups kept are the ones that
+#   validating the features one after the other would have kept.
+#--------------------------------------------------------------------------------------
+def validate_chunk(path, fingerprint, chunk):
+  schema = worker_schemas.get(fingerprint)
+  if schema is None:
+    schema = compile_schema(path)
+    worker_schemas.set(fingerprint, schema)
+
+  results = ValidationResults(sys.maxint)
+  for id, serialized in chunk:
+    valid = schema.validate(etree.fromstring(serialized))
+    results.add(valid, schema.error_log, id)
+  return results.serialized()
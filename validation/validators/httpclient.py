@@ -0,0 +1,141 @@
+from django.conf import settings
+from urlparse import urlparse, urljoin
+import httplib, socket, threading
+
+# Statuses that send the client somewhere else, and how many times it will follow them
+REDIRECT_STATUSES = [301, 302, 303, 307, 308]
+MAX_REDIRECTS = 5
+
+#--------------------------------------------------------------------------------------
+# Exception raised when a URL cannot be retrieved. status is the HTTP status of the
+#   response, or None if no response was received at all.
+#--------------------------------------------------------------------------------------
+class HttpError(IOError):
+  def __init__(self, url, message, status=None):
+    IOError.__init__(self, '%s: %s' % (url, message))
+    self.url = url
+    self.status = status
+
+#--------------------------------------------------------------------------------------
+# Class for a small HTTP client that keeps connections open between requests. Idle
+#   connections are pooled by (scheme, host, port), at most max_idle of each, so that
+#   fetching the same WFS again doesn't open a new connection every time. Every socket
+#   operation gives up after timeout seconds, set by VALIDATION_HTTP_TIMEOUT.
+#--------------------------------------------------------------------------------------
+class HttpClient(object):
+  def __init__(self, timeout=None, max_idle=4):
+    self.timeout = timeout if timeout is not None else getattr(settings, 'VALIDATION_HTTP_TIMEOUT', 30)
+    self.max_idle = max_idle
+    self.idle = {}
+    self.lock = threading.Lock()
+
+  # Function to take an idle connection from the pool, or open a new one
+  #   Returns the connection, and whether it was reused
+  def connection(self, key):
+    with self.lock:
+      idle = self.idle.get(key, [])
+      if len(idle) > 0: return idle.pop(), True
+    scheme, host, port = key
+    if scheme == 'https': return httplib.HTTPSConnection(host, port, timeout=self.timeout), False
+    return httplib.HTTPConnection(host, port, timeout=self.timeout), False
+
+  # Function to put a connection back in the pool once its response has been read
+  def release(self, key, connection):
+    with self.lock:
+      idle = self.idle.setdefault(key, [])
+      if len(idle) < self.max_idle:
+        idle.append(connection)
+        return
+    connection.close()
+
+  def close(self):
+    with self.lock:
+      for idle in self.idle.values():
+        for connection in idle: connection.close()
+      self.idle = {}
+
+  #--------------------------------------------------------------------------------------
+  # Function to GET a URL, following redirects. Returns a PooledResponse, which can be
+  #   read like a file. Responses with an error status raise an HttpError; a 304 is
+  #   returned like any other response.
+  #--------------------------------------------------------------------------------------
+  def get(self, url, headers=None):
+    for redirect in range(MAX_REDIRECTS + 1):
+      response = self.request(url, headers or {})
+      location = response.getheader('location')
+      if response.status not in REDIRECT_STATUSES or location is None: break
+      response.read()
+      url = urljoin(url, location)
+    else:
+      raise HttpError(url, 'Too many redirects')
+
+    if response.status >= 400:
+      response.close()
+      raise HttpError(url, 'HTTP Error %s: %s' % (response.status, response.reason), response.status)
+
+    # A 304 has no body, so its connection can go back to the pool right away
+    if response.status == 304: response.read()
+    return response
+
+  # Function to send a single request. A pooled connection may have been closed by the
+  #   server while it was idle, in which case the request is sent again on a new one.
+  def request(self, url, headers):
+    parsed = urlparse(url)
+    if parsed.scheme not in ['http', 'https'] or not parsed.hostname:
+      raise HttpError(url, 'Not an HTTP URL')
+    key = (parsed.scheme, parsed.hostname, parsed.port)
+    path = (parsed.path or '/') + ('?%s' % parsed.query if parsed.query else '')
+
+    while True:
+      connection, reused = self.connection(key)
+      try:
+        connection.request('GET', path, headers=headers)
+        return PooledResponse(self, key, connection, connection.getresponse(), url)
+      except (httplib.HTTPException, socket.error), err:
+        connection.close()
+        if not reused: raise HttpError(url, str(err) or err.__class__.__name__)
+
+#--------------------------------------------------------------------------------------
+# Class for a response from the HttpClient. Its connection goes back to the pool as soon
+#   as the body has been read to the end, or is closed if the response is abandoned.
+#--------------------------------------------------------------------------------------
+class PooledResponse(object):
+  def __init__(self, client, key, connection, response, url):
+    self.client = client
+    self.key = key
+    self.connection = connection
+    self.response = response
+    self.url = url
+    self.status = response.status
+    self.reason = response.reason
+
+  def getheader(self, name, default=None):
+    return self.response.getheader(name, default)
+
+  def read(self, size=-1):
+    try:
+      data = self.response.read() if size < 0 else self.response.read(size)
+    except (httplib.HTTPException, socket.error), err:
+      self.close()
+      raise HttpError(self.url, str(err) or err.__class__.__name__)
+    if self.response.isclosed(): self.finish()
+    return data
+
+  # Function to hand the connection back, if the server will keep it open
+  def finish(self):
+    if self.connection is None: return
+    if self.response.will_close: self.connection.close()
+    else: self.client.release(self.key, self.connection)
+    self.connection = None
+
+  def close(self):
+    if self.connection is None: return
+    if self.response.isclosed():
+      self.finish()
+      return
+    self.response.close()
+    self.connection.close()
+    self.connection = None
+
+# The client shared by every validation in this process
+http_client = HttpClient()
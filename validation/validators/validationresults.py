@@ -0,0 +1,159 @@
+from collections import OrderedDict
+from lxml import etree
+import hashlib, json, re
+
+# The most groups of errors a result keeps, and the most feature ids kept for each group
+MAX_ERROR_GROUPS = 100
+FEATURE_ID_SAMPLE = 5
+
+# Positions in the paths lxml gives for errors, like the [2] in /aasg:Well/aasg:Name[2]
+position_pattern = re.compile(r'\[\d+\]')
+
+#--------------------------------------------------------------------------------------
+# Function to find an identifier for a feature: its gml:id, or its fid in WFS 1.0.
+#   Returns None if it has neither.
+#--------------------------------------------------------------------------------------
+def feature_id(element):
+  for name, value in element.attrib.items():
+    if name == 'fid' or (name.startswith('{http://www.opengis.net/gml') and name.endswith('}id')): return value
+  return None
+
+#--------------------------------------------------------------------------------------
+# Function to hash a feature's content, as exclusive canonical XML, so that a feature
+#   served again unchanged hashes the same whatever the response around it declares
+#--------------------------------------------------------------------------------------
+def feature_digest(element):
+  return hashlib.sha1(etree.tostring(element, method='c14n', exclusive=True, with_comments=False)).hexdigest()
+
+# Function to boil an lxml error log entry down to what errors are grouped by
+def error_key(error):
+  return (error.type_name, error.message, position_pattern.sub('', error.path or ''))
+
+#--------------------------------------------------------------------------------------
+# Class for errors that share a type, message and path, counting how often they were
+#   reported and remembering the first few features they were reported for
+#--------------------------------------------------------------------------------------
+class ErrorGroup(object):
+  def __init__(self, type, message, path):
+    self.type = type
+    self.message = message
+    self.path = path
+    self.count = 0
+    self.feature_ids = []
+
+  def add(self, count, feature_ids):
+    self.count += count
+    for id in feature_ids:
+      if len(self.feature_ids) >= FEATURE_ID_SAMPLE: break
+      if id is not None and id not in self.feature_ids: self.feature_ids.append(id)
+
+  def serialized(self):
+    return {
+      'type': self.type,
+      'message': self.message,
+      'path': self.path,
+      'count': self.count,
+      'feature_ids': self.feature_ids
+    }
+
+#--------------------------------------------------------------------------------------
+# Class to tally the validation of features. Only counts are kept, and errors grouped
+#   by (type, message, path), in the order they were first seen. At most max_groups
+#   groups are kept; errors that would start another group are only counted, as
+#   ungrouped_count. error_count is the total number of errors reported.
+#--------------------------------------------------------------------------------------
+class ValidationResults(object):
+  def __init__(self, max_groups=MAX_ERROR_GROUPS):
+    self.max_groups = max_groups
+    self.number_of_elements = 0
+    self.valid_elements = 0
+    self.error_count = 0
+    self.ungrouped_count = 0
+    self.groups = OrderedDict()
+    self.failed = False
+    self.incomplete = False
+
+  # Function to record the outcome of validating one feature, given lxml's error log
+  #   entries. Features without an id are identified by their position.
+  def add(self, valid, errors, id=None):
+    self.add_verdict(valid, [ error_key(error) for error in errors ], id)
+
+  # Function to record the outcome of validating one feature, given its errors as
+  #   (type, message, path) tuples, such as a verdict carried over from an earlier run
+  def add_verdict(self, valid, errors, id=None):
+    self.number_of_elements += 1
+    if valid: self.valid_elements += 1
+    if id is None: id = '#%s' % self.number_of_elements
+    for type, message, path in errors:
+      self.record(type, message, path, 1, [id])
+
+  # Function to record errors of one kind
+  def record(self, type, message, path, count=1, feature_ids=[]):
+    self.error_count += count
+    self.failed = True
+    key = (type, message, path)
+    group = self.groups.get(key)
+    if group is None:
+      if len(self.groups) >= self.max_groups:
+        self.ungrouped_count += count
+        return
+      group = self.groups[key] = ErrorGroup(type, message, path)
+    group.add(count, feature_ids)
+
+  # Function to record an error that isn't about any one feature, such as a response
+  #   that was cut short. The features validated may then not be all there were.
+  def add_error(self, message):
+    self.record('', message, '')
+    self.incomplete = True
+
+  # Function to add results from elsewhere, such as a chunk of features validated in
+  #   another process, given in their serialized form. A group's count only includes
+  #   what the other results kept in groups.
+  def merge(self, data):
+    self.number_of_elements += data['number_of_elements']
+    self.valid_elements += data['valid_elements']
+    for group in data['error_groups']:
+      self.record(group['type'], group['message'], group['path'], group['count'], group['feature_ids'])
+    if data['ungrouped_error_count'] > 0:
+      self.error_count += data['ungrouped_error_count']
+      self.ungrouped_count += data['ungrouped_error_count']
+      self.failed = True
+
+  # Function to call once every element has been validated
+  def finish(self):
+    # If no elements were validated, the result is not valid
+    if self.number_of_elements == 0 and not self.failed:
+      self.add_error("No elements were validated.")
+    return self
+
+  @property
+  def valid(self):
+    return not self.failed and self.valid_elements == self.number_of_elements
+
+  # The groups of errors, in the order they were first seen
+  @property
+  def errors(self):
+    return self.groups.values()
+
+  # Function to count the number of valid elements
+  def valid_count(self):
+    return self.valid_elements
+
+  # Function to count the number of invalid elements
+  def invalid_count(self):
+    return self.number_of_elements - self.valid_elements
+
+  # Function to boil the results down to plain data
+  def serialized(self):
+    return {
+      'valid': self.valid,
+      'number_of_elements': self.number_of_elements,
+      'valid_elements': self.valid_count(),
+      'invalid_elements': self.invalid_count(),
+      'error_count': self.error_count,
+      'ungrouped_error_count': self.ungrouped_count,
+      'error_groups': [ group.serialized() for group in self.groups.values() ]
+    }
+
+  def to_json(self):
+    return json.dumps(self.serialized())
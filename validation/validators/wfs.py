@@ -1,9 +1,15 @@
 from contentmodels.models import ContentModel, ModelVersion
+from validation.models import ValidationJob, ValidationBatch
 from WfsCapabilities import WfsCapabilities
-from WfsGetFeature import WfsGetFeature
+from WfsHarvest import feature_validator, ALL_FEATURES
 from django import forms
-from django.http import HttpResponseNotAllowed
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseNotAllowed, HttpResponseRedirect, Http404
+from django.middleware.csrf import CsrfViewMiddleware
 from django.shortcuts import render
+from django.utils.crypto import constant_time_compare
+from django.views.decorators.csrf import csrf_exempt
+import json
 
 #--------------------------------------------------------------------------------------
 # A Form to gather user's input: Just the WFS URL
@@ -29,6 +35,12 @@ class WfsSelectionForm(forms.Form):
     if len(capabilities.feature_types) is 0:
       raise forms.ValidationError('The WFS you specified does not provide any FeatureTypes')
     
+# The numbers of features that can be validated from a single GetFeature request
+NUMBER_OF_FEATURES_CHOICES = [ (1,1), (10,10), (50, 50) ]
+
+# Larger numbers, only offered when validations are queued as jobs
+JOB_NUMBER_OF_FEATURES_CHOICES = [ (1000, 1000), (10000, 10000) ]
+
 #--------------------------------------------------------------------------------------
 # A Form to gather user's input required to validate a WFS against some ModelVersion
 #   Note that the constructor for the form requires a URL
@@ -45,6 +57,12 @@ class WfsValidationParametersForm(forms.Form):
     # Set the initial URL
     self.fields['url'].initial = url
     
+    # Many features, or whole layers, can take a long time to validate, so they are only
+    #   offered, or accepted, as jobs
+    from validation.jobs import jobs_enabled
+    if jobs_enabled():
+      self.fields['number_of_features'].choices = NUMBER_OF_FEATURES_CHOICES + JOB_NUMBER_OF_FEATURES_CHOICES + [ (ALL_FEATURES, 'All') ]
+    
   # Define form fields
   url = forms.URLField(widget=forms.HiddenInput) 
   content_model = forms.ModelChoiceField(queryset=ContentModel.objects.all(),
@@ -56,17 +74,18 @@ class WfsValidationParametersForm(forms.Form):
   feature_type = forms.ChoiceField(choices=[],
     widget=forms.Select(attrs={'class':'span4'})
   )
-  number_of_features = forms.IntegerField(
-    widget=forms.Select(
-      attrs={'class':'span1'},
-      choices=((1,1), (10,10), (50, 50))
-    )
+  number_of_features = forms.TypedChoiceField(coerce=int,
+    choices=NUMBER_OF_FEATURES_CHOICES,
+    widget=forms.Select(attrs={'class':'span1'})
   )
 
 #--------------------------------------------------------------------------------------
 # Here is the actual view function for /validate/wfs
 #--------------------------------------------------------------------------------------
 def validate_wfs_form(req):
+  # validation.jobs imports this package's modules, so it is imported when it is used
+  from validation.jobs import jobs_enabled, submit_job
+
   # Insure that HTTP requests are of the proper type
   allowed = [ 'GET', 'POST' ] 
   if req.method not in allowed:
@@ -86,20 +105,19 @@ def validate_wfs_form(req):
         feature_type = form.cleaned_data['feature_type']
         number_of_features = form.cleaned_data['number_of_features']
         modelversion = form.cleaned_data['version']
-        get_feature_validator = WfsGetFeature(form.capabilities, feature_type, number_of_features)
-        result = get_feature_validator.validate(modelversion)
+        
+        # Queue the validation, and send the user to the job's page to wait for it
+        if jobs_enabled():
+          job = submit_job(form.cleaned_data['url'], feature_type, number_of_features, modelversion)
+          return HttpResponseRedirect(job.absolute_url())
+        
+        # Or validate while the user waits for this response. Web server processes don't
+        #   start a pool of their own to validate on several cores.
+        get_feature_validator = feature_validator(form.capabilities, feature_type, number_of_features)
+        result = get_feature_validator.validate(modelversion, parallel=False)
         
         # Setup hash table for results rendering
-        context = {
-            "valid": result.valid,
-            "valid_elements": result.valid_count(),
-            "url": get_feature_validator.url,
-            "errors": result.errors,
-            "modelversion": modelversion,
-            "feature_type": feature_type,
-            "number_of_features": number_of_features,
-            "wfs_base_url": get_feature_validator.url.split('?')[0]
-          }
+        context = results_context(result.serialized(), get_feature_validator.url, modelversion, feature_type, number_of_features)
         
         # Render the results as HTML
         return render(req, 'wfs-results-bootstrap.html', context)
@@ -120,4 +138,115 @@ def validate_wfs_form(req):
     form = WfsSelectionForm()
     
   # You'll get here if it was a GET request, or if form validation failed
-  return render(req, 'wfs-form-bootstrap.html', { 'form': form })
\ No newline at end of file
+  return render(req, 'wfs-form-bootstrap.html', { 'form': form })
+
+#--------------------------------------------------------------------------------------
+# Function to set up the hash table for rendering a validation result, given in the
+#   serialized form that ValidationJobs store
+#--------------------------------------------------------------------------------------
+def results_context(data, url, modelversion, feature_type, number_of_features, json_url=None):
+  return {
+      "valid": data['valid'],
+      "valid_elements": data['valid_elements'],
+      "url": url,
+      "errors": data['error_groups'],
+      "error_count": data['error_count'],
+      "ungrouped_error_count": data['ungrouped_error_count'],
+      "json_url": json_url,
+      "modelversion": modelversion,
+      "feature_type": feature_type,
+      "number_of_features": number_of_features,
+      "wfs_base_url": url.split('?')[0]
+    }
+
+def get_job(job_id):
+  try:
+    return ValidationJob.objects.select_related('modelversion').get(pk=job_id)
+  except ValidationJob.DoesNotExist:
+    raise Http404
+
+#--------------------------------------------------------------------------------------
+# View function for /validate/wfs/jobs/<id>: the results of a finished job, or a page
+#   that follows the job's progress until it finishes
+#--------------------------------------------------------------------------------------
+def wfs_job(req, job_id):
+  job = get_job(job_id)
+  if job.status == ValidationJob.DONE:
+    context = results_context(job.result_data(), job.get_feature_url, job.modelversion, job.feature_type, job.number_of_features, job.absolute_url() + '/result')
+    return render(req, 'wfs-results-bootstrap.html', context)
+  return render(req, 'wfs-job-bootstrap.html', { 'job': job })
+
+#--------------------------------------------------------------------------------------
+# View function for /validate/wfs/jobs/<id>/status: the job's progress, as JSON
+#--------------------------------------------------------------------------------------
+def wfs_job_status(req, job_id):
+  return HttpResponse(json.dumps(get_job(job_id).serialized()), mimetype='application/json')
+
+#--------------------------------------------------------------------------------------
+# View function for /validate/wfs/jobs/<id>/result: a finished job's results, as JSON
+#--------------------------------------------------------------------------------------
+def wfs_job_result(req, job_id):
+  job = get_job(job_id)
+  if job.status != ValidationJob.DONE: raise Http404
+  return HttpResponse(json.dumps(job.result_document()), mimetype='application/json')
+
+#--------------------------------------------------------------------------------------
+# Batches make requests to whatever URLs their manifest lists, so they can only be
+#   submitted and looked at by staff users, or with the token set as VALIDATION_API_TOKEN
+#   sent as "Authorization: Token <token>". Requests with the token don't need a CSRF
+#   token; those of logged in users do.
+#   Returns None if the request can go ahead, or the response that refuses it.
+#--------------------------------------------------------------------------------------
+def batch_access_denied(req):
+  token = getattr(settings, 'VALIDATION_API_TOKEN', None)
+  scheme, space, given = req.META.get('HTTP_AUTHORIZATION', '').partition(' ')
+  if token and scheme == 'Token' and constant_time_compare(given.strip(), token): return None
+  if not req.user.is_staff:
+    return HttpResponse(json.dumps({ 'error': 'A staff login or an API token is required' }), status=403, mimetype='application/json')
+  return CsrfViewMiddleware().process_view(req, None, (), {})
+
+#--------------------------------------------------------------------------------------
+# View function for /validate/wfs/batch: POST a JSON manifest (see validation.batch) to
+#   validate many FeatureTypes against many ModelVersions. The batch is queued for
+#   run_validation_jobs; the response, as JSON, gives its id and where to follow its
+#   progress and find its report.
+#--------------------------------------------------------------------------------------
+@csrf_exempt
+def validate_wfs_batch(req):
+  from validation.batch import submit_batch
+  if req.method != 'POST':
+    return HttpResponseNotAllowed([ 'POST' ])
+  denied = batch_access_denied(req)
+  if denied is not None: return denied
+
+  try:
+    batch = submit_batch(json.loads(req.body))
+  except ValueError, err:
+    # Both unreadable JSON and a ManifestError
+    return HttpResponse(json.dumps({ 'error': str(err) }), status=400, mimetype='application/json')
+
+  return HttpResponse(json.dumps(batch.serialized()), status=202, mimetype='application/json')
+
+def get_batch(batch_id):
+  try:
+    return ValidationBatch.objects.get(pk=batch_id)
+  except ValidationBatch.DoesNotExist:
+    raise Http404
+
+#--------------------------------------------------------------------------------------
+# View function for /validate/wfs/batches/<id>: the batch's progress, as JSON
+#--------------------------------------------------------------------------------------
+def wfs_batch(req, batch_id):
+  denied = batch_access_denied(req)
+  if denied is not None: return denied
+  return HttpResponse(json.dumps(get_batch(batch_id).serialized()), mimetype='application/json')
+
+#--------------------------------------------------------------------------------------
+# View function for /validate/wfs/batches/<id>/report: a finished batch's report, as JSON
+#--------------------------------------------------------------------------------------
+def wfs_batch_report(req, batch_id):
+  denied = batch_access_denied(req)
+  if denied is not None: return denied
+  batch = get_batch(batch_id)
+  if batch.status != ValidationBatch.DONE: raise Http404
+  return HttpResponse(batch.report, mimetype='application/json')